@@ -49,6 +49,8 @@ from api_config import (
 
 # Import SciPIP backend
 from app_pages.button_interface import Backend
+from utils.paper_client import PaperClient
+from utils.async_paper_client import AsyncPaperClient
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
@@ -70,6 +72,15 @@ async def lifespan(app: FastAPI):
         # Initialize backend
         backend = Backend()
         logger.info("✅ Backend initialized successfully")
+        try:
+            missing = PaperClient().schema.missing_schema()
+            if missing:
+                logger.warning(
+                    f"⚠️ Missing Neo4j constraints/indexes: {', '.join(missing)}, "
+                    "run `python src/paper_manager.py schema` to create them"
+                )
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to check Neo4j constraints/indexes: {e}")
         logger.info("🚀 SciPIP API Service started successfully!")
     except Exception as e:
         logger.error(f"❌ Failed to initialize service: {e}")
@@ -79,6 +90,8 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down SciPIP API Service...")
+    if AsyncPaperClient._initialized:
+        await AsyncPaperClient().close()
 
 
 # Initialize FastAPI app
@@ -183,7 +196,7 @@ async def generate_streaming_response(background: str) -> AsyncGenerator[str, No
         yield f"data: {json.dumps({'type': 'step_start', 'data': {'step': 'retrieve_literature', 'message': 'Retrieving related works...'}})}{newline}"
         
         try:
-            related_works, related_works_intact = backend.entities2literature_callback(expanded_background, entities_all)
+            related_works, related_works_intact = await backend.aentities2literature_callback(expanded_background, entities_all)
             yield f"data: {json.dumps({'type': 'step_complete', 'data': {'step': 'retrieve_literature', 'related_works': related_works, 'related_works_count': len(related_works_intact), 'message': f'Successfully retrieved {len(related_works_intact)} related papers'}})}{newline}"
         except Exception as e:
             logger.error(f"Literature retrieval error: {e}")
@@ -219,7 +232,7 @@ async def generate_streaming_response(background: str) -> AsyncGenerator[str, No
         yield f"data: {json.dumps({'type': 'error', 'data': {'message': f'Unexpected error: {str(e)}'}})}{newline}"
 
 
-def generate_non_streaming_response(background: str) -> Dict[str, Any]:
+async def generate_non_streaming_response(background: str) -> Dict[str, Any]:
     """
     Generate non-streaming response for idea generation.
     
@@ -253,7 +266,7 @@ def generate_non_streaming_response(background: str) -> Dict[str, Any]:
             entities_all = []
         
         # Step 5: Retrieve related works
-        related_works, related_works_intact = backend.entities2literature_callback(expanded_background, entities_all)
+        related_works, related_works_intact = await backend.aentities2literature_callback(expanded_background, entities_all)
         
         # Step 6: Generate ideas
         initial_ideas, final_ideas = backend.literature2initial_ideas_callback(background, brainstorms, related_works_intact)
@@ -327,7 +340,7 @@ async def generate_ideas(request: GenerateRequest):
             }
         )
     else:
-        return generate_non_streaming_response(request.background)
+        return await generate_non_streaming_response(request.background)
 
 
 @app.get("/")
@@ -0,0 +1,95 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : scripts
+
+File Name : benchmark_cluster.py
+
+Description : Benchmark of the retriever's threshold clustering on synthetic candidate
+    sets, checks parity with the former pure-Python UnionFind/can_merge implementation
+    on small inputs. Usage:
+    ```
+    python scripts/benchmark_cluster.py --sizes 100,500,1000,2000,5000
+    ```
+
+Creation Date : 2026-10-16
+"""
+import os
+import sys
+import time
+import click
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from utils.cluster import threshold_cluster
+
+
+def reference_cluster(similarity_matrix, threshold):
+    """The former O(n^3) UnionFind/can_merge clustering, used for parity checks
+    """
+    n = len(similarity_matrix)
+    parent = list(range(n))
+    rank = [1] * n
+
+    def find(x):
+        if parent[x] != x:
+            parent[x] = find(parent[x])
+        return parent[x]
+
+    def union(x, y):
+        root_x, root_y = find(x), find(y)
+        if root_x != root_y:
+            if rank[root_x] > rank[root_y]:
+                parent[root_y] = root_x
+            elif rank[root_x] < rank[root_y]:
+                parent[root_x] = root_y
+            else:
+                parent[root_y] = root_x
+                rank[root_x] += 1
+
+    def can_merge(i, j):
+        root_i, root_j = find(i), find(j)
+        for k in range(n):
+            if find(k) == root_i or find(k) == root_j:
+                if similarity_matrix[i][k] < threshold or similarity_matrix[j][k] < threshold:
+                    return False
+        return True
+
+    for i in range(n):
+        for j in range(i + 1, n):
+            if similarity_matrix[i][j] >= threshold and can_merge(i, j):
+                union(i, j)
+    return [find(i) for i in range(n)]
+
+
+def synthetic_similarity(n, dimension=64, topics=20, noise=0.35, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(topics, dimension))
+    embedding = centers[rng.integers(0, topics, n)] + noise * rng.normal(size=(n, dimension))
+    embedding /= np.linalg.norm(embedding, axis=1, keepdims=True)
+    return embedding @ embedding.T
+
+
+@click.command()
+@click.option("--sizes", default="100,500,1000,2000,5000", type=str, help="Candidate set sizes")
+@click.option("--threshold", default=0.95, type=float, help="RETRIEVE.similarity_threshold")
+@click.option("--parity-max", default=200, type=int, help="Check parity with the reference up to this size")
+def main(sizes, threshold, parity_max):
+    print(f"| {'n':>6} | {'clusters':>8} | {'vectorized (s)':>14} | {'reference (s)':>13} |")
+    print(f"|{'-' * 8}|{'-' * 10}|{'-' * 16}|{'-' * 15}|")
+    for n in [int(size) for size in sizes.split(",")]:
+        similarity_matrix = synthetic_similarity(n)
+        start = time.perf_counter()
+        labels = threshold_cluster(similarity_matrix, threshold)
+        elapsed = time.perf_counter() - start
+        reference_elapsed = "-"
+        if n <= parity_max:
+            start = time.perf_counter()
+            reference_labels = reference_cluster(similarity_matrix, threshold)
+            reference_elapsed = f"{time.perf_counter() - start:.4f}"
+            assert labels == reference_labels, f"labels differ from the reference at n={n}"
+        print(f"| {n:>6} | {len(set(labels)):>8} | {elapsed:>14.4f} | {reference_elapsed:>13} |")
+
+
+if __name__ == "__main__":
+    main()
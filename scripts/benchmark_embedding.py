@@ -0,0 +1,117 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : scripts
+
+File Name : benchmark_embedding.py
+
+Description : CPU encoding throughput of the embedding models, in one process (torch
+    intra-op threads on all cores) and sharded over the multi-process encoding pool with
+    pinned thread counts, see `utils.embedding_pool`. Reports texts per second and texts
+    per second per core, and checks the pooled vectors against the in-process ones. The
+    models are loaded from ./assets/model. Usage:
+    ```
+    python scripts/benchmark_embedding.py --workers 2,4,8 --num-texts 2048
+    ```
+
+Creation Date : 2026-10-16
+"""
+import os
+import sys
+import time
+import click
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+import torch
+from sentence_transformers import SentenceTransformer
+from utils.header import get_dir
+from utils.embedding_pool import EmbeddingPool
+
+MODELS = [
+    "sentence-transformers/all-MiniLM-L6-v2",
+    "BAAI/llm-embedder",
+    "jinaai/jina-embeddings-v3",
+]
+
+
+def synthetic_texts(n, seed=0):
+    """Abstract-like texts of 30 to 300 words, sorted by length as the backfill does
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = [
+        "model", "retrieval", "graph", "entity", "embedding", "language", "training", "data",
+        "neural", "attention", "paper", "scientific", "idea", "method", "results", "task",
+        "learning", "transformer", "benchmark", "evaluation", "propose", "novel", "large",
+    ]
+    texts = [
+        " ".join(rng.choice(vocabulary, size=rng.integers(30, 300)))
+        for _ in range(n)
+    ]
+    return sorted(texts, key=len, reverse=True)
+
+
+def load_model(model_name, task):
+    model = SentenceTransformer(
+        model_name_or_path=get_dir(f"./assets/model/{model_name}"),
+        device="cpu",
+        trust_remote_code=True,
+        local_files_only=True,
+    )
+    if task is not None:
+        model[0].default_task = task
+    return model
+
+
+@click.command()
+@click.option("--models", default=",".join(MODELS), type=str, help="Embedding models")
+@click.option("--workers", default="2,4", type=str, help="Pool sizes to benchmark")
+@click.option("--threads", default=0, type=int, help="Threads per worker, 0 to split the cores")
+@click.option("--num-texts", default=1024, type=int, help="Number of texts to encode")
+@click.option("--batch-size", default=32, type=int, help="Model batch size")
+@click.option("--chunk-size", default=64, type=int, help="Texts sent to a worker at once")
+@click.option("--task", default="text-matching", type=str, help="Task of jina-embeddings-v3")
+def main(models, workers, threads, num_texts, batch_size, chunk_size, task):
+    texts = synthetic_texts(num_texts)
+    cores = os.cpu_count() or 1
+    print(f"{num_texts} texts, {cores} cores")
+    print(f"| {'model':<40} | {'mode':<14} | {'cores':>5} | {'texts/s':>9} | {'texts/s/core':>12} | {'max |1-cos|':>11} |")
+    print(f"|{'-' * 42}|{'-' * 16}|{'-' * 7}|{'-' * 11}|{'-' * 14}|{'-' * 13}|")
+    for model_name in models.split(","):
+        model_task = task if "jina-embeddings-v3" in model_name else None
+        torch.set_num_threads(cores)
+        model = load_model(model_name, model_task)
+        model.encode(texts[:batch_size], batch_size=batch_size)
+        start = time.perf_counter()
+        reference = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+        elapsed = time.perf_counter() - start
+        print(
+            f"| {model_name:<40} | {'1 process':<14} | {cores:>5} | {num_texts / elapsed:>9.1f} "
+            f"| {num_texts / elapsed / cores:>12.2f} | {'-':>11} |"
+        )
+        del model
+        for worker_num in [int(worker) for worker in workers.split(",")]:
+            pool = EmbeddingPool(
+                get_dir(f"./assets/model/{model_name}"),
+                task=model_task,
+                workers=worker_num,
+                threads_per_worker=threads,
+                chunk_size=chunk_size,
+            )
+            # load the model in every worker before timing
+            pool.encode(texts[:chunk_size * worker_num], batch_size=batch_size)
+            start = time.perf_counter()
+            embeddings = pool.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+            elapsed = time.perf_counter() - start
+            pool.close()
+            used = worker_num * pool.threads_per_worker
+            drift = np.max(np.abs(1 - np.sum(embeddings * reference, axis=1)))
+            mode = f"{worker_num} x {pool.threads_per_worker} threads"
+            print(
+                f"| {model_name:<40} | {mode:<14} | {used:>5} | {num_texts / elapsed:>9.1f} "
+                f"| {num_texts / elapsed / used:>12.2f} | {drift:>11.2e} |"
+            )
+
+
+if __name__ == "__main__":
+    main()
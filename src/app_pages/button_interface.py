@@ -105,6 +105,15 @@ class Backend(object):
             res.append(f'{p["title"]}. {p["venue_name"].upper()} {p["year"]}.')
         return res, result["related_paper"]
 
+    async def aentities2literature_callback(self, expanded_background, entities):
+        result = await self.retriever_factory.aretrieve(
+            expanded_background, entities, need_evaluate=False, target_paper_id_list=[]
+        )
+        res = []
+        for i, p in enumerate(result["related_paper"]):
+            res.append(f'{p["title"]}. {p["venue_name"].upper()} {p["year"]}.')
+        return res, result["related_paper"]
+
     def literature2initial_ideas_callback(
         self, expanded_background, brainstorms, retrieved_literature
     ):
@@ -366,6 +366,12 @@ def main(ctx):
     required=False,
     help="The number of data you want to process",
 )
+@click.option(
+    "--retrieve-batch-size",
+    default=16,
+    type=int,
+    help="Number of backgrounds retrieved together through `retrieve_many`",
+)
 def new_idea(
     config_path,
     ids_path,
@@ -376,6 +382,7 @@ def new_idea(
     use_inspiration,
     expand_intermediate,
     num,
+    retrieve_batch_size,
     **kwargs,
 ):
     check_env()
@@ -407,6 +414,10 @@ def new_idea(
                 eval_data = []
     logger.debug(f"{cur_num} datas have been processed.")
     all_input = json.load(ids_path)
+    rt = RetrieverFactory.get_retriever_factory().create_retriever(
+        retriever_name, config
+    )
+    samples = []
     for line in all_input:
         # 解析每行的JSON数据
         # data = json.loads(line)
@@ -422,87 +433,104 @@ def new_idea(
             data_num += 1
             print(f"Skipping already processed data_{data_num}.")
             continue
-        
-        ## extract entities from background
-        entities = api_helper.generate_entity_list(bg)
+        samples.append(bg)
+        if cur_num + len(samples) >= num:
+            break
+    for start in range(0, len(samples), retrieve_batch_size):
+        batch = []
+        for bg in samples[start : start + retrieve_batch_size]:
+            ## extract entities from background
+            entities = api_helper.generate_entity_list(bg)
 
-        ## expand background to a detailed version
-        keywords_str = functools.reduce(lambda x, y: f"{x}, {y}", entities)
-        expanded_background = api_helper.expand_background(bg, keywords_str)
+            ## expand background to a detailed version
+            keywords_str = functools.reduce(lambda x, y: f"{x}, {y}", entities)
+            expanded_background = api_helper.expand_background(bg, keywords_str)
 
-        ## brainstorm according to the background
-        if brainstorm_mode == "mode_b" or brainstorm_mode == "mode_c":
-            brainstorm = api_helper.generate_brainstorm(expanded_background)
-            seperate_brainstorm = extract_ideas(brainstorm)
-            ## expand the brainstorms to a detailed version
+            ## brainstorm according to the background
+            seperate_brainstorm = None
             expanded_brainstorms = []
-            if expand_intermediate:
-                for i, sb in enumerate(seperate_brainstorm):
-                    expanded_brainstorms.append(api_helper.expand_idea(expanded_background, sb))
-                    logger.info(f"Expand the {i}th brainstorm succeed")
-        else:
-            brainstorm = None
-        
-        ## Extract entities from the brainstorm result
-        logger.debug("Original entities from background: {}".format(entities))
-        if brainstorm_mode == "mode_c":
-            entities_bs = api_helper.generate_entity_list(brainstorm, 10)
-            logger.debug("Original entities from brainstorm: {}".format(entities_bs))
-            entities_all = list(set(entities) | set(entities_bs))
-        else:
-            entities_bs = None
-            entities_all = entities
+            if brainstorm_mode == "mode_b" or brainstorm_mode == "mode_c":
+                brainstorm = api_helper.generate_brainstorm(expanded_background)
+                seperate_brainstorm = extract_ideas(brainstorm)
+                ## expand the brainstorms to a detailed version
+                if expand_intermediate:
+                    for i, sb in enumerate(seperate_brainstorm):
+                        expanded_brainstorms.append(api_helper.expand_idea(expanded_background, sb))
+                        logger.info(f"Expand the {i}th brainstorm succeed")
+            else:
+                brainstorm = None
 
-        ### 2. 检索相关论文
-        rt = RetrieverFactory.get_retriever_factory().create_retriever(
-            retriever_name, config
-        )
-        result = rt.retrieve(
-            expanded_background, entities_all, need_evaluate=False, target_paper_id_list=[]
-        )
-        related_paper = result["related_paper"]
-        logger.info("Find {} related papers...".format(len(related_paper)))
-        entities_rt = result["entities"]
-        for paper in related_paper:
-            if not ("detail_method" in paper):
-                paper["detail_method"] = api_helper.generate_concise_method(paper["methodology"])
-                if isinstance(paper["detail_method"], str):
-                    paper_client.insert_new_field(paper["hash_id"], "detail_method", paper["detail_method"])
-                    logger.info(f"Add new field detail method to paper: {paper['hash_id']} succeed")
-        logger.info("Generate detail methods for all related papers succeed")
+            ## Extract entities from the brainstorm result
+            logger.debug("Original entities from background: {}".format(entities))
+            if brainstorm_mode == "mode_c":
+                entities_bs = api_helper.generate_entity_list(brainstorm, 10)
+                logger.debug("Original entities from brainstorm: {}".format(entities_bs))
+                entities_all = list(set(entities) | set(entities_bs))
+            else:
+                entities_bs = None
+                entities_all = entities
+            batch.append(
+                {
+                    "background": bg,
+                    "expanded_background": expanded_background,
+                    "entities_bg": entities,
+                    "brainstorm": brainstorm,
+                    "seperate_brainstorm": seperate_brainstorm,
+                    "entities_bs": entities_bs,
+                    "entities_all": entities_all,
+                    "expanded_brainstorms": expanded_brainstorms,
+                }
+            )
 
-        ### 3. 生成IDEA
-        idea_generator = IdeaGenerator(config, related_paper, brainstorm)
-        _, _, inspirations, initial_ideas, idea_filtered, final_ideas = idea_generator.generate_ins_bs(expanded_background)
-        expanded_initial_ideas = []
-        if expand_intermediate:
-            for i, initial_idea in enumerate(initial_ideas):
-                expanded_initial_ideas.append(api_helper.expand_idea(expanded_background, initial_idea))
-                logger.info(f"Expand the {i}th initial idea succeed")
-        eval_data.append(
-            {
-                "background": bg,
-                "expanded_background": expanded_background,
-                "entities_bg": entities,
-                "brainstorm": brainstorm,
-                "seperate_brainstorm": seperate_brainstorm,
-                "entities_bs": entities_bs,
-                "entities_rt": entities_rt,
-                "related_paper": [p["title"] for p in related_paper],
-                "inspirations": inspirations,
-                "initial_ideas": initial_ideas,
-                "filtered_ideas": idea_filtered,
-                "expanded_final_ideas": final_ideas,
-                "expanded_brainstorms": expanded_brainstorms,
-                "expanded_initial_ideas": expanded_initial_ideas,
-            }
+        ### 2. 检索相关论文 (整批一次检索)
+        results = rt.retrieve_many(
+            [sample["expanded_background"] for sample in batch],
+            [sample["entities_all"] for sample in batch],
+            need_evaluate=False,
         )
-        cur_num += 1
-        if cur_num % batch_size == 0:
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(eval_data, f, ensure_ascii=False, indent=4)
-        if cur_num >= num:
-            break
+        for sample, result in zip(batch, results):
+            expanded_background = sample["expanded_background"]
+            related_paper = result["related_paper"]
+            logger.info("Find {} related papers...".format(len(related_paper)))
+            entities_rt = result["entities"]
+            for paper in related_paper:
+                if not ("detail_method" in paper):
+                    paper["detail_method"] = api_helper.generate_concise_method(paper["methodology"])
+                    if isinstance(paper["detail_method"], str):
+                        paper_client.insert_new_field(paper["hash_id"], "detail_method", paper["detail_method"])
+                        logger.info(f"Add new field detail method to paper: {paper['hash_id']} succeed")
+            logger.info("Generate detail methods for all related papers succeed")
+
+            ### 3. 生成IDEA
+            idea_generator = IdeaGenerator(config, related_paper, sample["brainstorm"])
+            _, _, inspirations, initial_ideas, idea_filtered, final_ideas = idea_generator.generate_ins_bs(expanded_background)
+            expanded_initial_ideas = []
+            if expand_intermediate:
+                for i, initial_idea in enumerate(initial_ideas):
+                    expanded_initial_ideas.append(api_helper.expand_idea(expanded_background, initial_idea))
+                    logger.info(f"Expand the {i}th initial idea succeed")
+            eval_data.append(
+                {
+                    "background": sample["background"],
+                    "expanded_background": expanded_background,
+                    "entities_bg": sample["entities_bg"],
+                    "brainstorm": sample["brainstorm"],
+                    "seperate_brainstorm": sample["seperate_brainstorm"],
+                    "entities_bs": sample["entities_bs"],
+                    "entities_rt": entities_rt,
+                    "related_paper": [p["title"] for p in related_paper],
+                    "inspirations": inspirations,
+                    "initial_ideas": initial_ideas,
+                    "filtered_ideas": idea_filtered,
+                    "expanded_final_ideas": final_ideas,
+                    "expanded_brainstorms": sample["expanded_brainstorms"],
+                    "expanded_initial_ideas": expanded_initial_ideas,
+                }
+            )
+            cur_num += 1
+            if cur_num % batch_size == 0:
+                with open(output_file, "w", encoding="utf-8") as f:
+                    json.dump(eval_data, f, ensure_ascii=False, indent=4)
     logger.info("=== Finish ===")
     with open(output_file, "w", encoding="utf-8") as f:
         json.dump(eval_data, f, ensure_ascii=False, indent=4)
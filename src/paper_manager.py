@@ -1,6 +1,7 @@
 import os
 import json
 import re
+import numpy as np
 from tqdm import tqdm
 import torch
 from utils.paper_crawling import PaperCrawling
@@ -10,6 +11,15 @@ from collections import defaultdict
 from utils.header import get_dir, ConfigReader
 from utils.llms_api import APIHelper
 from utils.paper_retriever import Retriever
+from utils.vector_index import VectorIndexManager
+from utils.embedding_store import EmbeddingStoreManager
+from utils.entity_index import EntityIndex, load_or_build_entity_index
+from utils.entity_graph import load_or_build_entity_graph
+from utils.disk_embedding_cache import get_disk_embedding_cache
+from utils.embedding_pool import get_embedding_pool
+from utils.embedding_backfill import EmbeddingBackfill
+from utils.onnx_embedding import cache_model_name, cosine_drift
+from utils.embedding_postfix import embedding_postfix
 from utils import scipdf
 import click
 from collections import Counter
@@ -175,6 +185,15 @@ class PaperManager:
         self.year = year
         self.data_type = "train"
         self.paper_client = PaperClient()
+        self.paper_client.fetch_size = config.DEFAULT.get("neo4j_fetch_size", 1000)
+        self.paper_client.write_batch_size = config.DEFAULT.get("neo4j_write_batch_size", 500)
+        # papers, entity links and citations waiting for a batched write, see `flush`
+        self.paper_buffer = []
+        self.entity_buffer = []
+        self.citation_buffer = []
+        # the entity index snapshot, loaded when new entity links are flushed
+        self.entity_index = None
+        self.entity_index_changed = False
         self.paper_crawling = PaperCrawling(config, data_type=self.data_type)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.embedding_model = get_embedding_model(config)
@@ -203,11 +222,21 @@ class PaperManager:
             except:
                 self.ignore_paper_pdf_url = []
 
-    def create_vector_index(self):
-        index_exists = self.paper_client.check_index_exists()
-        if not index_exists:
-            print("Create vector index paper-embeddings")
-            self.paper_client.create_vector_index()
+    def create_vector_index(self, to="all"):
+        """Create a neo4j vector index for abstract, background, contribution, and summary
+        embeddings of the configured embedding model, with the dimension of the model
+        """
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        if dimension is None:
+            dimension = len(self.embedding_model.encode("dimension"))
+        for name in ["abstract", "background", "contribution", "summary"]:
+            if to == "all" or to == name:
+                type_name = f"{name}_embedding{self.retriever.embedding_postfix}"
+                if self.paper_client.check_index_exists(type_name):
+                    logger.info(f"vector index of {type_name} exists, skip")
+                    continue
+                logger.info(f"Create vector index of {type_name} ({dimension} dimensions)")
+                self.paper_client.create_vector_index(type_name, dimension)
 
     def clean_entity(self, entity):
         """The extracted entities may be noisy, remove all noisy characters
@@ -251,6 +280,72 @@ class PaperManager:
                 return False
         return True
 
+    def buffer_paper(self, paper):
+        self.paper_buffer.append(paper)
+        if len(self.paper_buffer) >= self.paper_client.write_batch_size:
+            self.flush_papers()
+
+    def buffer_entities(self, hash_id, entities):
+        self.entity_buffer.append((hash_id, entities))
+        if len(self.entity_buffer) >= self.paper_client.write_batch_size:
+            self.flush_entities()
+
+    def buffer_citation(self, paper):
+        self.citation_buffer.append(paper)
+        if len(self.citation_buffer) >= self.paper_client.write_batch_size:
+            self.flush_citations()
+
+    def flush_papers(self):
+        if self.paper_buffer:
+            self.paper_client.add_paper_nodes(self.paper_buffer)
+            self.paper_buffer = []
+
+    def flush_entities(self):
+        # entities are linked to existing papers only, write the buffered papers first
+        self.flush_papers()
+        if self.entity_buffer:
+            self.paper_client.add_entity_nodes(self.entity_buffer)
+            self.refresh_entity_index(self.entity_buffer)
+            self.entity_buffer = []
+
+    def flush_citations(self):
+        if self.citation_buffer:
+            self.paper_client.add_paper_citations(self.citation_buffer)
+            self.citation_buffer = []
+
+    def flush(self):
+        """Write all buffered papers, entity links and citations
+        """
+        self.flush_papers()
+        self.flush_entities()
+        self.flush_citations()
+        if self.entity_index_changed:
+            self.entity_index.save(self.entity_index_path())
+            self.entity_index_changed = False
+            logger.info(f"save entity index ({len(self.entity_index)} entities)")
+
+    def entity_index_path(self):
+        index_dir = get_dir(self.config.DEFAULT.get("index_dir", "./assets/index"))
+        return os.path.join(index_dir, "entity")
+
+    def refresh_entity_index(self, paper_entities):
+        """Add new RELATED_TO edges to the entity index snapshot (and its co-occurrence
+        table), if the snapshot has been built. It is saved by `flush`
+        Args:
+            paper_entities (List of (hash_id, List of entities))
+        """
+        if self.entity_index is None:
+            if not EntityIndex.exists(self.entity_index_path()):
+                return
+            self.entity_index = EntityIndex.load(self.entity_index_path())
+        added = self.entity_index.add_edges(
+            (entity_name, hash_id)
+            for hash_id, entities in paper_entities
+            for entity_name in entities
+        )
+        if added > 0:
+            self.entity_index_changed = True
+
     def update_paper(
         self,
         paper,
@@ -336,7 +431,7 @@ class PaperManager:
 
         # insert paper in database
         if self.check_parse(paper):
-            self.paper_client.add_paper_node(paper)
+            self.buffer_paper(paper)
         else:
             return
 
@@ -352,7 +447,7 @@ class PaperManager:
             entities = self.api_helper.generate_entity_list(paper["abstract"])
             logger.info("hash_id {}, Entities: {}".format(paper["hash_id"], entities))
             if entities is not None:
-                self.paper_client.add_entity_node(paper["hash_id"], entities)
+                self.buffer_entities(paper["hash_id"], entities)
             else:
                 logger.warning(
                     "hash_id: {}, pdf_url: {} entities None...".format(
@@ -482,6 +577,28 @@ class PaperManager:
         need_summary=False,
         need_get_entities=False,
         need_ground_truth=False,
+    ):
+        """Update the papers of the paper list json files, papers and entities are written
+        in batches
+        """
+        try:
+            self.update_paper_list_from_json(
+                need_download=need_download,
+                need_parse=need_parse,
+                need_summary=need_summary,
+                need_get_entities=need_get_entities,
+                need_ground_truth=need_ground_truth,
+            )
+        finally:
+            self.flush()
+
+    def update_paper_list_from_json(
+        self,
+        need_download=True,
+        need_parse=False,
+        need_summary=False,
+        need_get_entities=False,
+        need_ground_truth=False,
     ):
         if self.year != "all":
             logger.info(
@@ -598,49 +715,54 @@ class PaperManager:
             year_list = self.year_list
         for year in year_list:
             paper_list = self.paper_client.select_paper(self.venue_name, year)
-            for paper in tqdm(paper_list):
-                if (
-                    self.check_parse(paper)
-                    and len(paper["reference"]) > 0
-                    and "motivation" in paper.keys()
-                    and paper["motivation"] is not None
-                ):
-                    paper["cite_id_list"] = [
-                        generate_hash_id(ref_title)
-                        for ref_title in paper["reference_filter"]
-                    ]
-                    paper["cite_id_list"] = self.paper_client.filter_paper_id_list(
-                        paper["cite_id_list"], year=year
-                    )
-                    paper["all_cite_id_list"] = [
-                        generate_hash_id(ref_title) for ref_title in paper["reference"]
-                    ]
-                    paper["all_cite_id_list"] = self.paper_client.filter_paper_id_list(
-                        paper["all_cite_id_list"], year=year
-                    )
-                    if "entities" not in paper.keys() or len(paper["entities"]) < 3:
-                        paper["entities"] = self.api_helper.generate_entity_list(
-                            paper["abstract"]
+            # the buffered citations (and LLM-generated entities) are written even if a
+            # paper fails
+            try:
+                for paper in tqdm(paper_list):
+                    if (
+                        self.check_parse(paper)
+                        and len(paper["reference"]) > 0
+                        and "motivation" in paper.keys()
+                        and paper["motivation"] is not None
+                    ):
+                        paper["cite_id_list"] = [
+                            generate_hash_id(ref_title)
+                            for ref_title in paper["reference_filter"]
+                        ]
+                        paper["cite_id_list"] = self.paper_client.filter_paper_id_list(
+                            paper["cite_id_list"], year=year
                         )
-                        logger.debug(
-                            "get entity from context: {}".format(paper["entities"])
+                        paper["all_cite_id_list"] = [
+                            generate_hash_id(ref_title) for ref_title in paper["reference"]
+                        ]
+                        paper["all_cite_id_list"] = self.paper_client.filter_paper_id_list(
+                            paper["all_cite_id_list"], year=year
                         )
-                    logger.debug(
-                        "paper hash_id {}, cite_id_list {}, all_cite_id_list {}".format(
-                            paper["hash_id"],
-                            paper["cite_id_list"],
-                            paper["all_cite_id_list"],
+                        if "entities" not in paper.keys() or len(paper["entities"]) < 3:
+                            paper["entities"] = self.api_helper.generate_entity_list(
+                                paper["abstract"]
+                            )
+                            logger.debug(
+                                "get entity from context: {}".format(paper["entities"])
+                            )
+                        logger.debug(
+                            "paper hash_id {}, cite_id_list {}, all_cite_id_list {}".format(
+                                paper["hash_id"],
+                                paper["cite_id_list"],
+                                paper["all_cite_id_list"],
+                            )
                         )
-                    )
-                else:
-                    paper["cite_id_list"] = []
-                    paper["all_cite_id_list"] = []
-                if (
-                    "entities" in paper.keys()
-                    and "cite_id_list" in paper.keys()
-                    and "all_cite_id_list" in paper.keys()
-                ):
-                    self.paper_client.add_paper_citation(paper)
+                    else:
+                        paper["cite_id_list"] = []
+                        paper["all_cite_id_list"] = []
+                    if (
+                        "entities" in paper.keys()
+                        and "cite_id_list" in paper.keys()
+                        and "all_cite_id_list" in paper.keys()
+                    ):
+                        self.buffer_citation(paper)
+            finally:
+                self.flush_citations()
 
     def insert_entity_combinations(self):
         if self.year != "all":
@@ -658,43 +780,126 @@ class PaperManager:
         # )
         # self.paper_client.add_paper_summary_embedding(self.embedding_model, hash_id)
 
-    def add_new_embedding(self, hash_id=None, to="all"):
-        """add new embeddings for abstract, background, contribution, and summary
+    def new_embedding_postfix(self):
+        """postfix of the embedding properties written by the configured model and task
+        """
+        return embedding_postfix(self.config.DEFAULT.embedding, self.config.DEFAULT.embedding_task)
+
+    def add_new_embedding(self, hash_id=None, to="all", only_missing=False):
+        """add new embeddings for abstract, background, contribution, and summary. An
+        interrupted run resumes from the checkpoints in `DEFAULT.embedding_checkpoint_dir`
+        Args:
+            only_missing (bool): skip papers which already have the embedding
         """
-        postfix_set = {
-            "sentence-transformers/all-MiniLM-L6-v2": "",
-            "BAAI/llm-embedder": "_llm_embedder",
-            "jina/jina-embeddings-v3": "_jina_v3"
-        }
-        postfix = postfix_set[self.config.DEFAULT.embedding]
+        postfix = self.new_embedding_postfix()
+        checkpoint_dir = get_dir(
+            self.config.DEFAULT.get("embedding_checkpoint_dir", "./assets/index/backfill")
+        )
+        task = None
         if "jina" in postfix:
-            if self.config.DEFAULT.embedding_task == "text-matching":
-                postfix += "_text_matching"
-            elif self.config.DEFAULT.embedding_task == "retrieval.query":
-                postfix += "_query"
-            elif self.config.DEFAULT.embedding_task == "retrieval.passage":
-                postfix += "_passage"
-            else:
-                assert False
+            task = self.config.DEFAULT.embedding_task
+        cache = dict(
+            embedding_cache=get_disk_embedding_cache(self.config),
+            cache_scope=(
+                cache_model_name(self.config.DEFAULT.embedding, self.embedding_model), task, postfix
+            ),
+        )
+        # large batches are sharded over the cpu encoding pool if configured
+        embedding_model = get_embedding_pool(self.config, self.embedding_model) or self.embedding_model
+        if to == "all" and hash_id is None:
+            # one pass over the papers for all four fields
+            self.paper_client.update_paper_embeddings(
+                embedding_model, postfix=postfix,
+                only_missing=only_missing, checkpoint_dir=checkpoint_dir, **cache,
+            )
+            return
         if to == "all" or to == "abstract":
             self.paper_client.update_paper_embedding(
-                self.embedding_model, hash_id,
-                name="abstract", postfix=postfix
+                embedding_model, hash_id,
+                name="abstract", postfix=postfix,
+                only_missing=only_missing, checkpoint_dir=checkpoint_dir, **cache,
             )
         if to == "all" or to == "background":
             self.paper_client.update_paper_embedding(
-                self.embedding_model, hash_id,
-                name="background", postfix=postfix
+                embedding_model, hash_id,
+                name="background", postfix=postfix,
+                only_missing=only_missing, checkpoint_dir=checkpoint_dir, **cache,
             )
         if to == "all" or to == "contribution":
             self.paper_client.update_paper_embedding(
-                self.embedding_model, hash_id,
-                name="contribution", postfix=postfix
+                embedding_model, hash_id,
+                name="contribution", postfix=postfix,
+                only_missing=only_missing, checkpoint_dir=checkpoint_dir, **cache,
             )
         if to == "all" or to == "summary":
             self.paper_client.update_paper_embedding(
-                self.embedding_model, hash_id,
-                name="summary", postfix=postfix
+                embedding_model, hash_id,
+                name="summary", postfix=postfix,
+                only_missing=only_missing, checkpoint_dir=checkpoint_dir, **cache,
+            )
+
+    def check_embedding_parity(self, name="background", sample=256):
+        """Encode the `name` field of `sample` papers with the configured embedding backend
+        (see `DEFAULT.embedding_backend`) and compare with the vectors stored in the database
+        Returns:
+            drift (np.ndarray): 1 - cosine similarity of each paper with a stored vector
+        """
+        embedding_name = f"{name}_embedding{self.new_embedding_postfix()}"
+        backfill = EmbeddingBackfill(
+            self.paper_client, self.embedding_model, [(name, embedding_name, name == "abstract")],
+            batch_size=sample, device=self.device,
+        )
+        records = backfill.read_page(EmbeddingBackfill.START_KEY)
+        props = backfill.encode(records)
+        stored = self.paper_client.get_papers_embeddings(
+            [record["hash_id"] for record in records], [embedding_name]
+        )[:, 0]
+        encoded = np.asarray(
+            [paper_props.get(embedding_name, np.zeros(stored.shape[1])) for paper_props in props],
+            dtype=np.float32,
+        )
+        keep = np.any(stored != 0, axis=1) & np.any(encoded != 0, axis=1)
+        if not keep.any():
+            return np.zeros(0, dtype=np.float32)
+        drift = cosine_drift(encoded[keep], stored[keep])
+        logger.info(
+            f"{type(self.embedding_model).__name__} vs stored {embedding_name}: {len(drift)} "
+            f"papers, max drift {drift.max():.2e}, mean drift {drift.mean():.2e}"
+        )
+        return drift
+
+    def build_index(self, to="all"):
+        """build in-process ANN indexes and memory-mapped embedding stores for abstract,
+        background, contribution, and summary embeddings of the configured embedding model,
+        the co-cite index, the entity inverted index and the CONNECT entity graph
+        """
+        index_dir = get_dir(self.config.DEFAULT.get("index_dir", "./assets/index"))
+        index_manager = VectorIndexManager(index_dir)
+        store_manager = EmbeddingStoreManager(index_dir)
+        for name in ["abstract", "background", "contribution", "summary"]:
+            if to == "all" or to == name:
+                type_name = f"{name}_embedding{self.retriever.embedding_postfix}"
+                ids, vectors = self.paper_client.get_all_paper_embeddings(type_name)
+                if len(ids) == 0:
+                    logger.warning(f"no paper has {type_name}, skip")
+                    continue
+                index_manager.build(
+                    type_name, ids, vectors,
+                    nlist=self.config.RETRIEVE.get("ann_nlist", 0),
+                )
+                store_manager.build(type_name, ids, vectors)
+        if to == "all" or to == "cocite":
+            self.retriever.cocite.build(rebuild=True)
+        if to == "all" or to == "entity":
+            load_or_build_entity_index(
+                os.path.join(index_dir, "entity"),
+                self.paper_client.get_entity_paper_edges,
+                rebuild=True,
+            )
+            load_or_build_entity_graph(
+                os.path.join(index_dir, "entity_graph"),
+                self.paper_client.get_entity_connections,
+                rebuild=True,
             )
 
     def cosine_similarity_search(self, data_type, context, k=1):
@@ -951,12 +1156,118 @@ def embedding(config_path):
     required=True,
     help="Dataset configuration file in YAML",
 )
-def add_new_embedding(config_path):
-    """Insert another new embedding for papers in the database
+@click.option(
+    "--to",
+    default="all",
+    type=click.Choice(["all", "abstract", "background", "contribution", "summary"]),
+    help="Which embedding field to add",
+)
+@click.option(
+    "--only-missing",
+    is_flag=True,
+    help="Only embed papers which do not have the embedding yet",
+)
+def add_new_embedding(config_path, to, only_missing):
+    """Insert another new embedding for papers in the database, an interrupted run resumes
+    where it stopped
+    """
+    # Configuration
+    config = ConfigReader.load(config_path)
+    PaperManager(config).add_new_embedding(to=to, only_missing=only_missing)
+
+@main.command()
+@click.option(
+    "-c",
+    "--config-path",
+    default=get_dir("./configs/datasets.yaml"),
+    type=click.File(),
+    required=True,
+    help="Dataset configuration file in YAML",
+)
+@click.option(
+    "--to",
+    default="background",
+    type=click.Choice(["abstract", "background", "contribution", "summary"]),
+    help="Which embedding field to compare",
+)
+@click.option(
+    "--sample",
+    default=256,
+    type=int,
+    help="Number of papers to compare",
+)
+def check_embedding_parity(config_path, to, sample):
+    """Compare the vectors of the configured embedding backend (DEFAULT.embedding_backend)
+    with the ones stored in the database, fail above DEFAULT.embedding_parity_max_drift
+    """
+    # Configuration
+    config = ConfigReader.load(config_path)
+    drift = PaperManager(config).check_embedding_parity(name=to, sample=sample)
+    max_drift = float(config.DEFAULT.get("embedding_parity_max_drift", 0.01))
+    if len(drift) == 0:
+        raise click.ClickException(f"no stored {to} embeddings to compare with")
+    if drift.max() > max_drift:
+        raise click.ClickException(f"max cosine drift {drift.max():.2e} > {max_drift:.2e}")
+
+@main.command()
+@click.option(
+    "-c",
+    "--config-path",
+    default=get_dir("./configs/datasets.yaml"),
+    type=click.File(),
+    required=True,
+    help="Dataset configuration file in YAML",
+)
+@click.option(
+    "--to",
+    default="all",
+    type=click.Choice(["all", "abstract", "background", "contribution", "summary", "cocite", "entity"]),
+    help="Which index to build, an embedding field, the co-cite index or the entity index",
+)
+def build_index(config_path, to):
+    """Build the in-process ANN indexes and embedding stores used by the retrievers
+    """
+    # Configuration
+    config = ConfigReader.load(config_path)
+    PaperManager(config).build_index(to=to)
+
+@main.command()
+@click.option(
+    "--check",
+    is_flag=True,
+    help="Only report the missing constraints and indexes, do not create them",
+)
+def schema(check):
+    """Create and verify the uniqueness constraints of Paper.hash_id and Entity.name and the
+    range index of Paper(venue_name, year)
+    """
+    schema_manager = PaperClient().schema
+    missing = schema_manager.missing_schema() if check else schema_manager.create_schema()
+    if missing:
+        raise click.ClickException(f"missing constraints/indexes: {', '.join(missing)}")
+    logger.info("all constraints and indexes exist")
+
+@main.command()
+@click.option(
+    "-c",
+    "--config-path",
+    default=get_dir("./configs/datasets.yaml"),
+    type=click.File(),
+    required=True,
+    help="Dataset configuration file in YAML",
+)
+@click.option(
+    "--to",
+    default="all",
+    type=click.Choice(["all", "abstract", "background", "contribution", "summary"]),
+    help="Which embedding field to index",
+)
+def vector_index(config_path, to):
+    """Create the neo4j vector indexes of the embeddings used by the retrievers
     """
     # Configuration
     config = ConfigReader.load(config_path)
-    PaperManager(config).add_new_embedding(to="all")
+    PaperManager(config).create_vector_index(to=to)
 
 @main.command()
 @click.option(
@@ -41,9 +41,15 @@ def main(ctx):
     required=True,
     help="Dataset configuration file in YAML",
 )
+@click.option(
+    "--batch-size",
+    default=16,
+    type=int,
+    help="Number of papers retrieved together through `retrieve_many`",
+)
 @click.pass_context
 def retrieve(ctx,
-    config_path, ids_path
+    config_path, ids_path, batch_size
 ): 
     initial_kwargs={ctx.args[i][2:]: ctx.args[i+1] for i in range(0, len(ctx.args), 2)}
     kwargs = {"RETRIEVE": {}, "DEFAULT": {}}
@@ -92,6 +98,7 @@ def retrieve(ctx,
         retriever_name,
         config
     )
+    samples = []
     for line in ids_path:
         paper = json.loads(line)
         logger.info("\nbegin generate paper hash id {}".format(paper["hash_id"]))
@@ -115,24 +122,30 @@ def retrieve(ctx,
                 "hash_id {} cite paper num less than 5 ...".format(paper["hash_id"])
             )
             continue
-        # 2. Retrieve
-        result = rt.retrieve(
-            bg, entities, need_evaluate=True, target_paper_id_list=target_paper_id_list
-        )
-        filtered_precision += result["filtered_precision"]
-        precision += result["precision"]
-        filtered_recall += result["filtered_recall"]
-        gt_reference_num += result["gt_reference_num"]
-        retrieve_paper_num += result["retrieve_paper_num"]
-        recall += result["recall"]
-        label_num += result["label_num"]
-        for k, v in result["top_k_matrix"].items():
-            top_k_recall[k] += v["recall"]
-            top_k_precision[k] += v["precision"]
-        num += 1
-        if num >= 100:
+        samples.append((bg, entities, target_paper_id_list))
+        if len(samples) >= 100:
             break
-        continue
+    # 2. Retrieve
+    for start in range(0, len(samples), batch_size):
+        batch = samples[start : start + batch_size]
+        results = rt.retrieve_many(
+            [bg for bg, _, _ in batch],
+            [entities for _, entities, _ in batch],
+            need_evaluate=True,
+            target_paper_id_lists=[target for _, _, target in batch],
+        )
+        for result in results:
+            filtered_precision += result["filtered_precision"]
+            precision += result["precision"]
+            filtered_recall += result["filtered_recall"]
+            gt_reference_num += result["gt_reference_num"]
+            retrieve_paper_num += result["retrieve_paper_num"]
+            recall += result["recall"]
+            label_num += result["label_num"]
+            for k, v in result["top_k_matrix"].items():
+                top_k_recall[k] += v["recall"]
+                top_k_precision[k] += v["precision"]
+            num += 1
     logger.info("=== Finish Report ===")
     logger.info(f"{'Test Paper Num:':<25} {num}")
     logger.info(f"{'Average Precision:':<25} {precision/num:.3f}")
@@ -0,0 +1,176 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.async_paper_client
+
+File Name : async_paper_client.py
+
+Description : Read-only PaperClient on the neo4j async driver, for the FastAPI service.
+    It mirrors the read methods used by `Retriever.aretrieve` and shares the query templates, the
+    paper record cache and the vector index map of the sync PaperClient, so both clients
+    issue the same query strings and see the same cached papers.
+
+Creation Date : 2026-10-16
+"""
+import os
+from neo4j import AsyncGraphDatabase
+from .paper_client import (
+    PaperClient,
+    PAPER_RECORD_FIELDS,
+    paper_record,
+    stack_paper_embeddings,
+)
+
+
+class AsyncPaperClient:
+    _instance = None
+    _initialized = False
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(AsyncPaperClient, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self, paper_client=None, max_connection_pool_size=100) -> None:
+        """
+        Args:
+            paper_client (PaperClient): the sync client to share the query registry, paper
+                cache and schema with, `PaperClient()` by default
+            max_connection_pool_size (int): connections of the async driver
+        """
+        if not self._initialized:
+            self.paper_client = paper_client if paper_client is not None else PaperClient()
+            self.driver = self.get_neo4j_driver(max_connection_pool_size)
+            self.paper_cache = self.paper_client.paper_cache
+            self.schema = self.paper_client.schema
+            self.queries = self.paper_client.queries
+            AsyncPaperClient._initialized = True
+
+    def get_neo4j_driver(self, max_connection_pool_size=100):
+        URI = os.environ["NEO4J_URL"]
+        NEO4J_USERNAME = os.environ["NEO4J_USERNAME"]
+        NEO4J_PASSWD = os.environ["NEO4J_PASSWD"]
+        AUTH = (NEO4J_USERNAME, NEO4J_PASSWD)
+        driver = AsyncGraphDatabase.driver(
+            URI, auth=AUTH, max_connection_pool_size=max_connection_pool_size
+        )
+        return driver
+
+    async def close(self):
+        await self.driver.close()
+
+    async def read(self, query, **parameters):
+        """Run a read query in a managed transaction (retried on transient errors)
+        Returns:
+            records (List of dict)
+        """
+
+        async def work(tx):
+            result = await tx.run(query, **parameters)
+            return await result.data()
+
+        async with self.driver.session() as session:
+            return await session.execute_read(work)
+
+    async def update_papers_from_client(self, paper_id_list, fields=None):
+        """See `PaperClient.update_papers_from_client`
+        """
+        use_cache = fields is None and self.paper_cache.enabled
+        fields = PAPER_RECORD_FIELDS if fields is None else fields
+        if use_cache:
+            cached, missing = self.paper_cache.get_many(paper_id_list)
+        else:
+            cached, missing = {}, list(paper_id_list)
+        fetched = {}
+        if missing:
+            result = await self.read(
+                self.queries.query("papers_record"),
+                papers=[{"hash_id": hash_id} for hash_id in missing],
+                fields=fields,
+            )
+            for r in result:
+                fetched[r["hash_id"]] = paper_record(fields, r["values"])
+            if use_cache:
+                self.paper_cache.put_many(fetched.values())
+        papers = []
+        for hash_id in paper_id_list:
+            if hash_id in cached:
+                papers.append(cached[hash_id])
+            elif hash_id in fetched:
+                papers.append(dict(fetched[hash_id]))
+        return papers
+
+    async def get_papers_attribute(self, paper_id_list, attribute_name):
+        result = await self.read(
+            self.queries.query("papers_attribute"),
+            paper_ids=paper_id_list,
+            attribute_name=attribute_name,
+        )
+        return [record["attributeValue"] for record in result]
+
+    async def get_papers_embeddings(self, paper_id_list, field_names):
+        """See `PaperClient.get_papers_embeddings`
+        """
+        result = await self.read(
+            self.queries.query("papers_embeddings"),
+            paper_ids=list(paper_id_list),
+            field_names=list(field_names),
+        )
+        return stack_paper_embeddings(result, paper_id_list, field_names)
+
+    async def find_related_entities_of_entity_list(self, entity_names, k=3):
+        result = await self.read(
+            self.queries.query("related_entities_of_entity_list"),
+            batch_entities=entity_names,
+            k=k,
+        )
+        related_entities = {entity_name: [] for entity_name in entity_names}
+        for record in result:
+            related_entities[record["source_entity"]].append(record["entities"])
+        return related_entities
+
+    async def find_entities_by_paper_list(self, hash_ids: list):
+        result = await self.read(self.queries.query("entities_by_paper_list"), hash_ids=hash_ids)
+        return [record["entity_name"] for record in result]
+
+    async def find_paper_by_entity(self, entity_name):
+        result = await self.read(self.queries.query("papers_by_entity"), entity_name=entity_name)
+        return [record["hash_id"] for record in result]
+
+    async def get_entities_related_paper_num(self, entity_names):
+        result = await self.read(
+            self.queries.query("entities_related_paper_num"), entity_names=entity_names
+        )
+        return {record["entity_name"]: record["PaperCount"] for record in result}
+
+    async def filter_paper_id_list(self, paper_id_list, year="2024"):
+        """See `PaperClient.filter_paper_id_list`
+        """
+        if not paper_id_list:
+            return []
+        result = await self.read(
+            self.queries.query("papers_before_year"), paper_id_list=paper_id_list, year=year
+        )
+        return [record["hash_id"] for record in result]
+
+    async def cosine_similarity_search(self, embedding, k=1, type_name="embedding"):
+        """See `PaperClient.cosine_similarity_search`, the vector index map is the one cached
+        by the sync client's schema manager
+        """
+        if hasattr(embedding, "tolist"):
+            embedding = embedding.tolist()
+        index_name = self.schema.vector_index_of(type_name)
+        if index_name is not None:
+            results = await self.read(
+                self.queries.query("vector_index_search"),
+                index_name=index_name,
+                k=k,
+                embedding=embedding,
+            )
+        else:
+            results = await self.read(
+                self.queries.query("cosine_similarity_scan", embedding=type_name),
+                embedding=embedding,
+                k=k,
+            )
+        return [result["hash_id"] for result in results]
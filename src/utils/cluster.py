@@ -0,0 +1,63 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.cluster
+
+File Name : cluster.py
+
+Description : Threshold clustering of retrieved papers on their similarity matrix
+
+Creation Date : 2026-10-16
+"""
+import numpy as np
+
+
+def threshold_cluster(similarity_matrix, threshold):
+    """Cluster papers with a union-find over boolean masks. Pairs (i, j), i < j, are
+    visited in row-major order; i and j are merged if similarity[i][j] >= threshold and,
+    after merging, neither i nor j has a similarity below threshold with any member of
+    the two clusters. Unions are by rank and a cluster is labelled by its root, so the
+    labels are the same as the former pure-Python UnionFind/can_merge implementation.
+
+    `ok[x, r]` records whether node x has no similarity below threshold with any member
+    of the cluster rooted at r, so a merge check costs O(1) and a union O(n).
+    Args:
+        similarity_matrix (array, [n, n])
+        threshold (float)
+    Returns:
+        cluster_labels (List of int): root node of each paper's cluster
+    """
+    similarity_matrix = np.asarray(similarity_matrix)
+    n = len(similarity_matrix)
+    root = np.arange(n)
+    rank = np.ones(n, dtype=np.int64)
+    if n == 0:
+        return []
+    ok = ~(similarity_matrix < threshold)
+    above = np.triu(similarity_matrix >= threshold, k=1)
+    for i in range(n):
+        candidates = np.flatnonzero(above[i])
+        while len(candidates) > 0:
+            root_i = root[i]
+            root_j = root[candidates]
+            mergeable = (
+                (root_j != root_i)
+                & ok[i, root_i]
+                & ok[i, root_j]
+                & ok[candidates, root_i]
+                & ok[candidates, root_j]
+            )
+            hits = np.flatnonzero(mergeable)
+            if len(hits) == 0:
+                break
+            j = candidates[hits[0]]
+            root_j = root[j]
+            if rank[root_i] < rank[root_j]:
+                root_i, root_j = root_j, root_i
+            elif rank[root_i] == rank[root_j]:
+                rank[root_i] += 1
+            # root_j is merged into root_i
+            root[root == root_j] = root_i
+            ok[:, root_i] &= ok[:, root_j]
+            candidates = candidates[hits[0] + 1:]
+    return root.tolist()
@@ -0,0 +1,260 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.cocite_index
+
+File Name : cocite_index.py
+
+Description : Co-citation counts as a sparse matrix product. With A the citing-paper x
+    cited-paper CSR matrix, A^T A holds the number of papers citing both papers. Only the
+    top-k co-cited neighbours of every paper are kept, as compact int arrays. A table of
+    hash_id -> year lets co-cite results be filtered without touching neo4j.
+    Snapshots store a watermark of the database they were built from (e.g. the number of
+    citations) and are rebuilt when it no longer matches.
+
+Creation Date : 2026-10-16
+"""
+import os
+import numpy as np
+import scipy.sparse as sp
+from loguru import logger
+
+
+class CoCiteIndex:
+    """
+    ids (int64, [N]): sorted hash_ids of all cited papers
+    indptr (int64, [N + 1]): neighbours of ids[r] are neighbours[indptr[r]:indptr[r + 1]]
+    neighbours (int32): row of each co-cited paper, by descending count
+    counts (int32): co-citation count of each neighbour
+    top_k (int): at most top_k neighbours are kept for every paper
+    watermark (List of int): state of the database the index was built from, see
+        `PaperClient.get_citation_watermark`
+    """
+
+    def __init__(self, ids, indptr, neighbours, counts, top_k, watermark=None):
+        self.ids = ids
+        self.indptr = indptr
+        self.neighbours = neighbours
+        self.counts = counts
+        self.top_k = top_k
+        self.watermark = watermark
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, citemap, top_k=16):
+        """
+        Args:
+            citemap (dict of hash_id -> set of cited hash_ids)
+            top_k: number of neighbours kept for every paper
+        Returns:
+            CoCiteIndex
+        """
+        cited_lists = [list(cited) for cited in citemap.values() if cited]
+        if not cited_lists:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(empty, np.zeros(1, dtype=np.int64), empty.astype(np.int32), empty.astype(np.int32), top_k)
+        lengths = np.array([len(cited) for cited in cited_lists], dtype=np.int64)
+        cited = np.fromiter(
+            (cited_id for cited in cited_lists for cited_id in cited),
+            dtype=np.int64, count=int(lengths.sum()),
+        )
+        ids, columns = np.unique(cited, return_inverse=True)
+        rows = np.repeat(np.arange(len(cited_lists)), lengths)
+        citation = sp.csr_matrix(
+            (np.ones(len(cited), dtype=np.int32), (rows, columns)),
+            shape=(len(cited_lists), len(ids)),
+        )
+        citation.data[:] = 1  # duplicated citations count once
+        cocite = (citation.T @ citation).tocsr()
+        cocite.setdiag(0)
+        cocite.eliminate_zeros()
+        # sort every row by descending count (ties by column), keep the first top_k
+        entry_rows = np.repeat(np.arange(len(ids)), np.diff(cocite.indptr))
+        order = np.lexsort((cocite.indices, -cocite.data, entry_rows))
+        rank = np.arange(len(order)) - cocite.indptr[entry_rows[order]]
+        keep = order[rank < top_k]
+        row_num = np.bincount(entry_rows[keep], minlength=len(ids))
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(row_num)
+        return cls(
+            ids,
+            indptr,
+            cocite.indices[keep].astype(np.int32),
+            cocite.data[keep].astype(np.int32),
+            top_k,
+        )
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(
+            path, ids=self.ids, indptr=self.indptr,
+            neighbours=self.neighbours, counts=self.counts, top_k=self.top_k,
+            watermark=np.asarray(self.watermark if self.watermark is not None else [], dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        # snapshots saved before the watermark have none, and are rebuilt
+        watermark = data["watermark"].tolist() if "watermark" in data.files else None
+        return cls(
+            data["ids"], data["indptr"], data["neighbours"], data["counts"], int(data["top_k"]),
+            watermark=watermark or None,
+        )
+
+    def row(self, paper_id):
+        r = np.searchsorted(self.ids, paper_id)
+        if r < len(self.ids) and self.ids[r] == paper_id:
+            return int(r)
+        return -1
+
+    def get_cocite_ids(self, paper_id, k=1):
+        """Top-k most co-cited papers of `paper_id` (at most `top_k` of the build)
+        Returns:
+            paper_ids (List of int)
+        """
+        r = self.row(paper_id)
+        if r < 0:
+            return []
+        start = self.indptr[r]
+        end = min(self.indptr[r + 1], start + k)
+        return [int(i) for i in self.ids[self.neighbours[start:end]]]
+
+    def get_cocite_ids_many(self, paper_ids, k=1):
+        """Top-k most co-cited papers of every paper of `paper_ids`
+        Returns:
+            cocite_ids (np.ndarray of int64): concatenation of the top-k lists
+        """
+        paper_ids = np.asarray(list(paper_ids), dtype=np.int64)
+        if len(self.ids) == 0 or len(paper_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.ids, paper_ids), len(self.ids) - 1)
+        rows = rows[self.ids[rows] == paper_ids]
+        starts = self.indptr[rows]
+        lengths = np.minimum(self.indptr[rows + 1] - starts, k)
+        # positions starts[i] .. starts[i] + lengths[i] - 1 of every row, concatenated
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+        return self.ids[self.neighbours[positions]]
+
+
+class PaperTable:
+    """hash_id -> year of every paper in the database
+    ids (int64, [N]): sorted hash_ids
+    years (int16, [N]): publication year, UNKNOWN_YEAR if missing
+    watermark (List of int): number of papers in the database when the table was built
+    """
+    UNKNOWN_YEAR = np.iinfo(np.int16).max
+
+    def __init__(self, ids, years, watermark=None):
+        self.ids = ids
+        self.years = years
+        self.watermark = watermark
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def parse_year(cls, year):
+        try:
+            return int(year)
+        except (TypeError, ValueError):
+            return cls.UNKNOWN_YEAR
+
+    @classmethod
+    def build(cls, papers):
+        """
+        Args:
+            papers (iterable of (hash_id, year))
+        """
+        ids, years = [], []
+        for hash_id, year in papers:
+            ids.append(hash_id)
+            years.append(cls.parse_year(year))
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        return cls(ids[order], np.asarray(years, dtype=np.int16)[order])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(
+            path, ids=self.ids, years=self.years,
+            watermark=np.asarray(self.watermark if self.watermark is not None else [], dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        watermark = data["watermark"].tolist() if "watermark" in data.files else None
+        return cls(data["ids"], data["years"], watermark=watermark or None)
+
+    def contains(self, paper_ids):
+        """
+        Returns:
+            mask (np.ndarray of bool): the papers of `paper_ids` in the table
+        """
+        paper_ids = np.asarray(paper_ids, dtype=np.int64)
+        if len(self.ids) == 0 or len(paper_ids) == 0:
+            return np.zeros(len(paper_ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.ids, paper_ids), len(self.ids) - 1)
+        return self.ids[rows] == paper_ids
+
+    def filter(self, paper_ids, year="2024"):
+        """Keep the papers which released before `year` (not contained) and existed in the
+        database, the local equivalent of `PaperClient.filter_paper_id_list`
+        Args:
+            paper_ids (array of int64)
+            year: the papers before
+        Returns:
+            mask (np.ndarray of bool)
+        """
+        paper_ids = np.asarray(paper_ids, dtype=np.int64)
+        if len(self.ids) == 0 or len(paper_ids) == 0:
+            return np.zeros(len(paper_ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.ids, paper_ids), len(self.ids) - 1)
+        return (self.ids[rows] == paper_ids) & (self.years[rows] < self.parse_year(year))
+
+
+def load_or_build_paper_table(path, get_papers, rebuild=False, watermark=None):
+    """Load the paper table from `path`, or build it with `get_papers()` and save it. The
+    snapshot is rebuilt if it was built from a database state other than `watermark`
+    """
+    if not rebuild and os.path.exists(path):
+        table = PaperTable.load(path)
+        if watermark is None or table.watermark == list(watermark):
+            logger.debug(f"load paper table from {path}")
+            return table
+        logger.info(
+            f"paper table {path} was built at {table.watermark}, "
+            f"the database is at {list(watermark)}, rebuild it"
+        )
+    table = PaperTable.build(get_papers())
+    table.watermark = list(watermark) if watermark is not None else None
+    table.save(path)
+    logger.debug(f"save paper table to {path}")
+    return table
+
+
+def load_or_build_cocite_index(path, build_citemap, top_k=16, rebuild=False, watermark=None):
+    """Load the co-cite index from `path`, or build it with `build_citemap()` and save it.
+    The snapshot is rebuilt if it was built from a database state other than `watermark`
+    Args:
+        watermark (List of int): the current state of the database, None to skip the check
+    """
+    if not rebuild and os.path.exists(path):
+        index = CoCiteIndex.load(path)
+        if watermark is not None and index.watermark != list(watermark):
+            logger.info(
+                f"co-cite index {path} was built at {index.watermark}, "
+                f"the database is at {list(watermark)}, rebuild it"
+            )
+        elif index.top_k >= top_k:
+            logger.debug(f"load co-cite index from {path}")
+            return index
+    index = CoCiteIndex.build(build_citemap(), top_k=top_k)
+    index.watermark = list(watermark) if watermark is not None else None
+    index.save(path)
+    logger.debug(f"save co-cite index to {path}")
+    return index
@@ -0,0 +1,212 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.disk_embedding_cache
+
+File Name : disk_embedding_cache.py
+
+Description : Content-addressed on-disk embedding cache in SQLite, keyed by
+    (sha256 of the text, embedding model and its non-PyTorch backend, jina task, embedding
+    postfix), see `utils.onnx_embedding.cache_model_name`. Re-ingesting unchanged papers or
+    re-running a backfill reads the vectors instead of encoding the texts again. The total size of the vectors is capped, the least recently used entries
+    are evicted first. Hits and misses are counted per job.
+
+Creation Date : 2026-10-16
+"""
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+from collections import Counter, defaultdict
+from loguru import logger
+from .embedding_cache import QueryEmbeddingCache
+from .header import get_dir
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_disk_embedding_cache(config):
+    """The on-disk embedding cache configured by `DEFAULT.embedding_cache_path` and
+    `DEFAULT.embedding_cache_size_mb`, shared by all users of the same path, None if disabled
+    """
+    path = config.DEFAULT.get("embedding_cache_path", None)
+    if not path:
+        return None
+    path = os.path.abspath(get_dir(path))
+    with _caches_lock:
+        if path not in _caches:
+            max_bytes = int(config.DEFAULT.get("embedding_cache_size_mb", 0)) * 1024 * 1024
+            _caches[path] = DiskEmbeddingCache(path, max_bytes=max_bytes)
+        return _caches[path]
+
+
+class DiskEmbeddingCache:
+    """
+    path (str): the SQLite database file
+    max_bytes (int): cap of the total size of the stored vectors, 0 for no cap
+    """
+
+    # fraction of `max_bytes` kept after an eviction, so eviction does not run on every put
+    EVICT_TO = 0.9
+
+    def __init__(self, path, max_bytes=0) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.job_stats = defaultdict(Counter)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                text_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                task TEXT NOT NULL,
+                postfix TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (text_hash, model, task, postfix)
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self.connection.commit()
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(text, model_name, task=None, postfix=""):
+        return QueryEmbeddingCache.make_key(text, model_name, task) + (str(postfix),)
+
+    def get_many(self, keys, job="default"):
+        """
+        Returns:
+            found (dict of key -> np.ndarray of float32): the cached keys only
+        """
+        found = {}
+        now = time.time()
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                row = self.connection.execute(
+                    "SELECT vector FROM embeddings "
+                    "WHERE text_hash = ? AND model = ? AND task = ? AND postfix = ?",
+                    key,
+                ).fetchone()
+                if row is not None:
+                    found[key] = np.frombuffer(row[0], dtype=np.float32).copy()
+            if found:
+                self.connection.executemany(
+                    "UPDATE embeddings SET last_used = ? "
+                    "WHERE text_hash = ? AND model = ? AND task = ? AND postfix = ?",
+                    [(now,) + key for key in found],
+                )
+                self.connection.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.job_stats[job]["hits"] += hits
+            self.job_stats[job]["misses"] += len(keys) - hits
+        return found
+
+    def put_many(self, items):
+        """
+        Args:
+            items (dict of key -> embedding)
+        """
+        now = time.time()
+        rows = [
+            key + (np.asarray(embedding, dtype=np.float32).tobytes(), now)
+            for key, embedding in items.items()
+        ]
+        with self.lock:
+            for row in rows:
+                old = self.connection.execute(
+                    "SELECT LENGTH(vector) FROM embeddings "
+                    "WHERE text_hash = ? AND model = ? AND task = ? AND postfix = ?",
+                    row[:4],
+                ).fetchone()
+                self.size += len(row[4]) - (old[0] if old is not None else 0)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings "
+                "(text_hash, model, task, postfix, vector, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            if self.max_bytes > 0 and self.size > self.max_bytes:
+                self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        """Drop the least recently used vectors until the cache fits in EVICT_TO of max_bytes
+        """
+        target = int(self.max_bytes * self.EVICT_TO)
+        evicted = 0
+        while self.size > target:
+            rows = self.connection.execute(
+                "SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 1024"
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                break
+            drop = []
+            for rowid, length in rows:
+                drop.append((rowid,))
+                self.size -= length
+                if self.size <= target:
+                    break
+            self.connection.executemany("DELETE FROM embeddings WHERE rowid = ?", drop)
+            evicted += len(drop)
+        self.job_stats["evictions"]["count"] += evicted
+        logger.debug(f"evict {evicted} embeddings from {self.path}")
+
+    def encode_many(
+        self, embedding_model, texts, model_name, task=None, postfix="", job="default", **kwargs
+    ):
+        """`embedding_model.encode(texts, **kwargs)` through the cache, the missing texts
+        are encoded in one call
+        Returns:
+            embeddings (np.ndarray of float32, [len(texts), embedding dimension])
+        """
+        keys = [self.make_key(text, model_name, task, postfix) for text in texts]
+        found = self.get_many(keys, job=job)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            encoded = embedding_model.encode(list(missing.values()), **kwargs)
+            if hasattr(encoded, "detach"):
+                encoded = encoded.detach().cpu().numpy()
+            encoded = dict(zip(missing.keys(), np.asarray(encoded, dtype=np.float32)))
+            self.put_many(encoded)
+            found.update(encoded)
+        return np.stack([found[key] for key in keys])
+
+    def stats(self, job=None):
+        """Hits, misses and hit rate of `job`, of all jobs if None
+        """
+        with self.lock:
+            if job is not None:
+                counts = Counter(self.job_stats[job])
+            else:
+                counts = Counter()
+                for name, job_counts in self.job_stats.items():
+                    if name != "evictions":
+                        counts.update(job_counts)
+            total = counts["hits"] + counts["misses"]
+            return {
+                "hits": counts["hits"],
+                "misses": counts["misses"],
+                "hit_rate": counts["hits"] / total if total > 0 else 0.0,
+                "evictions": self.job_stats["evictions"]["count"],
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,174 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.embedding_backfill
+
+File Name : embedding_backfill.py
+
+Description : Resumable embedding backfill of text properties of Paper nodes. Papers are
+    paged by key (`hash_id > $last ORDER BY hash_id`) over the hash_id index, so every page
+    costs the same instead of rescanning the skipped prefix. All fields of a page are read
+    in one query, encoded in one length-sorted stream and written in one UNWIND. The last
+    written key is checkpointed to disk after every page, and an interrupted run resumes
+    after it. In "only missing" mode fields which already have the embedding are skipped.
+    With an on-disk embedding cache (see utils.disk_embedding_cache) only texts which were
+    never encoded by the same model, task and postfix go through the model.
+
+Creation Date : 2026-10-16
+"""
+import os
+import json
+from collections import namedtuple
+from loguru import logger
+
+# field: the text property to encode, e.g. "abstract"
+# embedding_name: the embedding property to write, e.g. "abstract_embedding_jina_v3"
+# with_title: encode `title + text`
+BackfillTarget = namedtuple("BackfillTarget", ["field", "embedding_name", "with_title"])
+
+
+class EmbeddingBackfill:
+    """
+    paper_client (PaperClient)
+    embedding_model: a SentenceTransformer-like model
+    targets (List of BackfillTarget): the fields to encode, read and written together
+    batch_size (int): papers per page, texts per model batch
+    only_missing (bool): skip fields which already have their embedding
+    checkpoint_path (str): json file of the last written key, None to disable resuming
+    embedding_cache (DiskEmbeddingCache): consulted before encoding, None to always encode
+    cache_scope (tuple): (model name, jina task, embedding postfix) of the cache keys
+    """
+
+    # hash_ids are non-negative, see utils.hash.generate_hash_id
+    START_KEY = -1
+
+    def __init__(
+        self, paper_client, embedding_model, targets, batch_size=512, only_missing=False,
+        checkpoint_path=None, device=None, embedding_cache=None, cache_scope=None,
+    ) -> None:
+        self.paper_client = paper_client
+        self.embedding_model = embedding_model
+        self.targets = [BackfillTarget(*target) for target in targets]
+        self.embedding_names = [target.embedding_name for target in self.targets]
+        self.batch_size = batch_size
+        self.only_missing = only_missing
+        self.checkpoint_path = checkpoint_path
+        self.device = device
+        self.embedding_cache = embedding_cache
+        self.cache_scope = cache_scope if cache_scope is not None else ("", None, "")
+        self.job = "+".join(self.embedding_names)
+
+    def load_checkpoint(self):
+        """The last written key of an interrupted run, START_KEY if none
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return self.START_KEY, 0
+        with open(self.checkpoint_path, "r", encoding="utf8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("embeddings") != self.embedding_names:
+            logger.warning(f"checkpoint {self.checkpoint_path} is not of {self.embedding_names}, ignore it")
+            return self.START_KEY, 0
+        logger.info(
+            f"resume {self.embedding_names} after hash_id {checkpoint['last']} "
+            f"({checkpoint['processed']} papers done)"
+        )
+        return checkpoint["last"], checkpoint["processed"]
+
+    def save_checkpoint(self, last, processed):
+        if self.checkpoint_path is None:
+            return
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(
+                {"embeddings": self.embedding_names, "last": last, "processed": processed}, f
+            )
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        if self.checkpoint_path is not None and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def read_page(self, last):
+        """The next `batch_size` papers with any field to encode
+        Returns:
+            records (List of dict): hash_id, title, contexts (text of each target, None if
+                it needs no encoding)
+        """
+        query = self.paper_client.queries.query("papers_contexts_after")
+        with self.paper_client.driver.session() as session:
+            return session.execute_read(
+                lambda tx: tx.run(
+                    query,
+                    last=last,
+                    batch_size=self.batch_size,
+                    fields=[target.field for target in self.targets],
+                    embeddings=self.embedding_names,
+                    only_missing=self.only_missing,
+                ).data()
+            )
+
+    def encode(self, records):
+        """Encode the texts of all targets of a page in one call, longest first, so every
+        model batch holds texts of similar length
+        Returns:
+            props (List of dict): embedding name -> vector, of each record
+        """
+        items = []
+        for i, record in enumerate(records):
+            for j, context in enumerate(record["contexts"]):
+                if context is None:
+                    continue
+                if self.targets[j].with_title:
+                    context = record["title"] + context
+                items.append((i, self.embedding_names[j], context))
+        items.sort(key=lambda item: len(item[2]), reverse=True)
+        props = [{} for _ in records]
+        if not items:
+            return props
+        contexts = [context for _, _, context in items]
+        if self.embedding_cache is not None:
+            model_name, task, postfix = self.cache_scope
+            embeddings = self.embedding_cache.encode_many(
+                self.embedding_model, contexts, model_name, task, postfix, job=self.job,
+                batch_size=self.batch_size, convert_to_tensor=True, device=self.device,
+            ).tolist()
+        else:
+            embeddings = self.embedding_model.encode(
+                contexts, batch_size=self.batch_size, convert_to_tensor=True, device=self.device,
+            ).detach().cpu().tolist()
+        for (i, embedding_name, _), embedding in zip(items, embeddings):
+            props[i][embedding_name] = embedding
+        return props
+
+    def write_page(self, records, props):
+        query = self.paper_client.queries.query("set_papers_properties")
+        rows = [
+            {"hash_id": record["hash_id"], "props": paper_props}
+            for record, paper_props in zip(records, props)
+            if paper_props
+        ]
+        with self.paper_client.driver.session() as session:
+            session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+
+    def run(self, resume=True):
+        """Encode and write all (missing) embeddings
+        Args:
+            resume (bool): continue after the checkpoint of an interrupted run
+        Returns:
+            processed (int): number of papers written, including the resumed run
+        """
+        last, processed = self.load_checkpoint() if resume else (self.START_KEY, 0)
+        while True:
+            records = self.read_page(last)
+            if not records:
+                break
+            self.write_page(records, self.encode(records))
+            last = records[-1]["hash_id"]
+            processed += len(records)
+            self.save_checkpoint(last, processed)
+            logger.info(f"== {self.embedding_names}: {processed} papers, last hash_id {last} ==")
+        self.clear_checkpoint()
+        if self.embedding_cache is not None:
+            logger.info(f"embedding cache of {self.job}: {self.embedding_cache.stats(job=self.job)}")
+        return processed
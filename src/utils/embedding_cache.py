@@ -0,0 +1,170 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.embedding_cache
+
+File Name : embedding_cache.py
+
+Description : Bounded, thread-safe LRU cache of query embeddings, keyed by
+    (sha256 of the text, embedding model, jina task). Optionally persisted to disk, and
+    optionally backed by the shared on-disk embedding cache (see utils.disk_embedding_cache)
+    as a second tier.
+
+Creation Date : 2026-10-16
+"""
+import os
+import atexit
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from loguru import logger
+
+
+class QueryEmbeddingCache:
+    _instance = None
+    _initialized = False
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(QueryEmbeddingCache, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self, max_size=1024, path=None, disk_cache=None) -> None:
+        if not self._initialized:
+            self.max_size = max_size
+            self.path = path
+            self.disk_cache = disk_cache
+            self.lock = threading.Lock()
+            self.cache = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            if self.path is not None:
+                self.load()
+                atexit.register(self.save)
+            QueryEmbeddingCache._initialized = True
+
+    @staticmethod
+    def make_key(text, model_name, task=None):
+        return (
+            hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            str(model_name),
+            str(task),
+        )
+
+    def get(self, key):
+        with self.lock:
+            embedding = self.cache.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return embedding.copy()
+
+    def put(self, key, embedding):
+        with self.lock:
+            self.cache[key] = np.array(embedding, dtype=np.float32)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+
+    def encode(self, embedding_model, text, model_name, task=None, postfix="", **kwargs):
+        """`embedding_model.encode(text, **kwargs)` through the cache
+        Args:
+            embedding_model: a SentenceTransformer-like model
+            text (str): the query
+            model_name (str): config.DEFAULT.embedding
+            task (str): the jina task, None for other models
+            postfix (str): the embedding postfix, part of the key of the disk cache
+        Returns:
+            embedding (np.ndarray)
+        """
+        key = self.make_key(text, model_name, task)
+        embedding = self.get(key)
+        if embedding is None:
+            if self.disk_cache is not None:
+                embedding = self.disk_cache.encode_many(
+                    embedding_model, [text], model_name, task, postfix, job="query", **kwargs
+                )[0]
+            else:
+                embedding = embedding_model.encode(text, **kwargs)
+                if hasattr(embedding, "detach"):
+                    embedding = embedding.detach().cpu().numpy()
+            self.put(key, embedding)
+        return embedding
+
+    def encode_many(self, embedding_model, texts, model_name, task=None, postfix="", **kwargs):
+        """Batched version of `encode`, the missing texts are encoded in one call
+        Returns:
+            embeddings (np.ndarray, [len(texts), embedding dimension])
+        """
+        keys = [self.make_key(text, model_name, task) for text in texts]
+        embeddings = [self.get(key) for key in keys]
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(keys[i], texts[i])
+        if missing:
+            if self.disk_cache is not None:
+                encoded = self.disk_cache.encode_many(
+                    embedding_model, list(missing.values()), model_name, task, postfix,
+                    job="query", **kwargs
+                )
+            else:
+                encoded = embedding_model.encode(list(missing.values()), **kwargs)
+                if hasattr(encoded, "detach"):
+                    encoded = encoded.detach().cpu().numpy()
+            encoded = dict(zip(missing.keys(), encoded))
+            for key, embedding in encoded.items():
+                self.put(key, embedding)
+            embeddings = [
+                encoded[key] if embedding is None else embedding
+                for key, embedding in zip(keys, embeddings)
+            ]
+        return np.stack(embeddings)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            stats = {
+                "size": len(self.cache),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+            }
+        if self.disk_cache is not None:
+            stats["disk"] = self.disk_cache.stats(job="query")
+        return stats
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            keys = ["\t".join(key) for key in self.cache.keys()]
+            embeddings = list(self.cache.values())
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        np.savez(
+            self.path,
+            keys=np.asarray(keys, dtype=str),
+            embeddings=np.stack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32),
+        )
+        logger.debug(f"save {len(keys)} query embeddings to {self.path}")
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path)
+            with self.lock:
+                for key, embedding in zip(data["keys"].tolist(), data["embeddings"]):
+                    self.cache[tuple(key.split("\t"))] = embedding
+                while len(self.cache) > self.max_size:
+                    self.cache.popitem(last=False)
+            logger.debug(f"load {len(self.cache)} query embeddings from {self.path}")
+        except Exception as e:
+            logger.warning(f"load query embedding cache {self.path} failed: {e}")
@@ -0,0 +1,194 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.embedding_pool
+
+File Name : embedding_pool.py
+
+Description : Multi-process CPU encoding pool. Without a GPU `SentenceTransformer.encode`
+    runs in one process and scales poorly with torch intra-op threads on short texts. The
+    pool loads the embedding model once in each of N worker processes, pins the thread count
+    of every worker so the workers do not oversubscribe the cores, and shards the texts of
+    an `encode` call into contiguous chunks (the backfill sorts texts by length, so a chunk
+    holds texts of similar length). It exposes the `encode` of a SentenceTransformer and is
+    a drop-in model for the backfill, the embedding caches and batch retrieval; small inputs
+    are encoded by the in-process model to avoid the inter-process round trip.
+
+Creation Date : 2026-10-16
+"""
+import os
+import atexit
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+from .onnx_embedding import embedding_backend_of
+
+# the model of a worker process, loaded by `_init_worker`
+_worker_model = None
+
+
+def _init_worker(model_path, task, num_threads):
+    """Pin the thread count of the worker and load the model, runs once per worker
+    """
+    global _worker_model
+    for name in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[name] = str(num_threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    _worker_model = SentenceTransformer(
+        model_name_or_path=model_path,
+        device="cpu",
+        trust_remote_code=True,
+        local_files_only=True,
+    )
+    if task is not None:
+        _worker_model[0].default_task = task
+
+
+def _encode_chunk(texts, kwargs):
+    return _worker_model.encode(texts, convert_to_numpy=True, **kwargs)
+
+
+class EmbeddingPool:
+    """
+    model_path (str): local directory of the embedding model
+    task (str): the jina default task, None for other models
+    workers (int): number of worker processes
+    threads_per_worker (int): torch threads of each worker, 0 to split the cores evenly
+    chunk_size (int): texts sent to a worker at once
+    local_model: the in-process model for inputs of less than `min_pool_texts` texts
+    min_pool_texts (int): smaller inputs are encoded by `local_model`
+    """
+
+    def __init__(
+        self, model_path, task=None, workers=2, threads_per_worker=0, chunk_size=64,
+        local_model=None, min_pool_texts=None,
+    ) -> None:
+        self.model_path = model_path
+        self.task = task
+        self.workers = workers
+        if threads_per_worker <= 0:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        self.threads_per_worker = threads_per_worker
+        self.chunk_size = chunk_size
+        self.local_model = local_model
+        self.min_pool_texts = min_pool_texts if min_pool_texts is not None else 2 * chunk_size
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def start(self):
+        """Start the worker processes, done by the first `encode` that needs them
+        """
+        with self.lock:
+            if self.executor is None:
+                # spawn: forking a process which already holds torch threads can deadlock
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_path, self.task, self.threads_per_worker),
+                )
+                logger.info(
+                    f"start embedding pool: {self.workers} workers x "
+                    f"{self.threads_per_worker} threads, {self.model_path}"
+                )
+        return self.executor
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
+
+    def encode(
+        self, sentences, batch_size=32, convert_to_tensor=False, convert_to_numpy=True,
+        device=None, **kwargs
+    ):
+        """`SentenceTransformer.encode` sharded over the worker processes, `device` is
+        ignored as the workers run on the cpu
+        Returns:
+            embeddings (np.ndarray, or torch.Tensor if `convert_to_tensor`)
+        """
+        if self.local_model is None and isinstance(sentences, str):
+            return self.encode(
+                [sentences], batch_size=batch_size, convert_to_tensor=convert_to_tensor,
+                **kwargs
+            )[0]
+        if isinstance(sentences, str) or (
+            self.local_model is not None and len(sentences) < self.min_pool_texts
+        ):
+            return self.local_model.encode(
+                sentences, batch_size=batch_size, convert_to_tensor=convert_to_tensor,
+                convert_to_numpy=convert_to_numpy, device=device, **kwargs
+            )
+        sentences = list(sentences)
+        kwargs = dict(kwargs, batch_size=min(batch_size, self.chunk_size), show_progress_bar=False)
+        if sentences:
+            executor = self.start()
+            chunks = [
+                sentences[start:start + self.chunk_size]
+                for start in range(0, len(sentences), self.chunk_size)
+            ]
+            embeddings = np.concatenate(
+                list(executor.map(_encode_chunk, chunks, [kwargs] * len(chunks)))
+            )
+        else:
+            embeddings = np.zeros((0, 0), dtype=np.float32)
+        if convert_to_tensor:
+            import torch
+
+            return torch.from_numpy(embeddings)
+        return embeddings
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_embedding_pool(config, local_model=None):
+    """The encoding pool configured by `DEFAULT.embedding_workers`, shared by all users of
+    the same model, None if disabled, a GPU is available or the embedding backend is not
+    PyTorch (the workers load the PyTorch model, their vectors would not match the local ones)
+    Args:
+        local_model: the in-process model, encodes single texts and small inputs
+    """
+    workers = int(config.DEFAULT.get("embedding_workers", 0))
+    if workers <= 0:
+        return None
+    if local_model is not None:
+        backend = embedding_backend_of(local_model)
+    else:
+        backend = config.DEFAULT.get("embedding_backend", "torch")
+    if backend != "torch":
+        logger.info(f"embedding pool disabled for the {backend} backend")
+        return None
+    import torch
+    from .header import get_dir
+
+    if torch.cuda.is_available():
+        return None
+    model_path = get_dir(f"./assets/model/{config.DEFAULT.embedding}")
+    task = None
+    if "jina-embeddings-v3" in config.DEFAULT.embedding:
+        task = config.DEFAULT.embedding_task
+    with _pools_lock:
+        key = (model_path, task)
+        if key not in _pools:
+            _pools[key] = EmbeddingPool(
+                model_path,
+                task=task,
+                workers=workers,
+                threads_per_worker=int(config.DEFAULT.get("embedding_worker_threads", 0)),
+                chunk_size=int(config.DEFAULT.get("embedding_pool_chunk_size", 64)),
+                local_model=local_model,
+            )
+            atexit.register(_pools[key].close)
+        return _pools[key]
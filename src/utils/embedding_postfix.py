@@ -0,0 +1,45 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.embedding_postfix
+
+File Name : embedding_postfix.py
+
+Description : Postfix of the Paper embedding properties written by each embedding model
+    (and jina-embeddings-v3 task), e.g. `background_embedding_jina_v3_text_matching`. The
+    single mapping used by the retrievers, the paper manager and the property whitelist
+    of the query registry.
+
+Creation Date : 2026-10-17
+"""
+
+EMBEDDING_MODEL_POSTFIXES = {
+    "sentence-transformers/all-MiniLM-L6-v2": "",
+    "BAAI/llm-embedder": "_llm_embedder",
+    "jinaai/jina-embeddings-v3": "_jina_v3",
+}
+# tasks of jina-embeddings-v3, appended to its model postfix
+JINA_TASK_POSTFIXES = {
+    "text-matching": "_text_matching",
+    "retrieval.query": "_query",
+    "retrieval.passage": "_passage",
+}
+ALL_EMBEDDING_POSTFIXES = list(EMBEDDING_MODEL_POSTFIXES.values()) + [
+    EMBEDDING_MODEL_POSTFIXES["jinaai/jina-embeddings-v3"] + task_postfix
+    for task_postfix in JINA_TASK_POSTFIXES.values()
+]
+
+
+def embedding_postfix(model_name, task=None):
+    """Postfix of the embeddings of `model_name`, with the jina `task` if given
+    Raises:
+        ValueError: unknown model or jina task
+    """
+    if model_name not in EMBEDDING_MODEL_POSTFIXES:
+        raise ValueError(f"unknown embedding model {model_name!r}")
+    postfix = EMBEDDING_MODEL_POSTFIXES[model_name]
+    if model_name == "jinaai/jina-embeddings-v3" and task is not None:
+        if task not in JINA_TASK_POSTFIXES:
+            raise ValueError(f"unknown jina-embeddings-v3 task {task!r}")
+        postfix += JINA_TASK_POSTFIXES[task]
+    return postfix
@@ -0,0 +1,125 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.embedding_store
+
+File Name : embedding_store.py
+
+Description : Read-only, memory-mapped embedding matrices, one per embedding property
+    (e.g. `background_embedding_jina_v3_text_matching`). Rows are L2-normalized float32
+    and sorted by hash_id, so a lookup is a binary search and cosine similarity is a
+    plain dot product. The files are mapped read-only, every process on the host
+    shares the same pages.
+
+Creation Date : 2026-10-16
+"""
+import os
+import numpy as np
+from loguru import logger
+from .vector_index import normalize_rows
+
+
+class EmbeddingStore:
+    def __init__(self, ids, vectors):
+        self.ids = ids
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1]
+
+    @classmethod
+    def build(cls, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        return cls(ids[order], normalize_rows(vectors)[order])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(f"{path}.ids.npy", self.ids)
+        np.save(f"{path}.npy", self.vectors)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = "r" if mmap else None
+        return cls(
+            np.load(f"{path}.ids.npy"),
+            np.load(f"{path}.npy", mmap_mode=mmap_mode),
+        )
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(f"{path}.ids.npy") and os.path.exists(f"{path}.npy")
+
+    def lookup(self, paper_id_list):
+        """Map hash_ids to rows
+        Args:
+            paper_id_list (List of int)
+        Returns:
+            rows (np.ndarray of int64): row of each paper, -1 if the paper is not stored
+        """
+        paper_ids = np.asarray(paper_id_list, dtype=np.int64)
+        if len(self.ids) == 0 or len(paper_ids) == 0:
+            return np.full(len(paper_ids), -1, dtype=np.int64)
+        rows = np.searchsorted(self.ids, paper_ids)
+        rows = np.minimum(rows, len(self.ids) - 1)
+        rows[self.ids[rows] != paper_ids] = -1
+        return rows
+
+    def get(self, paper_id_list):
+        """Gather the normalized embeddings of `paper_id_list`
+        Returns:
+            vectors (np.ndarray of float32, [N, D]): zero rows for papers not stored
+            found (np.ndarray of bool, [N])
+        """
+        rows = self.lookup(paper_id_list)
+        found = rows >= 0
+        vectors = np.zeros((len(rows), self.dimension), dtype=np.float32)
+        vectors[found] = self.vectors[rows[found]]
+        return vectors, found
+
+    def cosine_similarity(self, embedding, paper_id_list):
+        """Cosine similarity between `embedding` and every paper of `paper_id_list`
+        Returns:
+            scores (np.ndarray of float32, [N])
+            found (np.ndarray of bool, [N])
+        """
+        query = normalize_rows(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+        vectors, found = self.get(paper_id_list)
+        return vectors @ query, found
+
+
+class EmbeddingStoreManager:
+    """Owns the embedding stores of one `index_dir` and caches the loaded ones
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.stores = {}
+
+    def store_path(self, type_name):
+        return os.path.join(self.index_dir, "store", type_name)
+
+    def get(self, type_name):
+        """Return the memory-mapped store of `type_name`, or None if it was never built
+        """
+        if type_name not in self.stores:
+            path = self.store_path(type_name)
+            if EmbeddingStore.exists(path):
+                self.stores[type_name] = EmbeddingStore.load(path)
+                logger.info(
+                    "load embedding store {} ({} papers)".format(type_name, len(self.stores[type_name]))
+                )
+            else:
+                self.stores[type_name] = None
+        return self.stores[type_name]
+
+    def build(self, type_name, ids, vectors):
+        store = EmbeddingStore.build(ids, vectors)
+        store.save(self.store_path(type_name))
+        self.stores[type_name] = store
+        logger.info("build embedding store {}: {} papers".format(type_name, len(store)))
+        return store
@@ -0,0 +1,178 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.entity_graph
+
+File Name : entity_graph.py
+
+Description : In-memory weighted entity graph in CSR form, for multi-hop entity expansion.
+    The edges are either the RELATED_TO co-occurrence counts of the entity index (number of
+    shared papers) or the CONNECT edges of the database (number of papers in which both
+    entities occur in one sentence), see `RETRIEVE.relation_name`. A breadth-first search
+    expands entities over `RETRIEVE.kg_jump_num` hops, keeping edges heavier than a
+    threshold and at most a given number of new entities per hop.
+
+Creation Date : 2026-10-16
+"""
+import os
+import json
+import numpy as np
+import scipy.sparse as sp
+from loguru import logger
+
+
+class EntityGraph:
+    """
+    entity_names (List of str): entity of each row
+    indptr, neighbours, weights: neighbours of entity e are
+        neighbours[indptr[e]:indptr[e + 1]] (sorted rows), with the edge weights
+    """
+
+    def __init__(self, entity_names, indptr, neighbours, weights):
+        self.entity_names = entity_names
+        self.entity_rows = {name: i for i, name in enumerate(entity_names)}
+        self.indptr = indptr
+        self.neighbours = neighbours
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.entity_names)
+
+    @classmethod
+    def from_matrix(cls, entity_names, adjacency):
+        """
+        Args:
+            entity_names (List of str)
+            adjacency (scipy.sparse matrix, [E, E]): symmetric edge weights
+        """
+        adjacency = sp.csr_matrix(adjacency)
+        adjacency.setdiag(0)
+        adjacency.eliminate_zeros()
+        adjacency.sort_indices()
+        return cls(
+            list(entity_names),
+            adjacency.indptr.astype(np.int64),
+            adjacency.indices.astype(np.int32),
+            adjacency.data.astype(np.float32),
+        )
+
+    @classmethod
+    def from_cooccurrence(cls, entity_index):
+        """The RELATED_TO graph: entities are linked by the number of papers they share
+        """
+        return cls.from_matrix(entity_index.entity_names, entity_index.cooccurrence)
+
+    @classmethod
+    def build(cls, edges):
+        """The CONNECT graph, edges are undirected and weights of repeated edges add up
+        Args:
+            edges (iterable of (entity_name_1, entity_name_2, strength))
+        """
+        entity_rows = {}
+        rows, columns, weights = [], [], []
+        for entity_name_1, entity_name_2, strength in edges:
+            rows.append(entity_rows.setdefault(entity_name_1, len(entity_rows)))
+            columns.append(entity_rows.setdefault(entity_name_2, len(entity_rows)))
+            weights.append(strength if strength is not None else 1)
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float32)
+        adjacency = sp.csr_matrix(
+            (np.concatenate([weights, weights]),
+             (np.concatenate([rows, columns]), np.concatenate([columns, rows]))),
+            shape=(len(entity_rows), len(entity_rows)),
+        )
+        adjacency.sum_duplicates()
+        return cls.from_matrix(list(entity_rows.keys()), adjacency)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.savez(
+            os.path.join(path, "entity_graph.npz"),
+            indptr=self.indptr,
+            neighbours=self.neighbours,
+            weights=self.weights,
+        )
+        with open(os.path.join(path, "entity_names.json"), "w", encoding="utf8") as f:
+            json.dump(self.entity_names, f, ensure_ascii=False)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "entity_graph.npz")) and os.path.exists(
+            os.path.join(path, "entity_names.json")
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(os.path.join(path, "entity_graph.npz"))
+        with open(os.path.join(path, "entity_names.json"), "r", encoding="utf8") as f:
+            entity_names = json.load(f)
+        return cls(entity_names, data["indptr"], data["neighbours"], data["weights"])
+
+    def expand_rows(self, seed_rows, hops=1, min_weight=0, max_per_hop=0):
+        """Breadth-first search from `seed_rows`
+        Args:
+            seed_rows (List of int)
+            hops (int): number of hops
+            min_weight: only follow edges heavier than `min_weight`
+            max_per_hop (int): keep the heaviest `max_per_hop` new entities of each hop
+                (weight of the heaviest edge reaching it), 0 for no limit
+        Returns:
+            rows (np.ndarray of int): reached entities in the order of hops, rows of a hop
+                ascending (heaviest first if capped), seeds excluded
+        """
+        visited = np.zeros(len(self.entity_names), dtype=bool)
+        frontier = np.unique(np.asarray(seed_rows, dtype=np.int64))
+        visited[frontier] = True
+        reached = []
+        for _ in range(hops):
+            if len(frontier) == 0:
+                break
+            starts, ends = self.indptr[frontier], self.indptr[frontier + 1]
+            positions = np.concatenate(
+                [np.arange(start, end) for start, end in zip(starts, ends)]
+            )
+            if len(positions) == 0:
+                break
+            neighbours = self.neighbours[positions]
+            weights = self.weights[positions]
+            keep = (weights > min_weight) & ~visited[neighbours]
+            neighbours, weights = neighbours[keep], weights[keep]
+            if len(neighbours) == 0:
+                break
+            candidates, inverse = np.unique(neighbours, return_inverse=True)
+            best = np.zeros(len(candidates), dtype=np.float32)
+            np.maximum.at(best, inverse, weights)
+            if max_per_hop > 0 and len(candidates) > max_per_hop:
+                order = np.lexsort((candidates, -best))[:max_per_hop]
+                candidates = candidates[order]
+            visited[candidates] = True
+            reached.append(candidates)
+            frontier = np.sort(candidates)
+        if not reached:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(reached)
+
+    def neighbours_of(self, entity_name, hops=1, min_weight=0, max_per_hop=0):
+        """Entities reached from `entity_name` in at most `hops` hops, see `expand_rows`
+        """
+        if entity_name not in self.entity_rows:
+            return []
+        rows = self.expand_rows(
+            [self.entity_rows[entity_name]], hops=hops,
+            min_weight=min_weight, max_per_hop=max_per_hop,
+        )
+        return [self.entity_names[row] for row in rows]
+
+
+def load_or_build_entity_graph(path, get_edges, rebuild=False):
+    """Load the CONNECT entity graph from `path`, or build it with `get_edges()` and save it
+    """
+    if not rebuild and EntityGraph.exists(path):
+        graph = EntityGraph.load(path)
+        logger.debug(f"load entity graph from {path} ({len(graph)} entities)")
+        return graph
+    graph = EntityGraph.build(get_edges())
+    graph.save(path)
+    logger.debug(f"save entity graph to {path} ({len(graph)} entities)")
+    return graph
@@ -0,0 +1,298 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.entity_index
+
+File Name : entity_index.py
+
+Description : In-memory inverted index of the (Entity)-[:RELATED_TO]->(Paper) edges.
+    Every entity maps to the sorted rows of its papers (a CSR matrix), every paper to the
+    rows of its entities, so entity expansion, document frequencies and paper unions are
+    array operations instead of Cypher traversals. The entity-entity co-occurrence counts
+    (E @ E.T of the entity-paper matrix E) are materialized as a CSR matrix as well, so
+    entity expansion is a thresholded lookup of one row. New edges update it incrementally.
+
+Creation Date : 2026-10-16
+"""
+import os
+import json
+import numpy as np
+import scipy.sparse as sp
+from loguru import logger
+
+
+class EntityIndex:
+    """
+    entity_names (List of str): entity of each row
+    paper_ids (int64, [P]): sorted hash_ids of all papers with entities
+    entity_indptr, entity_papers: papers of entity e are
+        entity_papers[entity_indptr[e]:entity_indptr[e + 1]] (sorted paper rows)
+    paper_indptr, paper_entities: entities of paper row p, the transposed CSR
+    cooccurrence (scipy.sparse.csr_matrix of int32, [E, E]): number of papers shared by
+        two entities, zero diagonal, computed from the edges if not given
+    """
+
+    def __init__(
+        self, entity_names, paper_ids, entity_indptr, entity_papers, paper_indptr, paper_entities,
+        cooccurrence=None,
+    ):
+        self.entity_names = entity_names
+        self.entity_rows = {name: i for i, name in enumerate(entity_names)}
+        self.paper_ids = paper_ids
+        self.entity_indptr = entity_indptr
+        self.entity_papers = entity_papers
+        self.paper_indptr = paper_indptr
+        self.paper_entities = paper_entities
+        if cooccurrence is None:
+            relation = self.relation_matrix()
+            cooccurrence = self.cooccurrence_of(relation, relation)
+        self.cooccurrence = cooccurrence
+
+    def __len__(self):
+        return len(self.entity_names)
+
+    @property
+    def document_frequency(self):
+        """Number of papers related to each entity
+        """
+        return np.diff(self.entity_indptr)
+
+    def relation_matrix(self):
+        """The binary entity-paper matrix, [E, P]
+        """
+        return sp.csr_matrix(
+            (np.ones(len(self.entity_papers), dtype=np.int32), self.entity_papers, self.entity_indptr),
+            shape=(len(self.entity_names), len(self.paper_ids)),
+        )
+
+    @staticmethod
+    def cooccurrence_of(left, right):
+        """left @ right.T without the diagonal, as int32 CSR with sorted indices
+        """
+        cooccurrence = (left @ right.T).tocsr()
+        cooccurrence.setdiag(0)
+        cooccurrence.eliminate_zeros()
+        cooccurrence.sort_indices()
+        return cooccurrence.astype(np.int32)
+
+    @classmethod
+    def build(cls, edges):
+        """
+        Args:
+            edges (iterable of (entity_name, hash_id)): RELATED_TO edges
+        Returns:
+            EntityIndex
+        """
+        entity_rows = {}
+        entities = []
+        papers = []
+        for entity_name, hash_id in edges:
+            entities.append(entity_rows.setdefault(entity_name, len(entity_rows)))
+            papers.append(hash_id)
+        paper_ids, paper_rows = np.unique(np.asarray(papers, dtype=np.int64), return_inverse=True)
+        relation = sp.csr_matrix(
+            (np.ones(len(entities), dtype=np.int32), (np.asarray(entities, dtype=np.int64), paper_rows)),
+            shape=(len(entity_rows), len(paper_ids)),
+        )
+        relation.sum_duplicates()
+        relation.sort_indices()
+        transposed = relation.T.tocsr()
+        transposed.sort_indices()
+        return cls(
+            list(entity_rows.keys()),
+            paper_ids,
+            relation.indptr.astype(np.int64),
+            relation.indices.astype(np.int32),
+            transposed.indptr.astype(np.int64),
+            transposed.indices.astype(np.int32),
+        )
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.savez(
+            os.path.join(path, "entity_index.npz"),
+            paper_ids=self.paper_ids,
+            entity_indptr=self.entity_indptr,
+            entity_papers=self.entity_papers,
+            paper_indptr=self.paper_indptr,
+            paper_entities=self.paper_entities,
+            cooccur_indptr=self.cooccurrence.indptr.astype(np.int64),
+            cooccur_entities=self.cooccurrence.indices.astype(np.int32),
+            cooccur_counts=self.cooccurrence.data.astype(np.int32),
+        )
+        with open(os.path.join(path, "entity_names.json"), "w", encoding="utf8") as f:
+            json.dump(self.entity_names, f, ensure_ascii=False)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "entity_index.npz")) and os.path.exists(
+            os.path.join(path, "entity_names.json")
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(os.path.join(path, "entity_index.npz"))
+        with open(os.path.join(path, "entity_names.json"), "r", encoding="utf8") as f:
+            entity_names = json.load(f)
+        cooccurrence = None
+        # snapshots saved before the co-occurrence table compute it on load
+        if "cooccur_indptr" in data.files:
+            cooccurrence = sp.csr_matrix(
+                (data["cooccur_counts"], data["cooccur_entities"], data["cooccur_indptr"]),
+                shape=(len(entity_names), len(entity_names)),
+            )
+        return cls(
+            entity_names,
+            data["paper_ids"],
+            data["entity_indptr"],
+            data["entity_papers"],
+            data["paper_indptr"],
+            data["paper_entities"],
+            cooccurrence,
+        )
+
+    def add_edges(self, edges):
+        """Add new RELATED_TO edges. The co-occurrence counts are updated from the new edges
+        only: with E the current and D the new entity-paper edges,
+        (E + D) @ (E + D).T = E @ E.T + D @ E.T + E @ D.T + D @ D.T
+        Args:
+            edges (iterable of (entity_name, hash_id))
+        Returns:
+            added (int): number of edges which did not exist
+        """
+        entities, papers = [], []
+        for entity_name, hash_id in edges:
+            if entity_name not in self.entity_rows:
+                self.entity_rows[entity_name] = len(self.entity_names)
+                self.entity_names.append(entity_name)
+            entities.append(self.entity_rows[entity_name])
+            papers.append(hash_id)
+        if not entities:
+            return 0
+        paper_ids = np.union1d(self.paper_ids, np.asarray(papers, dtype=np.int64))
+        shape = (len(self.entity_names), len(paper_ids))
+        # the current edges in the new (entity, paper) coordinates
+        old_columns = np.searchsorted(paper_ids, self.paper_ids)[self.entity_papers]
+        old_rows = np.repeat(np.arange(len(self.entity_indptr) - 1), np.diff(self.entity_indptr))
+        relation = sp.csr_matrix(
+            (np.ones(len(old_rows), dtype=np.int32), (old_rows, old_columns)), shape=shape
+        )
+        new = sp.csr_matrix(
+            (np.ones(len(entities), dtype=np.int32),
+             (np.asarray(entities, dtype=np.int64), np.searchsorted(paper_ids, papers))),
+            shape=shape,
+        )
+        new.sum_duplicates()
+        new.data[:] = 1
+        new = new - new.multiply(relation)
+        new.eliminate_zeros()
+        added = int(new.nnz)
+        if added == 0:
+            return 0
+        cooccurrence = self.cooccurrence.copy()
+        cooccurrence.resize((shape[0], shape[0]))
+        delta = (new @ relation.T).tocsr()
+        cooccurrence = cooccurrence + delta + delta.T + self.cooccurrence_of(new, new)
+        cooccurrence.setdiag(0)
+        cooccurrence.eliminate_zeros()
+        cooccurrence.sort_indices()
+        relation = (relation + new).tocsr()
+        relation.sort_indices()
+        transposed = relation.T.tocsr()
+        transposed.sort_indices()
+        self.paper_ids = paper_ids
+        self.entity_indptr = relation.indptr.astype(np.int64)
+        self.entity_papers = relation.indices.astype(np.int32)
+        self.paper_indptr = transposed.indptr.astype(np.int64)
+        self.paper_entities = transposed.indices.astype(np.int32)
+        self.cooccurrence = cooccurrence.astype(np.int32)
+        return added
+
+    def _entity_rows_of(self, entity_names):
+        return [self.entity_rows[name] for name in entity_names if name in self.entity_rows]
+
+    def _paper_rows_of(self, paper_ids):
+        paper_ids = np.asarray(list(paper_ids), dtype=np.int64)
+        if len(self.paper_ids) == 0 or len(paper_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.paper_ids, paper_ids), len(self.paper_ids) - 1)
+        return rows[self.paper_ids[rows] == paper_ids]
+
+    def papers_of(self, entity_row):
+        return self.entity_papers[self.entity_indptr[entity_row] : self.entity_indptr[entity_row + 1]]
+
+    def entities_of(self, paper_row):
+        return self.paper_entities[self.paper_indptr[paper_row] : self.paper_indptr[paper_row + 1]]
+
+    def find_paper_by_entity(self, entity_name):
+        """Find all papers with `entity_name`
+        Returns:
+            res (List of hash_ids)
+        """
+        if entity_name not in self.entity_rows:
+            return []
+        return self.paper_ids[self.papers_of(self.entity_rows[entity_name])].tolist()
+
+    def find_papers_by_entities(self, entity_names):
+        """Union of the papers of all `entity_names`
+        Returns:
+            res (List of hash_ids)
+        """
+        rows = self._entity_rows_of(entity_names)
+        if not rows:
+            return []
+        paper_rows = np.unique(np.concatenate([self.papers_of(row) for row in rows]))
+        return self.paper_ids[paper_rows].tolist()
+
+    def get_entities_related_paper_num(self, entity_names):
+        """Entity name -> number of related papers, entities without papers are left out
+        """
+        document_frequency = self.document_frequency
+        return {
+            name: int(document_frequency[self.entity_rows[name]])
+            for name in entity_names
+            if name in self.entity_rows
+        }
+
+    def find_entities_by_paper_list(self, hash_ids):
+        """All entities of a list of papers (an entity appears once per paper)
+        """
+        paper_rows = self._paper_rows_of(hash_ids)
+        if len(paper_rows) == 0:
+            return []
+        entity_rows = np.concatenate([self.entities_of(row) for row in paper_rows])
+        return [self.entity_names[row] for row in entity_rows]
+
+    def cooccurring_entities_of(self, entity_row):
+        """Rows of the entities sharing papers with `entity_row` and the numbers of papers
+        """
+        start, end = self.cooccurrence.indptr[entity_row], self.cooccurrence.indptr[entity_row + 1]
+        return self.cooccurrence.indices[start:end], self.cooccurrence.data[start:end]
+
+    def related_entities_of(self, entity_name, k=3):
+        """Entities co-occurring with `entity_name` in more than `k` papers
+        """
+        if entity_name not in self.entity_rows:
+            return []
+        entity_rows, counts = self.cooccurring_entities_of(self.entity_rows[entity_name])
+        return [self.entity_names[e] for e in entity_rows[counts > k]]
+
+    def find_related_entities_by_entity_list(self, entity_names, k=3):
+        """Entities co-occurring with any of `entity_names` in more than `k` papers
+        """
+        related_entities = set()
+        for entity_name in entity_names:
+            related_entities.update(self.related_entities_of(entity_name, k=k))
+        return list(related_entities)
+
+def load_or_build_entity_index(path, get_edges, rebuild=False):
+    """Load the entity index snapshot from `path`, or build it with `get_edges()` and save it
+    """
+    if not rebuild and EntityIndex.exists(path):
+        index = EntityIndex.load(path)
+        logger.debug(f"load entity index from {path} ({len(index)} entities)")
+        return index
+    index = EntityIndex.build(get_edges())
+    index.save(path)
+    logger.debug(f"save entity index to {path} ({len(index)} entities)")
+    return index
@@ -7,6 +7,7 @@ from collections import Counter
 from huggingface_hub import hf_hub_download
 from sentence_transformers import SentenceTransformer
 from .header import get_dir
+from .onnx_embedding import load_onnx_backend
 
 ENV_CHECKED = False
 EMBEDDING_CHECKED = False
@@ -183,6 +184,11 @@ class EmbeddingModel:
                 # 设置 jina-embeddings-v3 的默认任务
                 if "jina-embeddings-v3" in config.DEFAULT.embedding:
                     cls._instance.embedding_model[0].default_task = config.DEFAULT.embedding_task
+                # cpu 上可选 onnxruntime (int8) 后端，不支持或一致性检查失败时保留 PyTorch 模型
+                if device == "cpu":
+                    cls._instance.embedding_model = load_onnx_backend(
+                        config, cls._instance.embedding_model, model_path
+                    )
                 print(f"==== using device {device} ====")
             finally:
                 # 恢复原始环境变量
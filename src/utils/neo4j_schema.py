@@ -0,0 +1,169 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.neo4j_schema
+
+File Name : neo4j_schema.py
+
+Description : Constraints and indexes of the neo4j database. Paper.hash_id and Entity.name
+    are unique (backing the MATCH/MERGE lookups), Paper(venue_name, year) has a range index
+    for `select_paper`, and one vector index is created for every embedding property of
+    Paper nodes (e.g. `background_embedding_jina_v3_text_matching`), with the dimension of
+    the loaded embedding model.
+
+Creation Date : 2026-10-16
+"""
+import re
+import time
+import threading
+from loguru import logger
+
+
+class SchemaManager:
+    # name, label, property
+    UNIQUE_CONSTRAINTS = [
+        ("paper_hash_id_unique", "Paper", "hash_id"),
+        ("entity_name_unique", "Entity", "name"),
+    ]
+    # name, label, properties
+    RANGE_INDEXES = [
+        ("paper_venue_name_year", "Paper", ["venue_name", "year"]),
+    ]
+
+    # a lookup of an embedding without index re-reads the indexes at most this often, so
+    # an index created by `paper_manager.py vector-index` is used without a restart
+    MISS_REFRESH_SECONDS = 60
+
+    def __init__(self, driver) -> None:
+        self.driver = driver
+        self.lock = threading.Lock()
+        self.vector_indexes = None
+        self.refreshed_at = 0.0
+
+    @staticmethod
+    def vector_index_name(type_name):
+        """e.g. `background_embedding_llm_embedder` -> `paper_background_embedding_llm_embedder`
+        """
+        return "paper_" + re.sub(r"[^0-9A-Za-z_]", "_", type_name)
+
+    def show_indexes(self):
+        query = """
+            SHOW INDEXES
+            YIELD name, type, entityType, labelsOrTypes, properties, state
+            RETURN name, type, entityType, labelsOrTypes, properties, state
+        """
+        with self.driver.session() as session:
+            return session.execute_read(lambda tx: tx.run(query).data())
+
+    def show_constraints(self):
+        query = """
+            SHOW CONSTRAINTS
+            YIELD name, type, labelsOrTypes, properties
+            RETURN name, type, labelsOrTypes, properties
+        """
+        with self.driver.session() as session:
+            return session.execute_read(lambda tx: tx.run(query).data())
+
+    def missing_schema(self):
+        """Constraints and range indexes of `UNIQUE_CONSTRAINTS` and `RANGE_INDEXES` which
+        do not exist (under any name) or are not online
+        Returns:
+            missing (List of str): e.g. ["UNIQUE Paper.hash_id"]
+        """
+        unique = {
+            (record["labelsOrTypes"][0], tuple(record["properties"]))
+            for record in self.show_constraints()
+            if "UNIQUENESS" in record["type"] and record["labelsOrTypes"]
+        }
+        ranges = {
+            (record["labelsOrTypes"][0], tuple(record["properties"]))
+            for record in self.show_indexes()
+            if record["type"] == "RANGE" and record["labelsOrTypes"] and record["state"] == "ONLINE"
+        }
+        missing = []
+        for _, label, prop in self.UNIQUE_CONSTRAINTS:
+            if (label, (prop,)) not in unique:
+                missing.append(f"UNIQUE {label}.{prop}")
+        for _, label, props in self.RANGE_INDEXES:
+            if (label, tuple(props)) not in ranges:
+                missing.append(f"RANGE {label}({', '.join(props)})")
+        return missing
+
+    def create_schema(self, wait_seconds=300):
+        """Create the constraints and range indexes if not exist, wait until they are online
+        Returns:
+            missing (List of str): what is still missing afterwards, see `missing_schema`
+        """
+        queries = [
+            f"CREATE CONSTRAINT `{name}` IF NOT EXISTS FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE"
+            for name, label, prop in self.UNIQUE_CONSTRAINTS
+        ] + [
+            f"CREATE INDEX `{name}` IF NOT EXISTS FOR (n:{label}) ON ({', '.join(f'n.{prop}' for prop in props)})"
+            for name, label, props in self.RANGE_INDEXES
+        ]
+        with self.driver.session() as session:
+            for query in queries:
+                try:
+                    session.execute_write(lambda tx: tx.run(query).data())
+                    logger.info(f"{query}: done")
+                except Exception as e:
+                    # e.g. duplicated hash_id/name values, or an equivalent schema under another name
+                    logger.error(f"{query}: {e}")
+            session.run("CALL db.awaitIndexes($seconds)", seconds=wait_seconds).consume()
+        return self.missing_schema()
+
+    def get_vector_indexes(self, refresh=False):
+        """Embedding property of Paper nodes -> name of its vector index, cached until refresh
+        """
+        with self.lock:
+            if self.vector_indexes is None or refresh:
+                self.refreshed_at = time.monotonic()
+                self.vector_indexes = {
+                    record["properties"][0]: record["name"]
+                    for record in self.show_indexes()
+                    if record["type"] == "VECTOR"
+                    and record["labelsOrTypes"] == ["Paper"]
+                    and record["properties"]
+                    and record["state"] == "ONLINE"
+                }
+            return self.vector_indexes
+
+    def vector_index_of(self, type_name):
+        """Name of the online vector index on `Paper.{type_name}`, None if not indexed. A miss
+        refreshes the cached indexes if they are older than MISS_REFRESH_SECONDS
+        """
+        index_name = self.get_vector_indexes().get(type_name, None)
+        if index_name is None and time.monotonic() - self.refreshed_at > self.MISS_REFRESH_SECONDS:
+            index_name = self.get_vector_indexes(refresh=True).get(type_name, None)
+        return index_name
+
+    def create_vector_index(self, type_name, dimension, similarity_function="cosine", wait_seconds=300):
+        """Create the vector index of `Paper.{type_name}` if not exists, wait until it is online
+        Args:
+            type_name: "abstract_embedding", "background_embedding_jina_v3_query", etc.
+            dimension (int): dimension of the embedding model
+        Returns:
+            index_name (str)
+        """
+        if not re.fullmatch(r"[0-9A-Za-z_]+", type_name):
+            raise ValueError(f"invalid embedding property name: {type_name}")
+        if similarity_function not in ("cosine", "euclidean"):
+            raise ValueError(f"invalid similarity function: {similarity_function}")
+        index_name = self.vector_index_name(type_name)
+        # schema commands do not take parameters, all parts are validated above
+        query = f"""
+            CREATE VECTOR INDEX `{index_name}` IF NOT EXISTS
+            FOR (p:Paper) ON (p.`{type_name}`)
+            OPTIONS {{indexConfig: {{
+            `vector.dimensions`: {int(dimension)},
+            `vector.similarity_function`: '{similarity_function}'
+            }}}}
+            """
+        with self.driver.session() as session:
+            session.execute_write(lambda tx: tx.run(query).data())
+            session.run(
+                "CALL db.awaitIndex($name, $seconds)", name=index_name, seconds=wait_seconds
+            ).consume()
+        logger.info(f"vector index {index_name} on Paper.{type_name} ({dimension} dimensions) is online")
+        self.get_vector_indexes(refresh=True)
+        return index_name
@@ -0,0 +1,281 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.onnx_embedding
+
+File Name : onnx_embedding.py
+
+Description : ONNX Runtime backend of the embedding model for cpu-only hosts, selected by
+    `DEFAULT.embedding_backend` ("onnx" or "onnx-int8"). The transformer of the loaded
+    SentenceTransformer is exported to ONNX once (and dynamically quantized to int8 weights
+    for "onnx-int8"), next to the model files. Tokenization, pooling and normalization are
+    those of the SentenceTransformer, so vectors stay comparable with the ones stored in
+    the database; a probe of the two backends is compared at load time and the PyTorch
+    model is kept if the cosine drift is above `DEFAULT.embedding_parity_max_drift`.
+    Exports are written to a temporary file and moved into place, with the fingerprint of
+    the model weights next to them: an interrupted export is never loaded, and updated
+    weights are exported again.
+    jina-embeddings-v3 is not exported: its custom XLM-RoBERTa picks a LoRA adapter per
+    task at run time (custom_st.py), which the plain export does not trace.
+
+Creation Date : 2026-10-16
+"""
+import os
+import json
+import numpy as np
+from loguru import logger
+
+# models whose architecture the export does not support, with the reason
+ONNX_UNSUPPORTED = {
+    "jinaai/jina-embeddings-v3": "custom architecture with task LoRA adapters",
+}
+
+# texts encoded by both backends at load time
+PROBE_TEXTS = [
+    "Retrieval-augmented generation of scientific ideas.",
+    "We propose a graph of entities extracted from paper abstracts and link entities that "
+    "co-occur in the same sentence, then expand the query entities over several hops.",
+    "Background: large language models hallucinate citations. Contribution: a retriever "
+    "which combines semantic neighbours, co-citations and clustering of candidate papers.",
+]
+
+
+def cosine_drift(embeddings, reference):
+    """1 - cosine similarity of each row of `embeddings` and `reference`
+    """
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    reference = np.atleast_2d(np.asarray(reference, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1)
+    return 1 - np.sum(embeddings * reference, axis=1) / np.maximum(norms, 1e-12)
+
+
+def embedding_backend_of(model):
+    """The backend actually serving `model`: "onnx" or "onnx-int8" for an
+    `OnnxEmbeddingModel`, "torch" otherwise (also when `load_onnx_backend` fell back)
+    """
+    return getattr(model, "backend", "torch")
+
+
+def cache_model_name(model_name, model):
+    """The model part of the embedding cache keys, `model_name` suffixed with the backend
+    of `model` if it is not PyTorch, so ONNX (int8) vectors never replace PyTorch ones
+    """
+    backend = embedding_backend_of(model)
+    if backend == "torch":
+        return model_name
+    return f"{model_name}@{backend}"
+
+
+# weight files of a model directory, see `model_fingerprint`
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt")
+
+
+def model_fingerprint(model_dir):
+    """Name, size and modification time of the weight files of `model_dir` (the exports
+    under `model_dir/onnx` excluded), changes when the weights are updated
+    """
+    fingerprint = []
+    for root, dirs, files in os.walk(model_dir):
+        dirs[:] = sorted(name for name in dirs if name != "onnx")
+        for name in sorted(files):
+            if name.endswith(WEIGHT_SUFFIXES):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                fingerprint.append(
+                    [os.path.relpath(path, model_dir), stat.st_size, stat.st_mtime_ns]
+                )
+    return fingerprint
+
+
+def is_exported(path, fingerprint):
+    """`path` exists and was exported from the weights of `fingerprint`
+    """
+    try:
+        with open(f"{path}.source.json", "r", encoding="utf8") as f:
+            return os.path.exists(path) and json.load(f) == fingerprint
+    except (OSError, ValueError):
+        return False
+
+
+def replace_export(tmp_path, path, fingerprint):
+    """Move a finished export into place, then record the weights it was exported from
+    """
+    os.replace(tmp_path, path)
+    tmp_source = f"{path}.source.json.{os.getpid()}.tmp"
+    with open(tmp_source, "w", encoding="utf8") as f:
+        json.dump(fingerprint, f)
+    os.replace(tmp_source, f"{path}.source.json")
+
+
+def export_onnx(model, onnx_dir, quantize=False, opset=14, fingerprint=None):
+    """Export the transformer of a SentenceTransformer to `onnx_dir/model.onnx`, and its
+    int8 dynamic quantization to `onnx_dir/model_int8.onnx`, if not exported from the same
+    weights yet
+    Args:
+        fingerprint: `model_fingerprint` of the model weights
+    Returns:
+        onnx_path (str): the model to run
+    """
+    import torch
+
+    transformer = model[0]
+    auto_model = transformer.auto_model
+    os.makedirs(onnx_dir, exist_ok=True)
+    onnx_path = os.path.join(onnx_dir, "model.onnx")
+    # a temporary file per process: concurrent exports do not write the same file
+    tmp_suffix = f".{os.getpid()}.tmp"
+    if not is_exported(onnx_path, fingerprint):
+        features = transformer.tokenize(PROBE_TEXTS[:1])
+        input_names = [
+            name for name in ["input_ids", "attention_mask", "token_type_ids"] if name in features
+        ]
+
+        class LastHiddenState(torch.nn.Module):
+            def forward(self, *inputs):
+                return auto_model(**dict(zip(input_names, inputs)), return_dict=False)[0]
+
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+        auto_model.eval()
+        with torch.no_grad():
+            torch.onnx.export(
+                LastHiddenState(),
+                tuple(features[name].cpu() for name in input_names),
+                onnx_path + tmp_suffix,
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=opset,
+            )
+        replace_export(onnx_path + tmp_suffix, onnx_path, fingerprint)
+        logger.info(f"export embedding model to {onnx_path}")
+    if not quantize:
+        return onnx_path
+    quantized_path = os.path.join(onnx_dir, "model_int8.onnx")
+    if not is_exported(quantized_path, fingerprint):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantize_dynamic(onnx_path, quantized_path + tmp_suffix, weight_type=QuantType.QInt8)
+        replace_export(quantized_path + tmp_suffix, quantized_path, fingerprint)
+        logger.info(f"quantize embedding model to {quantized_path}")
+    return quantized_path
+
+
+class OnnxEmbeddingModel:
+    """
+    onnx_path (str): the exported transformer
+    model (SentenceTransformer): the model it was exported from, for its tokenizer, pooling
+        and normalization
+    num_threads (int): onnxruntime intra-op threads, 0 for the onnxruntime default
+    backend (str): "onnx" or "onnx-int8", see `embedding_backend_of`
+    """
+
+    def __init__(self, onnx_path, model, num_threads=0, backend="onnx") -> None:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.onnx_path = onnx_path
+        self.backend = backend
+        self.session = onnxruntime.InferenceSession(
+            onnx_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.transformer = model[0]
+        pooling = model[1]
+        if pooling.pooling_mode_cls_token:
+            self.pooling_mode = "cls"
+        elif pooling.pooling_mode_max_tokens:
+            self.pooling_mode = "max"
+        else:
+            self.pooling_mode = "mean"
+        self.normalize = any(type(module).__name__ == "Normalize" for module in model)
+        self.dimension = model.get_sentence_embedding_dimension()
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def pool(self, hidden, attention_mask):
+        if self.pooling_mode == "cls":
+            return hidden[:, 0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        if self.pooling_mode == "max":
+            return np.where(mask > 0, hidden, -1e9).max(axis=1)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(
+        self, sentences, batch_size=32, convert_to_tensor=False, convert_to_numpy=True,
+        normalize_embeddings=False, device=None, show_progress_bar=None, **kwargs
+    ):
+        """`SentenceTransformer.encode` on onnxruntime, `device` is ignored
+        Returns:
+            embeddings (np.ndarray, or torch.Tensor if `convert_to_tensor`)
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        sentences = list(sentences)
+        # longest first, as SentenceTransformer does, so batches need little padding
+        order = np.argsort([-len(sentence) for sentence in sentences], kind="stable")
+        embeddings = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            features = self.transformer.tokenize([sentences[row] for row in rows])
+            inputs = {
+                name: value.cpu().numpy()
+                for name, value in features.items()
+                if name in self.input_names
+            }
+            hidden = self.session.run(None, inputs)[0]
+            embeddings[rows] = self.pool(hidden, inputs["attention_mask"])
+        if self.normalize or normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        if single:
+            embeddings = embeddings[0]
+        if convert_to_tensor:
+            import torch
+
+            return torch.from_numpy(embeddings)
+        return embeddings
+
+
+def load_onnx_backend(config, model, model_dir):
+    """The onnxruntime version of `model` if `DEFAULT.embedding_backend` asks for it and it
+    passes the parity probe, otherwise `model` itself
+    Args:
+        model (SentenceTransformer): the loaded PyTorch model
+        model_dir (str): local directory of the model, the export is kept in `model_dir/onnx`
+    """
+    backend = config.DEFAULT.get("embedding_backend", "torch")
+    if backend not in ["onnx", "onnx-int8"]:
+        return model
+    if config.DEFAULT.embedding in ONNX_UNSUPPORTED:
+        logger.warning(
+            f"{config.DEFAULT.embedding} cannot be exported to ONNX "
+            f"({ONNX_UNSUPPORTED[config.DEFAULT.embedding]}), use the PyTorch backend"
+        )
+        return model
+    try:
+        onnx_path = export_onnx(
+            model, os.path.join(model_dir, "onnx"), quantize=backend == "onnx-int8",
+            fingerprint=model_fingerprint(model_dir),
+        )
+        onnx_model = OnnxEmbeddingModel(
+            onnx_path, model,
+            num_threads=int(config.DEFAULT.get("embedding_onnx_threads", 0)),
+            backend=backend,
+        )
+    except Exception as e:
+        logger.warning(f"load {backend} backend failed, use the PyTorch backend: {e}")
+        return model
+    drift = cosine_drift(onnx_model.encode(PROBE_TEXTS), model.encode(PROBE_TEXTS)).max()
+    max_drift = float(config.DEFAULT.get("embedding_parity_max_drift", 0.01))
+    if drift > max_drift:
+        logger.warning(
+            f"{backend} backend drifts {drift:.2e} > {max_drift:.2e} from PyTorch, "
+            f"use the PyTorch backend"
+        )
+        return model
+    logger.info(f"use {backend} embedding backend {onnx_path} (probe drift {drift:.2e})")
+    return onnx_model
@@ -0,0 +1,111 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.paper_cache
+
+File Name : paper_cache.py
+
+Description : Bounded, thread-safe LRU/TTL cache of paper records keyed by hash_id, so
+    hot papers are not re-fetched from neo4j on every retrieval. Writes to a paper must
+    invalidate its entry.
+
+Creation Date : 2026-10-16
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class PaperRecordCache:
+    """
+    max_size (int): number of papers kept, 0 disables the cache
+    ttl (float): seconds a record stays valid, 0 means no expiry
+    """
+
+    def __init__(self, max_size=4096, ttl=600) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_size=None, ttl=None):
+        with self.lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if ttl is not None:
+                self.ttl = ttl
+            self._evict()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def _evict(self):
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, hash_ids):
+        """
+        Returns:
+            records (dict of hash_id -> record): copies of the valid cached records
+            missing (List of hash_id): hash_ids to fetch from the database
+        """
+        records, missing = {}, []
+        now = time.monotonic()
+        with self.lock:
+            for hash_id in hash_ids:
+                entry = self.cache.get(hash_id)
+                if entry is not None and (self.ttl <= 0 or now - entry[0] < self.ttl):
+                    self.cache.move_to_end(hash_id)
+                    records[hash_id] = dict(entry[1])
+                    self.hits += 1
+                else:
+                    if entry is not None:
+                        del self.cache[hash_id]
+                    missing.append(hash_id)
+                    self.misses += 1
+        return records, missing
+
+    def put_many(self, records):
+        """
+        Args:
+            records (iterable of dict): records with a `hash_id`
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self.lock:
+            for record in records:
+                self.cache[record["hash_id"]] = (now, dict(record))
+                self.cache.move_to_end(record["hash_id"])
+            self._evict()
+
+    def invalidate(self, hash_id):
+        with self.lock:
+            self.cache.pop(hash_id, None)
+
+    def invalidate_many(self, hash_ids):
+        with self.lock:
+            for hash_id in hash_ids:
+                self.cache.pop(hash_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.cache),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+            }
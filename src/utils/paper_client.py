@@ -17,11 +17,86 @@ import os
 import re
 import json
 import torch
+import numpy as np
 from tqdm import tqdm
 from neo4j import GraphDatabase
-from collections import defaultdict, deque
+from itertools import combinations
+from collections import Counter, defaultdict, deque
 from py2neo import Graph, Node, Relationship
 from loguru import logger
+from .paper_cache import PaperRecordCache
+from .neo4j_schema import SchemaManager
+from .query_registry import QueryRegistry
+from .embedding_backfill import EmbeddingBackfill
+
+# properties of a paper record used by the retrievers and the idea generator
+PAPER_RECORD_FIELDS = [
+    "hash_id",
+    "title",
+    "venue_name",
+    "year",
+    "summary",
+    "motivation",
+    "contribution",
+    "methodology",
+    "detail_method",
+]
+# properties written by `add_paper_nodes`, all but the required ones default to None
+PAPER_NODE_FIELDS = [
+    "venue_name",
+    "year",
+    "title",
+    "pdf_url",
+    "abstract",
+    "introduction",
+    "reference",
+    "summary",
+    "motivation",
+    "contribution",
+    "methodology",
+    "ground_truth",
+    "reference_filter",
+    "conclusions",
+]
+PAPER_NODE_OPTIONAL_FIELDS = PAPER_NODE_FIELDS[4:] + ["cite"]
+
+
+def paper_record(fields, values):
+    """A paper dict of the projected `fields`, unset properties are left out as they are
+    when returning the node
+    """
+    return {field: value for field, value in zip(fields, values) if value is not None}
+
+
+def stack_paper_embeddings(records, paper_id_list, field_names):
+    """Stack the records of the `papers_embeddings` query
+    Returns:
+        embeddings (np.ndarray of float32, [N, len(field_names), D]): in the order of
+            `paper_id_list`, zeros for missing papers or fields
+    """
+    paper_embeddings = {record["hash_id"]: record["embeddings"] for record in records}
+    dimension = next(
+        (
+            len(embedding)
+            for embeddings in paper_embeddings.values()
+            for embedding in embeddings
+            if embedding is not None
+        ),
+        0,
+    )
+    embeddings = np.zeros(
+        (len(paper_id_list), len(field_names), dimension), dtype=np.float32
+    )
+    missing = 0
+    for i, paper_id in enumerate(paper_id_list):
+        for j, embedding in enumerate(paper_embeddings.get(paper_id, [None] * len(field_names))):
+            if embedding is not None:
+                embeddings[i, j] = embedding
+            else:
+                missing += 1
+    if missing > 0:
+        logger.warning(f"{missing} embeddings of {field_names} are missing, use zeros.")
+    return embeddings
 
 
 class PaperClient:
@@ -38,6 +113,13 @@ class PaperClient:
             self.driver = self.get_neo4j_driver()
             self.teb_model = None
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            self.paper_cache = PaperRecordCache()
+            self.schema = SchemaManager(self.driver)
+            self.queries = QueryRegistry()
+            # records buffered per round trip by the streaming bulk reads
+            self.fetch_size = 1000
+            # rows per UNWIND write of the batched ingestion methods
+            self.write_batch_size = 500
             PaperClient._initialized = True
 
     def get_neo4j_driver(self):
@@ -58,40 +140,55 @@ class PaperClient:
         paper_id = paper.get("hash_id", None)
         if paper_id is None:
             return None
-        query = f"""
-            MATCH (p:Paper {{hash_id: {paper_id}}})
-            RETURN p
-            """
+        query = self.queries.query("paper_by_hash_id")
         with self.driver.session() as session:
-            result = session.execute_read(lambda tx: tx.run(query).data())
+            result = session.execute_read(
+                lambda tx: tx.run(query, hash_id=paper_id).data()
+            )
         if result:
             paper_from_client = result[0]["p"]
             if paper_from_client is not None:
                 paper.update(paper_from_client)
 
-    def update_papers_from_client(self, paper_id_list):
-        """Read paper from the database (client)
+    def update_papers_from_client(self, paper_id_list, fields=None):
+        """Read paper from the database (client), only the projected `fields` are returned.
+        Records of the default projection are served from `self.paper_cache` when possible
         Args:
             paper_id_list (List of str)
+            fields (List of str): properties to read, default `PAPER_RECORD_FIELDS`
         Returns:
             List of papers read from the database
         """
-        query = """
-            UNWIND $papers AS paper
-            MATCH (p:Paper {hash_id: paper.hash_id})
-            RETURN p as result
-        """
-        paper_data = [
-            {
-                "hash_id": hash_id,
-            }
-            for hash_id in paper_id_list
-        ]
-        with self.driver.session() as session:
-            result = session.execute_read(
-                lambda tx: tx.run(query, papers=paper_data).data()
-            )
-        return [r["result"] for r in result]
+        use_cache = fields is None and self.paper_cache.enabled
+        fields = PAPER_RECORD_FIELDS if fields is None else fields
+        if use_cache:
+            cached, missing = self.paper_cache.get_many(paper_id_list)
+        else:
+            cached, missing = {}, list(paper_id_list)
+        fetched = {}
+        if missing:
+            query = self.queries.query("papers_record")
+            paper_data = [
+                {
+                    "hash_id": hash_id,
+                }
+                for hash_id in missing
+            ]
+            with self.driver.session() as session:
+                result = session.execute_read(
+                    lambda tx: tx.run(query, papers=paper_data, fields=fields).data()
+                )
+            for r in result:
+                fetched[r["hash_id"]] = paper_record(fields, r["values"])
+            if use_cache:
+                self.paper_cache.put_many(fetched.values())
+        papers = []
+        for hash_id in paper_id_list:
+            if hash_id in cached:
+                papers.append(cached[hash_id])
+            elif hash_id in fetched:
+                papers.append(dict(fetched[hash_id]))
+        return papers
 
     def get_paper_attribute(self, paper_id, attribute_name):
         """Get some attribute of a certain paper
@@ -101,12 +198,11 @@ class PaperClient:
         Returns:
             The certain attribute
         """
-        query = f"""
-            MATCH (p:Paper {{hash_id: {paper_id}}})
-            RETURN p.{attribute_name} AS attributeValue
-            """
+        query = self.queries.query("paper_attribute", attribute=attribute_name)
         with self.driver.session() as session:
-            result = session.execute_read(lambda tx: tx.run(query).data())
+            result = session.execute_read(
+                lambda tx: tx.run(query, hash_id=paper_id).data()
+            )
         if result:
             return result[0]["attributeValue"]
         else:
@@ -121,11 +217,7 @@ class PaperClient:
         Returns:
             List of certain attribute
         """
-        query = """
-            UNWIND $paper_ids AS paper_id
-            MATCH (p:Paper {hash_id: paper_id})
-            RETURN p.hash_id AS hash_id, p[$attribute_name] AS attributeValue
-        """
+        query = self.queries.query("papers_attribute")
         with self.driver.session() as session:
             result = session.execute_read(
                 lambda tx: tx.run(
@@ -135,6 +227,24 @@ class PaperClient:
         paper_attributes = [record["attributeValue"] for record in result]
         return paper_attributes
 
+    def get_papers_embeddings(self, paper_id_list, field_names):
+        """Get several embedding fields of a list of papers in one round trip
+        Args:
+            paper_id_list (List of int): hash_ids
+            field_names (List of str): e.g. ["background_embedding", "summary_embedding"]
+        Returns:
+            embeddings (np.ndarray of float32, [N, len(field_names), D]): in the order of
+                `paper_id_list`, zeros for missing papers or fields
+        """
+        query = self.queries.query("papers_embeddings")
+        with self.driver.session() as session:
+            result = session.execute_read(
+                lambda tx: tx.run(
+                    query, paper_ids=list(paper_id_list), field_names=list(field_names)
+                ).data()
+            )
+        return stack_paper_embeddings(result, paper_id_list, field_names)
+
     def get_paper_by_attribute(self, attribute_name, anttribute_value):
         """Get some paper whose `attribute_name` is exactly equal to `anttribute_value`
         Args:
@@ -143,12 +253,11 @@ class PaperClient:
         Returns:
             The first exact match paper object or None
         """
-        query = f"""
-            MATCH (p:Paper {{{attribute_name}: '{anttribute_value}'}})
-            RETURN p
-            """
+        query = self.queries.query("paper_by_attribute", attribute=attribute_name)
         with self.driver.session() as session:
-            result = session.execute_read(lambda tx: tx.run(query).data())
+            result = session.execute_read(
+                lambda tx: tx.run(query, value=anttribute_value).data()
+            )
         if result:
             return result[0]["p"]
         else:
@@ -190,14 +299,7 @@ class PaperClient:
             related_entities (List): list of entities who are related with any entity in `entity_names`
         """
         related_entities = set()
-        query = """
-            UNWIND $batch_entities AS entity_name
-            MATCH (e1:Entity {name: entity_name})-[:RELATED_TO]->(p:Paper)<-[:RELATED_TO]-(e2:Entity)
-            WHERE e1 <> e2
-            WITH e1, e2, COUNT(p) AS common_papers, entity_name
-            WHERE common_papers > $k
-            RETURN e2.name AS entities, entity_name AS source_entity, common_papers
-        """
+        query = self.queries.query("related_entities_of_entity_list")
         with self.driver.session() as session:
             result = session.execute_read(
                 lambda tx: tx.run(query, batch_entities=entity_names, k=k).data()
@@ -207,6 +309,21 @@ class PaperClient:
             related_entities.add(entity)
         return list(related_entities)
 
+    def find_related_entities_of_entity_list(self, entity_names, k=3):
+        """`find_related_entities_by_entity_list` grouped by the source entity
+        Returns:
+            related_entities (dict of entity -> List of related entities)
+        """
+        query = self.queries.query("related_entities_of_entity_list")
+        with self.driver.session() as session:
+            result = session.execute_read(
+                lambda tx: tx.run(query, batch_entities=entity_names, k=k).data()
+            )
+        related_entities = {entity_name: [] for entity_name in entity_names}
+        for record in result:
+            related_entities[record["source_entity"]].append(record["entities"])
+        return related_entities
+
     def find_entities_by_paper_list(self, hash_ids: list):
         """Retrieve entities for a list of papers:
         Args:
@@ -214,11 +331,7 @@ class PaperClient:
         Returns:
             entity_list (List of List of entities): each item is also a list, meaning all entities from a paper
         """
-        query = """
-            UNWIND $hash_ids AS hash_id
-            MATCH (e:Entity)-[:RELATED_TO]->(p:Paper {hash_id: hash_id})
-            RETURN hash_id, e.name AS entity_name
-        """
+        query = self.queries.query("entities_by_paper_list")
         with self.driver.session() as session:
             result = session.execute_read(
                 lambda tx: tx.run(query, hash_ids=hash_ids).data()
@@ -236,10 +349,7 @@ class PaperClient:
         Returns:
             res (List of hash_ids): papers with `entity_name`
         """
-        query = """
-            MATCH (e1:Entity {name: $entity_name})-[:RELATED_TO]->(p:Paper)
-            RETURN p.hash_id AS hash_id
-        """
+        query = self.queries.query("papers_by_entity")
         with self.driver.session() as session:
             result = session.execute_read(
                 lambda tx: tx.run(query, entity_name=entity_name).data()
@@ -329,55 +439,41 @@ class PaperClient:
         Returns:
             None
         """
-        if "summary" not in paper.keys():
-            paper["summary"] = None
-        if "abstract" not in paper.keys():
-            paper["abstract"] = None
-        if "introduction" not in paper.keys():
-            paper["introduction"] = None
-        if "reference" not in paper.keys():
-            paper["reference"] = None
-        if "cite" not in paper.keys():
-            paper["cite"] = None
-        if "motivation" not in paper.keys():
-            paper["motivation"] = None
-        if "contribution" not in paper.keys():
-            paper["contribution"] = None
-        if "methodology" not in paper.keys():
-            paper["methodology"] = None
-        if "ground_truth" not in paper.keys():
-            paper["ground_truth"] = None
-        if "reference_filter" not in paper.keys():
-            paper["reference_filter"] = None
-        if "conclusions" not in paper.keys():
-            paper["conclusions"] = None
+        self.add_paper_nodes([paper])
+
+    def add_paper_nodes(self, papers, batch_size=None):
+        """Add or update paper nodes, `batch_size` papers per UNWIND write
+        Args:
+            papers (List of Dict): missing optional fields are set to None in place
+        Returns:
+            None
+        """
+        for paper in papers:
+            for field in PAPER_NODE_OPTIONAL_FIELDS:
+                if field not in paper.keys():
+                    paper[field] = None
         query = """
-            MERGE (p:Paper {hash_id: $hash_id})
-            ON CREATE SET p.venue_name = $venue_name, p.year = $year, p.title = $title, p.pdf_url = $pdf_url, p.abstract = $abstract, p.introduction = $introduction, p.reference = $reference, p.summary = $summary, p.motivation = $motivation, p.contribution = $contribution, p.methodology = $methodology, p.ground_truth = $ground_truth, p.reference_filter = $reference_filter, p.conclusions = $conclusions
-            ON MATCH SET p.venue_name = $venue_name, p.year = $year, p.title = $title, p.pdf_url = $pdf_url, p.abstract = $abstract, p.introduction = $introduction, p.reference = $reference, p.summary = $summary, p.motivation = $motivation, p.contribution = $contribution, p.methodology = $methodology, p.ground_truth = $ground_truth, p.reference_filter = $reference_filter, p.conclusions = $conclusions
-            RETURN p
+            UNWIND $papers AS paper
+            MERGE (p:Paper {hash_id: paper.hash_id})
+            SET p.venue_name = paper.venue_name, p.year = paper.year, p.title = paper.title, p.pdf_url = paper.pdf_url, p.abstract = paper.abstract, p.introduction = paper.introduction, p.reference = paper.reference, p.summary = paper.summary, p.motivation = paper.motivation, p.contribution = paper.contribution, p.methodology = paper.methodology, p.ground_truth = paper.ground_truth, p.reference_filter = paper.reference_filter, p.conclusions = paper.conclusions
             """
+        rows = [
+            {field: paper[field] for field in ["hash_id"] + PAPER_NODE_FIELDS}
+            for paper in papers
+        ]
+        self.write_batches(query, "papers", rows, batch_size)
+        self.paper_cache.invalidate_many(row["hash_id"] for row in rows)
+
+    def write_batches(self, query, name, rows, batch_size=None):
+        """Run `query` once per chunk of `rows`, passed as the `${name}` parameter
+        """
+        batch_size = self.write_batch_size if batch_size is None else batch_size
         with self.driver.session() as session:
-            result = session.execute_write(
-                lambda tx: tx.run(
-                    query,
-                    hash_id=paper["hash_id"],
-                    venue_name=paper["venue_name"],
-                    year=paper["year"],
-                    title=paper["title"],
-                    pdf_url=paper["pdf_url"],
-                    abstract=paper["abstract"],
-                    introduction=paper["introduction"],
-                    reference=paper["reference"],
-                    summary=paper["summary"],
-                    motivation=paper["motivation"],
-                    contribution=paper["contribution"],
-                    methodology=paper["methodology"],
-                    ground_truth=paper["ground_truth"],
-                    reference_filter=paper["reference_filter"],
-                    conclusions=paper["conclusions"],
-                ).data()
-            )
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i : i + batch_size]
+                session.execute_write(
+                    lambda tx: tx.run(query, **{name: batch}).consume()
+                )
 
     def check_entity_node_count(self, hash_id: int):
         """Whether a paper has more than `3` entities
@@ -407,20 +503,29 @@ class PaperClient:
         Returns:
             None
         """
+        self.add_entity_nodes([(hash_id, entities)])
+
+    def add_entity_nodes(self, paper_entities, batch_size=None):
+        """Add entity nodes and link them to their papers, `batch_size` links per UNWIND
+        write. The papers should be written before
+        Args:
+            paper_entities (List of (hash_id, List of entities))
+        Returns:
+            None
+        """
         query = """
-            MERGE (e:Entity {name: $entity_name})
-            WITH e
-            MATCH (p:Paper {hash_id: $hash_id})
+            UNWIND $links AS link
+            MERGE (e:Entity {name: link.entity_name})
+            WITH e, link
+            MATCH (p:Paper {hash_id: link.hash_id})
             MERGE (e)-[:RELATED_TO]->(p)
-            RETURN e, p
         """
-        with self.driver.session() as session:
-            for entity_name in entities:
-                result = session.execute_write(
-                    lambda tx: tx.run(
-                        query, entity_name=entity_name, hash_id=hash_id
-                    ).data()
-                )
+        links = [
+            {"hash_id": hash_id, "entity_name": entity_name}
+            for hash_id, entities in paper_entities
+            for entity_name in entities
+        ]
+        self.write_batches(query, "links", links, batch_size)
 
     def add_paper_citation(self, paper: dict):
         """Add citations for the paper node, set its cite_id_list, entities, and all_cite_id_list
@@ -431,39 +536,44 @@ class PaperClient:
         Returns:
             None
         """
+        self.add_paper_citations([paper])
+
+    def add_paper_citations(self, papers, batch_size=None):
+        """Batched `add_paper_citation`, `batch_size` papers per UNWIND write
+        """
         query = """
-            MERGE (p:Paper {hash_id: $hash_id}) ON MATCH SET p.cite_id_list = $cite_id_list, p.entities = $entities, p.all_cite_id_list = $all_cite_id_list
+            UNWIND $papers AS paper
+            MERGE (p:Paper {hash_id: paper.hash_id}) ON MATCH SET p.cite_id_list = paper.cite_id_list, p.entities = paper.entities, p.all_cite_id_list = paper.all_cite_id_list
             """
-        with self.driver.session() as session:
-            result = session.execute_write(
-                lambda tx: tx.run(
-                    query,
-                    hash_id=paper["hash_id"],
-                    cite_id_list=paper["cite_id_list"],
-                    entities=paper["entities"],
-                    all_cite_id_list=paper["all_cite_id_list"],
-                ).data()
-            )
+        rows = [
+            {
+                "hash_id": paper["hash_id"],
+                "cite_id_list": paper["cite_id_list"],
+                "entities": paper["entities"],
+                "all_cite_id_list": paper["all_cite_id_list"],
+            }
+            for paper in papers
+        ]
+        self.write_batches(query, "papers", rows, batch_size)
+        self.paper_cache.invalidate_many(row["hash_id"] for row in rows)
 
     def insert_new_field(self, hash_id: str, field_name: str, content):
         if hash_id is not None:
-            query = f"""
-                MATCH (n {{hash_id: $hash_id}}) 
-                SET n.{field_name} = $content
-                RETURN n
-            """
+            query = self.queries.query("set_paper_field", field=field_name)
             with self.driver.session() as session:
                 result = session.execute_write(
                     lambda tx: tx.run(
                         query, hash_id=hash_id, content=content
                     ).data()
                 )
+            self.paper_cache.invalidate(hash_id)
             return result
         else:
             return None
 
     def update_paper_embedding(
-        self, embedding_model, hash_id=None, batch_size=512, name="abstract", postfix=""
+        self, embedding_model, hash_id=None, batch_size=512, name="abstract", postfix="",
+        only_missing=False, checkpoint_dir=None, embedding_cache=None, cache_scope=None,
     ):
         """Extract paper embedding and store in the database
         Args:
@@ -471,13 +581,14 @@ class PaperClient:
             hash_id (str): add embedding for a paper if hash_id is not None.
                 Otherwise, all papers will be handled with a batch size of 512
             batch_size: if hash_id is None, all papers will be processed with `batch_size`
+            only_missing (bool): if hash_id is None, skip papers which have the embedding
+            checkpoint_dir (str): if hash_id is None, resume an interrupted run from the
+                checkpoint kept in `checkpoint_dir`
+            embedding_cache (DiskEmbeddingCache): reuse the vectors of texts encoded before,
+                keyed by `cache_scope` (model name, task, postfix)
         """
         if hash_id is not None:
-            query = f"""
-            MATCH (p:Paper {{hash_id: $hash_id}})
-            WHERE p.{name} IS NOT NULL
-            RETURN p.{name} AS context, p.hash_id AS hash_id, p.title AS title
-            """
+            query = self.queries.query("paper_context", field=name)
             with self.driver.session() as session:
                 results = session.execute_write(
                     lambda tx: tx.run(query, hash_id=hash_id).data()
@@ -488,18 +599,21 @@ class PaperClient:
             else:
                 contexts = [result["context"] for result in results]
             paper_ids = [result["hash_id"] for result in results]
-            context_embeddings = embedding_model.encode(
-                contexts, convert_to_tensor=True, device=self.device
+            if embedding_cache is not None and contexts:
+                model_name, task, cache_postfix = cache_scope
+                context_embeddings = embedding_cache.encode_many(
+                    embedding_model, contexts, model_name, task, cache_postfix,
+                    job=f"{name}_embedding{postfix}", convert_to_tensor=True, device=self.device,
+                )
+            else:
+                context_embeddings = embedding_model.encode(
+                    contexts, convert_to_tensor=True, device=self.device
+                ).detach().cpu().numpy()
+            query = self.queries.query(
+                "set_paper_embedding", embedding=f"{name}_embedding{postfix}"
             )
-            query = f"""
-                MERGE (p:Paper {{hash_id: $hash_id}})
-                ON CREATE SET p.{name}_embedding{postfix} = $embedding
-                ON MATCH SET p.{name}_embedding{postfix} = $embedding
-            """
             for idx, hash_id in tqdm(enumerate(paper_ids)):
-                embedding = (
-                    context_embeddings[idx].detach().cpu().numpy().flatten().tolist()
-                )
+                embedding = context_embeddings[idx].flatten().tolist()
                 with self.driver.session() as session:
                     results = session.execute_write(
                         lambda tx: tx.run(
@@ -507,49 +621,53 @@ class PaperClient:
                         ).data()
                     )
             return
-        offset = 0
-        while True:
-            query = f"""
-            MATCH (p:Paper)
-            WHERE p.{name} IS NOT NULL
-            RETURN p.{name} AS context, p.hash_id AS hash_id, p.title AS title
-            SKIP $offset LIMIT $batch_size
-            """
-            with self.driver.session() as session:
-                results = session.execute_write(
-                    lambda tx: tx.run(
-                        query, offset=offset, batch_size=batch_size
-                    ).data()
-                )
-            if not results:
-                break
-            if name == "abstract":
-                contexts = [result["title"] + result["context"] for result in results]
-            else:
-                contexts = [result["context"] for result in results]
-            paper_ids = [result["hash_id"] for result in results]
-            context_embeddings = embedding_model.encode(
-                contexts,
-                batch_size=batch_size,
-                convert_to_tensor=True,
-                device=self.device,
-            )
-            write_query = f"""
-            UNWIND $data AS row
-            MERGE (p:Paper {{hash_id: row.hash_id}})
-            ON CREATE SET p.{name}_embedding{postfix} = row.embedding
-            ON MATCH SET p.{name}_embedding{postfix} = row.embedding
-            """
-            data_to_write = []
-            context_embeddings = context_embeddings.detach().cpu().tolist()
-            for idx, hash_id in enumerate(paper_ids):
-                data_to_write.append({"hash_id": hash_id, "embedding": context_embeddings[idx]})
-            with self.driver.session() as session:
-                session.execute_write(
-                    lambda tx: tx.run(write_query, data=data_to_write)
-                )
-            offset += batch_size
-            logger.info(f"== Processed batch starting at offset {offset} ==")
+        self.backfill_embeddings(
+            embedding_model, [(name, f"{name}_embedding{postfix}", name == "abstract")],
+            batch_size=batch_size, only_missing=only_missing, checkpoint_dir=checkpoint_dir,
+            embedding_cache=embedding_cache, cache_scope=cache_scope,
+        )
+
+    def update_paper_embeddings(
+        self, embedding_model, names=("abstract", "background", "contribution", "summary"),
+        postfix="", batch_size=512, only_missing=False, checkpoint_dir=None,
+        embedding_cache=None, cache_scope=None,
+    ):
+        """`update_paper_embedding` of several fields in one pass over the papers: each page
+        is read once, its texts are encoded in one stream and its vectors written at once
+        Args:
+            names (List of str): text fields, the abstract is encoded with the title
+        Returns:
+            processed (int): number of papers written
+        """
+        return self.backfill_embeddings(
+            embedding_model,
+            [(name, f"{name}_embedding{postfix}", name == "abstract") for name in names],
+            batch_size=batch_size, only_missing=only_missing, checkpoint_dir=checkpoint_dir,
+            embedding_cache=embedding_cache, cache_scope=cache_scope,
+        )
+
+    def backfill_embeddings(
+        self, embedding_model, targets, batch_size=512, only_missing=False, checkpoint_dir=None,
+        embedding_cache=None, cache_scope=None,
+    ):
+        """Write the embeddings of `targets` of all papers, see `EmbeddingBackfill`
+        Args:
+            targets (List of (field, embedding_name, with_title))
+            checkpoint_dir (str): where the resume checkpoint is kept, None to disable it
+            embedding_cache (DiskEmbeddingCache): texts encoded before are read from it
+            cache_scope (tuple): (model name, jina task, embedding postfix) of the cache keys
+        Returns:
+            processed (int): number of papers written
+        """
+        checkpoint_path = None
+        if checkpoint_dir is not None:
+            checkpoint_name = "+".join(embedding_name for _, embedding_name, _ in targets)
+            checkpoint_path = os.path.join(checkpoint_dir, f"{checkpoint_name}.json")
+        return EmbeddingBackfill(
+            self, embedding_model, targets, batch_size=batch_size, only_missing=only_missing,
+            checkpoint_path=checkpoint_path, device=self.device,
+            embedding_cache=embedding_cache, cache_scope=cache_scope,
+        ).run()
 
     def add_paper_abstract_embedding(
         self, embedding_model, hash_id=None, batch_size=512
@@ -592,48 +710,9 @@ class PaperClient:
                         ).data()
                     )
             return
-        offset = 0
-        while True:
-            query = f"""
-            MATCH (p:Paper)
-            WHERE p.abstract IS NOT NULL
-            RETURN p.abstract AS context, p.hash_id AS hash_id, p.title AS title
-            SKIP $offset LIMIT $batch_size
-            """
-            with self.driver.session() as session:
-                results = session.execute_write(
-                    lambda tx: tx.run(
-                        query, offset=offset, batch_size=batch_size
-                    ).data()
-                )
-            if not results:
-                break
-            contexts = [result["title"] + result["context"] for result in results]
-            paper_ids = [result["hash_id"] for result in results]
-            context_embeddings = embedding_model.encode(
-                contexts,
-                batch_size=batch_size,
-                convert_to_tensor=True,
-                device=self.device,
-            )
-            write_query = """
-            UNWIND $data AS row
-            MERGE (p:Paper {hash_id: row.hash_id})
-            ON CREATE SET p.abstract_embedding = row.embedding
-            ON MATCH SET p.abstract_embedding = row.embedding
-            """
-            data_to_write = []
-            for idx, hash_id in enumerate(paper_ids):
-                embedding = (
-                    context_embeddings[idx].detach().cpu().numpy().flatten().tolist()
-                )
-                data_to_write.append({"hash_id": hash_id, "embedding": embedding})
-            with self.driver.session() as session:
-                session.execute_write(
-                    lambda tx: tx.run(write_query, data=data_to_write)
-                )
-            offset += batch_size
-            logger.info(f"== Processed batch starting at offset {offset} ==")
+        self.backfill_embeddings(
+            embedding_model, [("abstract", "abstract_embedding", True)], batch_size=batch_size
+        )
 
     def add_paper_bg_embedding(self, embedding_model, hash_id=None, batch_size=512):
         """Extract paper background embedding and store in the database
@@ -674,48 +753,9 @@ class PaperClient:
                         ).data()
                     )
             return
-        offset = 0
-        while True:
-            query = f"""
-            MATCH (p:Paper)
-            WHERE p.motivation IS NOT NULL
-            RETURN p.motivation AS context, p.hash_id AS hash_id, p.title AS title
-            SKIP $offset LIMIT $batch_size
-            """
-            with self.driver.session() as session:
-                results = session.execute_write(
-                    lambda tx: tx.run(
-                        query, offset=offset, batch_size=batch_size
-                    ).data()
-                )
-            if not results:
-                break
-            contexts = [result["title"] + result["context"] for result in results]
-            paper_ids = [result["hash_id"] for result in results]
-            context_embeddings = embedding_model.encode(
-                contexts,
-                batch_size=batch_size,
-                convert_to_tensor=True,
-                device=self.device,
-            )
-            write_query = """
-            UNWIND $data AS row
-            MERGE (p:Paper {hash_id: row.hash_id})
-            ON CREATE SET p.motivation_embedding = row.embedding
-            ON MATCH SET p.motivation_embedding = row.embedding
-            """
-            data_to_write = []
-            for idx, hash_id in enumerate(paper_ids):
-                embedding = (
-                    context_embeddings[idx].detach().cpu().numpy().flatten().tolist()
-                )
-                data_to_write.append({"hash_id": hash_id, "embedding": embedding})
-            with self.driver.session() as session:
-                session.execute_write(
-                    lambda tx: tx.run(write_query, data=data_to_write)
-                )
-            offset += batch_size
-            logger.info(f"== Processed batch starting at offset {offset} ==")
+        self.backfill_embeddings(
+            embedding_model, [("motivation", "motivation_embedding", True)], batch_size=batch_size
+        )
 
     def add_paper_contribution_embedding(
         self, embedding_model, hash_id=None, batch_size=512
@@ -758,48 +798,9 @@ class PaperClient:
                         ).data()
                     )
             return
-        offset = 0
-        while True:
-            query = f"""
-            MATCH (p:Paper)
-            WHERE p.contribution IS NOT NULL
-            RETURN p.contribution AS context, p.hash_id AS hash_id, p.title AS title
-            SKIP $offset LIMIT $batch_size
-            """
-            with self.driver.session() as session:
-                results = session.execute_write(
-                    lambda tx: tx.run(
-                        query, offset=offset, batch_size=batch_size
-                    ).data()
-                )
-            if not results:
-                break
-            contexts = [result["context"] for result in results]
-            paper_ids = [result["hash_id"] for result in results]
-            context_embeddings = embedding_model.encode(
-                contexts,
-                batch_size=batch_size,
-                convert_to_tensor=True,
-                device=self.device,
-            )
-            write_query = """
-            UNWIND $data AS row
-            MERGE (p:Paper {hash_id: row.hash_id})
-            ON CREATE SET p.contribution_embedding = row.embedding
-            ON MATCH SET p.contribution_embedding = row.embedding
-            """
-            data_to_write = []
-            for idx, hash_id in enumerate(paper_ids):
-                embedding = (
-                    context_embeddings[idx].detach().cpu().numpy().flatten().tolist()
-                )
-                data_to_write.append({"hash_id": hash_id, "embedding": embedding})
-            with self.driver.session() as session:
-                session.execute_write(
-                    lambda tx: tx.run(write_query, data=data_to_write)
-                )
-            offset += batch_size
-            logger.info(f"== Processed batch starting at offset {offset} ==")
+        self.backfill_embeddings(
+            embedding_model, [("contribution", "contribution_embedding", False)], batch_size=batch_size
+        )
 
     def add_paper_summary_embedding(
         self, embedding_model, hash_id=None, batch_size=512
@@ -843,48 +844,9 @@ class PaperClient:
                         ).data()
                     )
             return
-        offset = 0
-        while True:
-            query = f"""
-            MATCH (p:Paper)
-            WHERE p.summary IS NOT NULL
-            RETURN p.summary AS context, p.hash_id AS hash_id, p.title AS title
-            SKIP $offset LIMIT $batch_size
-            """
-            with self.driver.session() as session:
-                results = session.execute_write(
-                    lambda tx: tx.run(
-                        query, offset=offset, batch_size=batch_size
-                    ).data()
-                )
-            if not results:
-                break
-            contexts = [result["context"] for result in results]
-            paper_ids = [result["hash_id"] for result in results]
-            context_embeddings = embedding_model.encode(
-                contexts,
-                batch_size=batch_size,
-                convert_to_tensor=True,
-                device=self.device,
-            )
-            write_query = """
-            UNWIND $data AS row
-            MERGE (p:Paper {hash_id: row.hash_id})
-            ON CREATE SET p.summary_embedding = row.embedding
-            ON MATCH SET p.summary_embedding = row.embedding
-            """
-            data_to_write = []
-            for idx, hash_id in enumerate(paper_ids):
-                embedding = (
-                    context_embeddings[idx].detach().cpu().numpy().flatten().tolist()
-                )
-                data_to_write.append({"hash_id": hash_id, "embedding": embedding})
-            with self.driver.session() as session:
-                session.execute_write(
-                    lambda tx: tx.run(write_query, data=data_to_write)
-                )
-            offset += batch_size
-            logger.info(f"== Processed batch starting at offset {offset} ==")
+        self.backfill_embeddings(
+            embedding_model, [("summary", "summary_embedding", False)], batch_size=batch_size
+        )
 
     def cosine_similarity_search(self, embedding, k=1, type_name="embedding"):
         """Retrieve all papers whose `type_name` embedding is similar to `embedding`
@@ -896,40 +858,55 @@ class PaperClient:
         Returns:
             related_paper (List of str): hash_id of retrieved papers
         """
-        query = f"""
-            MATCH (paper:Paper)
-            WITH paper,
-                vector.similarity.cosine(paper.{type_name}, $embedding) AS score
-            WHERE score > 0
-            RETURN paper, score
-            ORDER BY score DESC LIMIT {k}
-            """
+        if hasattr(embedding, "tolist"):
+            embedding = embedding.tolist()
+        index_name = self.schema.vector_index_of(type_name)
+        if index_name is not None:
+            # the index and vector.similarity.cosine share the normalized score, cut at 0 on both
+            query = self.queries.query("vector_index_search")
+            with self.driver.session() as session:
+                results = session.execute_read(
+                    lambda tx: tx.run(
+                        query, index_name=index_name, k=k, embedding=embedding
+                    ).data()
+                )
+            return [result["hash_id"] for result in results]
+        query = self.queries.query("cosine_similarity_scan", embedding=type_name)
         with self.driver.session() as session:
             results = session.execute_read(
-                lambda tx: tx.run(query, embedding=embedding).data()
+                lambda tx: tx.run(query, embedding=embedding, k=k).data()
             )
         related_paper = []
         for result in results:
-            related_paper.append(result["paper"]["hash_id"])
+            related_paper.append(result["hash_id"])
         return related_paper
 
-    def create_vector_index(self):
+    def get_all_paper_embeddings(self, type_name="background_embedding"):
+        """Read the `type_name` embedding of every paper, e.g. to build an ANN index
+        Args:
+            type_name: "abstract_embedding", "summary_embedding", etc.
+        Returns:
+            ids (np.ndarray of int64, [N]): hash_id of papers with the embedding
+            vectors (np.ndarray of float32, [N, D]): their embeddings
+        """
+        query = self.queries.query("all_paper_embeddings", embedding=type_name)
+        ids = []
+        vectors = []
+        with self.driver.session() as session:
+            for record in tqdm(session.run(query)):
+                ids.append(record["hash_id"])
+                vectors.append(np.asarray(record["embedding"], dtype=np.float32))
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+        return np.asarray(ids, dtype=np.int64), np.stack(vectors)
+
+    def create_vector_index(self, type_name="embedding", dimension=384):
         """
         适用于Paper节点，这里的语句应该是针对所有数据库里的paper都做索引
-        针对Paper节点上的是属性 embedding 进行索引
-        索引向量的维度为384
+        针对Paper节点上的属性 `type_name` 进行索引，维度为 `dimension`
         适用余弦相似度作为计算相似度的方法
         """
-        query = """
-            CREATE VECTOR INDEX `paper-embeddings`
-            FOR (n:Paper) ON (n.embedding)
-            OPTIONS {indexConfig: {
-            `vector.dimensions`: 384,
-            `vector.similarity_function`: 'cosine'
-            }}
-            """
-        with self.driver.session() as session:
-            session.execute_write(lambda tx: tx.run(query).data())
+        return self.schema.create_vector_index(type_name, dimension)
 
     def filter_paper_id_list(self, paper_id_list, year="2024"):
         """Retrieve all papers' ids which released before "year" (not contained) and existed in the database
@@ -942,12 +919,7 @@ class PaperClient:
         if not paper_id_list:
             return []
         # WHERE p.year < "2024" AND p.venue_name <> "acl"
-        query = """
-            UNWIND $paper_id_list AS hash_id
-            MATCH (p:Paper {hash_id: hash_id})
-            WHERE p.year < $year
-            RETURN p.hash_id AS hash_id
-        """
+        query = self.queries.query("papers_before_year")
         with self.driver.session() as session:
             result = session.execute_read(
                 lambda tx: tx.run(query, paper_id_list=paper_id_list, year=year).data()
@@ -957,14 +929,13 @@ class PaperClient:
         existing_paper_ids = list(set(existing_paper_ids))
         return existing_paper_ids
 
-    def check_index_exists(self):
-        query = "SHOW INDEXES"
-        with self.driver.session() as session:
-            result = session.execute_read(lambda tx: tx.run(query).data())
-        for record in result:
-            if record["name"] == "paper-embeddings":
-                return True
-        return False
+    def check_index_exists(self, type_name="embedding"):
+        return self.schema.vector_index_of(type_name) is not None
+
+    def query_stats(self):
+        """Renders and distinct query strings of each registered query template
+        """
+        return self.queries.stats()
 
     def clear_database(self):
         query = """
@@ -988,13 +959,7 @@ class PaperClient:
         return paper_num
 
     def get_entities_related_paper_num(self, entity_names):
-        query = """
-            UNWIND $entity_names AS entity_name
-            MATCH (e:Entity {name: entity_name})-[:RELATED_TO]->(p:Paper)
-            WITH entity_name, COUNT(p) AS PaperCount
-            RETURN entity_name, PaperCount
-        """
-
+        query = self.queries.query("entities_related_paper_num")
         with self.driver.session() as session:
             result = session.execute_read(
                 lambda tx: tx.run(query, entity_names=entity_names).data()
@@ -1017,70 +982,165 @@ class PaperClient:
         text_list = [record["entity_text"] for record in result]
         return text_list
 
-    def get_entity_combinations(self, venue_name, year):
-        def process_paper_relationships(
-            session, entity_name_1, entity_name_2, abstract
-        ):
-            if entity_name_2 < entity_name_1:
-                entity_name_1, entity_name_2 = entity_name_2, entity_name_1
-            query = """
-                MATCH (e1:Entity {name: $entity_name_1})
-                MATCH (e2:Entity {name: $entity_name_2})
-                MERGE (e1)-[r:CONNECT]->(e2)
-                ON CREATE SET r.strength = 1
-                ON MATCH SET r.strength = r.strength + 1
-            """
+    def get_entity_combinations(self, venue_name, year, fetch_size=None, batch_size=None):
+        """Connect the entities of the papers published at `venue_name` in `year`: the
+        strength of a CONNECT edge grows by the number of papers in which both entities occur
+        in the same sentence of the abstract. Pairs are counted in memory in one pass over
+        the papers, then the edges are merged in UNWIND batches of `batch_size`
+        """
+        pair_counts = self.count_entity_combinations(
+            tqdm(self.iter_paper_entities(venue_name, year, fetch_size=fetch_size))
+        )
+        logger.info(f"{venue_name} {year}: {len(pair_counts)} co-occurring entity pairs")
+        query = """
+            UNWIND $pairs AS pair
+            MATCH (e1:Entity {name: pair.entity_name_1})
+            MATCH (e2:Entity {name: pair.entity_name_2})
+            MERGE (e1)-[r:CONNECT]->(e2)
+            ON CREATE SET r.strength = pair.count
+            ON MATCH SET r.strength = r.strength + pair.count
+        """
+        pairs = [
+            {"entity_name_1": entity_name_1, "entity_name_2": entity_name_2, "count": count}
+            for (entity_name_1, entity_name_2), count in pair_counts.items()
+        ]
+        self.write_batches(query, "pairs", pairs, batch_size)
+
+    def iter_paper_entities(self, venue_name, year, fetch_size=None):
+        """Iterate over the papers published at `venue_name` in `year` with their entities
+        Returns:
+            generator of (hash_id, abstract, List of entity names)
+        """
+        query = """
+            MATCH (e:Entity)-[:RELATED_TO]->(p:Paper)
+            WHERE p.venue_name=$venue_name and p.year=$year
+            WITH p, collect(e.name) AS entity_names
+            WHERE size(entity_names) > 1
+            RETURN p.hash_id AS hash_id, p.abstract AS abstract, entity_names
+        """
+        fetch_size = self.fetch_size if fetch_size is None else fetch_size
+        with self.driver.session(fetch_size=fetch_size) as session:
+            for record in session.run(query, venue_name=venue_name, year=year):
+                yield record["hash_id"], record["abstract"], record["entity_names"]
+
+    @staticmethod
+    def count_entity_combinations(papers):
+        """Count the papers in which two entities occur in the same (lowercased) sentence
+        Args:
+            papers (iterable of (hash_id, abstract, List of entity names))
+        Returns:
+            pair_counts (Counter of (entity_name_1, entity_name_2) -> number of papers),
+                entity_name_1 < entity_name_2
+        """
+        pair_counts = Counter()
+        for hash_id, abstract, entity_names in papers:
+            if abstract is None:
+                logger.warning(f"paper {hash_id} has no abstract, skip")
+                continue
+            entity_names = sorted(set(entity_names))
             sentences = re.split(r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s", abstract)
+            paper_pairs = set()
             for sentence in sentences:
                 sentence = sentence.lower()
-                if entity_name_1 in sentence and entity_name_2 in sentence:
-                    # 如果两个实体在同一句话中出现过，则创建或更新 CONNECT 关系
-                    session.execute_write(
-                        lambda tx: tx.run(
-                            query,
-                            entity_name_1=entity_name_1,
-                            entity_name_2=entity_name_2,
-                        ).data()
-                    )
-                    # logger.debug(f"CONNECT relation created or updated between {entity_name_1} and {entity_name_2} for Paper ID {paper_id}")
-                    break  # 如果找到一次出现就可以退出循环
+                present = [name for name in entity_names if name in sentence]
+                paper_pairs.update(combinations(present, 2))
+            pair_counts.update(paper_pairs)
+        return pair_counts
+
+    def build_citemap(self, fetch_size=None):
+        citemap = defaultdict(set)
+        for hash_id, cite_id_list in self.iter_paper_citations(fetch_size=fetch_size):
+            citemap[hash_id].update(cite_id_list)
+        return citemap
+
+    def get_paper_watermark(self):
+        """State of the papers in the database, changes when papers are inserted
+        Returns:
+            watermark (List of int): [number of papers]
+        """
+        query = "MATCH (p:Paper) RETURN count(p) AS papers"
+        with self.driver.session() as session:
+            record = session.execute_read(lambda tx: tx.run(query).single())
+        return [record["papers"]]
+
+    def get_embedding_watermark(self, type_name):
+        """State of the `type_name` embeddings in the database, changes when papers are
+        embedded
+        Returns:
+            watermark (List of int): [number of papers with `type_name`]
+        """
+        query = self.queries.query("paper_embedding_count", embedding=type_name)
+        with self.driver.session() as session:
+            record = session.execute_read(lambda tx: tx.run(query).single())
+        return [record["papers"]]
 
+    def get_citation_watermark(self):
+        """State of the citations in the database, changes when citations are inserted
+        Returns:
+            watermark (List of int): [papers citing any paper, total citations]
+        """
         query = """
-            MATCH (e:Entity)-[:RELATED_TO]->(p:Paper)
-            WHERE p.venue_name=$venue_name and p.year=$year
-            WITH p, collect(e) as entities
-            UNWIND range(0, size(entities)-2) as i
-            UNWIND range(i+1, size(entities)-1) as j
-            RETURN p.hash_id AS hash_id, entities[i].name AS entity_name_1, entities[j].name AS entity_name_2
+            MATCH (p:Paper)
+            WHERE p.cite_id_list IS NOT NULL AND size(p.cite_id_list) > 0
+            RETURN count(p) AS papers, sum(size(p.cite_id_list)) AS citations
         """
         with self.driver.session() as session:
-            result = session.execute_read(
-                lambda tx: tx.run(query, venue_name=venue_name, year=year).data()
-            )
-            for record in tqdm(result):
-                paper_id = record["hash_id"]
-                entity_name_1 = record["entity_name_1"]
-                entity_name_2 = record["entity_name_2"]
-                abstract = self.get_paper_attribute(paper_id, "abstract")
-                process_paper_relationships(
-                    session, entity_name_1, entity_name_2, abstract
-                )
+            record = session.execute_read(lambda tx: tx.run(query).single())
+        return [record["papers"], record["citations"]]
 
-    def build_citemap(self):
-        citemap = defaultdict(set)
+    def iter_paper_citations(self, fetch_size=None):
+        """Iterate over the papers citing any paper, records are pulled `fetch_size` at a time
+        Returns:
+            generator of (hash_id, cite_id_list)
+        """
         query = """
             MATCH (p:Paper)
+            WHERE p.cite_id_list IS NOT NULL AND size(p.cite_id_list) > 0
             RETURN p.hash_id AS hash_id, p.cite_id_list AS cite_id_list
         """
-        with self.driver.session() as session:
-            results = session.execute_read(lambda tx: tx.run(query).data())
-        for result in results:
-            hash_id = result["hash_id"]
-            cite_id_list = result["cite_id_list"]
-            if cite_id_list:
-                for cited_id in cite_id_list:
-                    citemap[hash_id].add(cited_id)
-        return citemap
+        fetch_size = self.fetch_size if fetch_size is None else fetch_size
+        with self.driver.session(fetch_size=fetch_size) as session:
+            for record in session.run(query):
+                yield record["hash_id"], record["cite_id_list"]
+
+    def get_entity_paper_edges(self):
+        """Iterate over all (Entity)-[:RELATED_TO]->(Paper) edges
+        Returns:
+            generator of (entity_name, hash_id)
+        """
+        query = """
+            MATCH (e:Entity)-[:RELATED_TO]->(p:Paper)
+            RETURN e.name AS entity_name, p.hash_id AS hash_id
+        """
+        with self.driver.session(fetch_size=self.fetch_size) as session:
+            for record in session.run(query):
+                yield record["entity_name"], record["hash_id"]
+
+    def get_entity_connections(self):
+        """Iterate over all (Entity)-[:CONNECT]->(Entity) edges
+        Returns:
+            generator of (entity_name_1, entity_name_2, strength)
+        """
+        query = """
+            MATCH (e1:Entity)-[r:CONNECT]->(e2:Entity)
+            RETURN e1.name AS entity_name_1, e2.name AS entity_name_2, r.strength AS strength
+        """
+        with self.driver.session(fetch_size=self.fetch_size) as session:
+            for record in session.run(query):
+                yield record["entity_name_1"], record["entity_name_2"], record["strength"]
+
+    def get_paper_years(self):
+        """Iterate over all papers' publication year
+        Returns:
+            generator of (hash_id, year)
+        """
+        query = """
+            MATCH (p:Paper)
+            RETURN p.hash_id AS hash_id, p.year AS year
+        """
+        with self.driver.session(fetch_size=self.fetch_size) as session:
+            for record in session.run(query):
+                yield record["hash_id"], record["year"]
 
     def neo4j_backup(self):
         URI = os.environ["NEO4J_URL"]
@@ -1,54 +1,31 @@
+import os
+import time
+import asyncio
 import torch
-import itertools
 import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
-from collections import Counter, defaultdict
+from collections import Counter
 from loguru import logger
 from abc import ABCMeta, abstractmethod
 from .paper_client import PaperClient
+from .async_paper_client import AsyncPaperClient
 from .paper_crawling import PaperCrawling
 from .llms_api import APIHelper
 from .hash import get_embedding_model
-
-
-class UnionFind:
-    def __init__(self, n):
-        self.parent = list(range(n))
-        self.rank = [1] * n
-
-    def find(self, x):
-        if self.parent[x] != x:
-            self.parent[x] = self.find(self.parent[x])
-        return self.parent[x]
-
-    def union(self, x, y):
-        rootX = self.find(x)
-        rootY = self.find(y)
-        if rootX != rootY:
-            if self.rank[rootX] > self.rank[rootY]:
-                self.parent[rootY] = rootX
-            elif self.rank[rootX] < self.rank[rootY]:
-                self.parent[rootX] = rootY
-            else:
-                self.parent[rootY] = rootX
-                self.rank[rootX] += 1
-
-
-def can_merge(uf, similarity_matrix, i, j, threshold):
-    """Condition of i and j can be merged: After merging, the similarity of any two nodes 
-    from root_i and root_j are larger than threshold
-    """
-    root_i = uf.find(i)
-    root_j = uf.find(j)
-    for k in range(len(similarity_matrix)):
-        if uf.find(k) == root_i or uf.find(k) == root_j:
-            if (
-                similarity_matrix[i][k] < threshold
-                or similarity_matrix[j][k] < threshold
-            ):
-                return False
-    return True
+from .embedding_pool import get_embedding_pool
+from .onnx_embedding import cache_model_name
+from .embedding_postfix import embedding_postfix
+from .header import get_dir
+from .vector_index import VectorIndexManager, normalize_rows
+from .embedding_store import EmbeddingStoreManager
+from .cluster import threshold_cluster
+from .cocite_index import load_or_build_cocite_index, load_or_build_paper_table
+from .entity_index import EntityIndex
+from .entity_graph import EntityGraph
+from .embedding_cache import QueryEmbeddingCache
+from .disk_embedding_cache import get_disk_embedding_cache
 
 
 class CoCite:
@@ -60,30 +37,87 @@ class CoCite:
             cls._instance = super(CoCite, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self) -> None:
+    def __init__(self, config=None) -> None:
         if not self._initialized:
             logger.debug("init co-cite map begin...")
             self.paper_client = PaperClient()
-            citemap = self.paper_client.build_citemap()
-            self.comap = defaultdict(lambda: defaultdict(int))
-            for paper_id, cited_id in citemap.items():
-                for id0, id1 in itertools.combinations(cited_id, 2):
-                    # ensure comap[id0][id1] == comap[id1][id0]
-                    self.comap[id0][id1] += 1
-                    self.comap[id1][id0] += 1
+            index_dir = "./assets/index"
+            self.top_k = 16
+            if config is not None:
+                index_dir = config.DEFAULT.get("index_dir", index_dir)
+                self.top_k = config.RETRIEVE.get("cocite_index_k", self.top_k)
+                self.paper_client.fetch_size = config.DEFAULT.get(
+                    "neo4j_fetch_size", self.paper_client.fetch_size
+                )
+            self.index_path = os.path.join(get_dir(index_dir), "cocite", "cocite.npz")
+            self.paper_table_path = os.path.join(get_dir(index_dir), "cocite", "papers.npz")
+            self.build()
             logger.debug("init co-cite map success")
             CoCite._initialized = True
 
-    def get_cocite_ids(self, id_, k=1):
+    def build(self, rebuild=False):
+        """Load the precomputed co-cite index and paper table, build them from the database
+        if they do not exist, were built before citations were added or `rebuild` is True
         """
+        self.index = load_or_build_cocite_index(
+            self.index_path, self.paper_client.build_citemap,
+            top_k=self.top_k, rebuild=rebuild,
+            watermark=self.paper_client.get_citation_watermark(),
+        )
+        self.paper_table = load_or_build_paper_table(
+            self.paper_table_path, self.paper_client.get_paper_years,
+            rebuild=rebuild, watermark=self.paper_client.get_paper_watermark(),
+        )
+
+    def get_cocite_ids(self, id_, k=1, year="2024"):
+        """Top-k papers most co-cited with `id_`, which released before `year` and existed
+        in the database
         """
-        sorted_items = sorted(self.comap[id_].items(), key=lambda x: x[1], reverse=True)
-        top_k = sorted_items[:k]
-        paper_ids = []
-        for item in top_k:
-            paper_ids.append(item[0])
-        paper_ids = self.paper_client.filter_paper_id_list(paper_ids)
-        return paper_ids
+        return self.get_cocite_ids_many([id_], k=k, year=year)
+
+    def get_cocite_ids_many(self, ids, k=1, year="2024"):
+        """Top-k co-cited papers of every paper of `ids`, filtered in memory (released
+        before `year` and existed in the database). Papers ingested after the paper table was
+        built are checked in the database, in one batched query
+        Args:
+            ids (List of int): hash_ids
+            k: top-k co-cited papers of each paper
+            year: keep papers released before `year` (not contained)
+        Returns:
+            paper_ids (List of int): unique co-cited paper ids
+        """
+        paper_ids, keep, unknown_ids = self.filter_cocite_ids(ids, k=k, year=year)
+        existing = self.paper_client.filter_paper_id_list(unknown_ids, year=year)
+        return self.merge_existing_ids(paper_ids, keep, existing)
+
+    async def aget_cocite_ids_many(self, ids, async_paper_client, k=1, year="2024"):
+        """`get_cocite_ids_many` checking the papers missing from the paper table through
+        the AsyncPaperClient
+        """
+        paper_ids, keep, unknown_ids = self.filter_cocite_ids(ids, k=k, year=year)
+        existing = await async_paper_client.filter_paper_id_list(unknown_ids, year=year)
+        return self.merge_existing_ids(paper_ids, keep, existing)
+
+    def filter_cocite_ids(self, ids, k=1, year="2024"):
+        """Top-k co-cited papers of `ids`, filtered by the paper table
+        Returns:
+            paper_ids (np.ndarray of int64): co-cited papers
+            keep (np.ndarray of bool): the papers of the table released before `year`
+            unknown_ids (List of int): papers not in the table, to check in the database
+        """
+        paper_ids = self.index.get_cocite_ids_many(ids, k)
+        keep = self.paper_table.filter(paper_ids, year=year)
+        unknown = ~self.paper_table.contains(paper_ids)
+        unknown_ids = list(dict.fromkeys(int(paper_id) for paper_id in paper_ids[unknown]))
+        return paper_ids, keep, unknown_ids
+
+    @staticmethod
+    def merge_existing_ids(paper_ids, keep, existing):
+        """The unique papers of `filter_cocite_ids` kept by the paper table, or found in the
+        database (`existing`, the `filter_paper_id_list` of its `unknown_ids`)
+        """
+        keep = keep | np.isin(paper_ids, np.asarray(existing, dtype=np.int64))
+        return list(dict.fromkeys(int(paper_id) for paper_id in paper_ids[keep]))
 
 
 class Retriever(object):
@@ -95,29 +129,134 @@ class Retriever(object):
     """
     __metaclass__ = ABCMeta
     retriever_name = "BASE"
+    _executor = None
+    _executor_lock = threading.Lock()
 
     def __init__(self, config):
         self.config = config
         self.use_cocite = config.RETRIEVE.use_cocite
         self.use_cluster_to_filter = config.RETRIEVE.use_cluster_to_filter
         self.paper_client = PaperClient()
-        self.cocite = CoCite()
+        self.cocite = CoCite(config)
         self.api_helper = APIHelper(config=config)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.embedding_model = get_embedding_model(config)
+        # multi-process encoding of batched queries on cpu, None if disabled
+        self.embedding_pool = get_embedding_pool(config, self.embedding_model)
+        # model part of the query embedding cache keys, includes the non-PyTorch backend
+        self.cache_model_name = cache_model_name(config.DEFAULT.embedding, self.embedding_model)
         self.paper_crawling = PaperCrawling(config=config)
-        if self.config.DEFAULT.embedding == "sentence-transformers/all-MiniLM-L6-v2":
-            self.embedding_postfix = ""
-        elif self.config.DEFAULT.embedding == "BAAI/llm-embedder":
-            self.embedding_postfix = "_llm_embedder"
-        elif self.config.DEFAULT.embedding == "jinaai/jina-embeddings-v3":
-            self.embedding_postfix = "_jina_v3"
-            if self.config.DEFAULT.embedding_database == "text-matching":
-                self.embedding_postfix += "_text_matching"
-            elif self.config.DEFAULT.embedding_database == "retrieval.query":
-                self.embedding_postfix += "_query"
-            elif self.config.DEFAULT.embedding_database == "retrieval.passage":
-                self.embedding_postfix += "_passage"
+        self.embedding_postfix = embedding_postfix(
+            self.config.DEFAULT.embedding, self.config.DEFAULT.get("embedding_database", None)
+        )
+        index_dir = get_dir(self.config.DEFAULT.get("index_dir", "./assets/index"))
+        self.vector_index = None
+        if self.config.RETRIEVE.get("use_ann_index", False):
+            self.vector_index = VectorIndexManager(
+                index_dir, get_watermark=self.paper_client.get_embedding_watermark
+            )
+            self.vector_index.get(
+                f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
+            )
+        self.embedding_store = None
+        if self.config.RETRIEVE.get("use_embedding_store", False):
+            self.embedding_store = EmbeddingStoreManager(index_dir)
+            self.embedding_store.get(f"background_embedding{self.embedding_postfix}")
+        self.entity_index = None
+        entity_index_path = os.path.join(index_dir, "entity")
+        if self.config.RETRIEVE.get("use_entity_index", False):
+            if EntityIndex.exists(entity_index_path):
+                self.entity_index = EntityIndex.load(entity_index_path)
+            else:
+                logger.warning(f"entity index not found in {entity_index_path}, use database")
+        self.entity_graph = self.load_entity_graph(index_dir)
+        self.paper_client.paper_cache.configure(
+            max_size=self.config.RETRIEVE.get("paper_cache_size", 4096),
+            ttl=self.config.RETRIEVE.get("paper_cache_ttl", 600),
+        )
+        self._async_paper_client = None
+        self.query_embedding_cache = None
+        if self.config.RETRIEVE.get("query_embedding_cache_size", 0) > 0:
+            cache_path = self.config.RETRIEVE.get("query_embedding_cache_path", None)
+            self.query_embedding_cache = QueryEmbeddingCache(
+                max_size=self.config.RETRIEVE.query_embedding_cache_size,
+                path=get_dir(cache_path) if cache_path else None,
+                disk_cache=get_disk_embedding_cache(self.config),
+            )
+
+    @property
+    def async_paper_client(self):
+        """The AsyncPaperClient used by `aretrieve`, created on first use
+        """
+        if self._async_paper_client is None:
+            self._async_paper_client = AsyncPaperClient(
+                self.paper_client,
+                max_connection_pool_size=self.config.DEFAULT.get("neo4j_async_pool_size", 100),
+            )
+        return self._async_paper_client
+
+    def encode_query(self, bg):
+        """Embedding of a query text, served from the query embedding cache if enabled
+        """
+        if self.query_embedding_cache is None:
+            return self.embedding_model.encode(bg, device=self.device)
+        task = None
+        if self.config.DEFAULT.embedding == "jinaai/jina-embeddings-v3":
+            task = self.config.DEFAULT.embedding_task
+        return self.query_embedding_cache.encode(
+            self.embedding_model, bg, self.cache_model_name, task,
+            postfix=self.embedding_postfix, device=self.device,
+        )
+
+    def encode_queries(self, bgs):
+        """Embeddings of a list of query texts, encoded in one batched call
+        Returns:
+            embeddings (np.ndarray, [len(bgs), embedding dimension])
+        """
+        embedding_model = self.embedding_pool or self.embedding_model
+        if self.query_embedding_cache is None:
+            return np.atleast_2d(embedding_model.encode(list(bgs), device=self.device))
+        task = None
+        if self.config.DEFAULT.embedding == "jinaai/jina-embeddings-v3":
+            task = self.config.DEFAULT.embedding_task
+        return self.query_embedding_cache.encode_many(
+            embedding_model, list(bgs), self.cache_model_name, task,
+            postfix=self.embedding_postfix, device=self.device,
+        )
+
+    def get_executor(self):
+        """The bounded thread pool shared by all retrievers to run independent stages
+        """
+        with Retriever._executor_lock:
+            if Retriever._executor is None:
+                Retriever._executor = ThreadPoolExecutor(
+                    max_workers=self.config.RETRIEVE.get("retrieve_workers", 8),
+                    thread_name_prefix="retrieve",
+                )
+        return Retriever._executor
+
+    @staticmethod
+    def run_stage(timings, stage, fn, *args):
+        """Run `fn(*args)`, record its wall time in `timings[stage]`
+        """
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    def submit_stage(self, timings, stage, fn, *args):
+        return self.get_executor().submit(self.run_stage, timings, stage, fn, *args)
+
+    def wait_stage(self, future, stage):
+        """Result of a submitted stage, waits at most `RETRIEVE.stage_timeout` seconds
+        """
+        try:
+            return future.result(timeout=self.config.RETRIEVE.get("stage_timeout", 60))
+        except TimeoutError:
+            logger.error(f"retrieve stage {stage} timed out")
+            raise
+
     @abstractmethod
     def retrieve(self, bg, entities, use_evaluate):
         """Retrieve papers, should be implemented by the sub-class
@@ -128,30 +267,312 @@ class Retriever(object):
         """
         pass
 
-    def retrieve_entities_by_enties(self, entities):
+    @abstractmethod
+    def retrieve_paper_many(self, backgrounds, entities_list, embeddings):
+        """Batched `retrieve_paper`, should be implemented by the sub-class
+        Returns:
+            List of retrieve results, one per background
+        """
+        pass
+
+    def retrieve_many(
+        self, backgrounds, entities_list, need_evaluate=False, target_paper_id_lists=None
+    ):
+        """Retrieve papers for many backgrounds at once. All backgrounds are encoded in one
+        batched call, each vector search and the entity lookups run once for the whole batch,
+        and all candidates are scored in a single matrix multiply
+        Args:
+            backgrounds (List of str): the user input backgrounds
+            entities_list (List of entity lists): the entities of each background
+            need_evaluate (bool)
+            target_paper_id_lists (List of paper id lists): the target papers of each background
+        Returns:
+            results (List of dict): the result of `retrieve` for each background
+        """
+        if len(backgrounds) == 0:
+            return []
+        if target_paper_id_lists is None:
+            target_paper_id_lists = [[] for _ in backgrounds]
+        target_paper_id_lists = [
+            self.check_target_paper_id_list(need_evaluate, target_paper_id_list)
+            for target_paper_id_list in target_paper_id_lists
+        ]
+        embeddings = self.encode_queries(backgrounds)
+        retrieve_results = self.retrieve_paper_many(backgrounds, entities_list, embeddings)
+        score_all_dicts = self.cal_related_score_many(
+            embeddings,
+            [retrieve_result["paper"] for retrieve_result in retrieve_results],
+            type_name=self.score_type_name,
+        )
+        return [
+            self.build_retrieve_result(
+                retrieve_result, score_all_dict, need_evaluate, target_paper_id_list
+            )
+            for retrieve_result, score_all_dict, target_paper_id_list in zip(
+                retrieve_results, score_all_dicts, target_paper_id_lists
+            )
+        ]
+
+    def check_target_paper_id_list(self, need_evaluate, target_paper_id_list):
+        if need_evaluate:
+            if target_paper_id_list is None or len(target_paper_id_list) == 0:
+                logger.error(
+                    "If you need evaluate retriever, please input target paper is list..."
+                )
+            else:
+                target_paper_id_list = list(set(target_paper_id_list))
+                logger.debug(f"target paper id list: {target_paper_id_list}")
+        return target_paper_id_list
+
+    def build_retrieve_result(
+        self, retrieve_result, score_all_dict, need_evaluate, target_paper_id_list
+    ):
+        """Evaluate (optionally) and filter the scored papers, read the picked papers
+        Returns:
+            result (dict): see `SNRetriever.retrieve`
+        """
+        evaluation, related_paper = self.pick_related_paper(
+            score_all_dict, need_evaluate, target_paper_id_list
+        )
+        related_paper = self.update_related_paper(related_paper)
+        return self.assemble_retrieve_result(
+            retrieve_result, related_paper, target_paper_id_list, **evaluation
+        )
+
+    def pick_related_paper(
+        self, score_all_dict, need_evaluate, target_paper_id_list, paper_embedding=None
+    ):
+        """Evaluate (optionally) and filter the scored papers
+        Args:
+            paper_embedding: pre-fetched, see `filter_related_paper`
+        Returns:
+            evaluation (dict): keyword arguments of `assemble_retrieve_result`
+            related_paper (List of int): ids of the picked papers
+        """
+        evaluation = {}
+        if need_evaluate:
+            top_k_matrix, label_num, recall, precision = self.eval_related_paper_in_all(
+                score_all_dict, target_paper_id_list
+            )
+            logger.debug("Top K matrix:{}".format(top_k_matrix))
+            logger.debug("before filter:")
+            logger.debug(f"Recall: {recall:.3f}")
+            logger.debug(f"Precision: {precision:.3f}")
+            evaluation = {
+                "top_k_matrix": top_k_matrix,
+                "label_num": label_num,
+                "recall": recall,
+                "precision": precision,
+            }
+        ## For idea generation, only top 10 papers will be used, which has no relations with retriveal evaluation
+        logger.info("=== Begin filter related paper score ===")
+        related_paper = self.filter_related_paper(
+            score_all_dict, top_k=self.config.RETRIEVE.all_retrieve_paper_num,
+            paper_embedding=paper_embedding,
+        )
+        logger.info("=== End filter related paper score ===")
+        return evaluation, related_paper
+
+    def assemble_retrieve_result(
+        self, retrieve_result, related_paper, target_paper_id_list,
+        top_k_matrix=None, label_num=0, recall=0, precision=0,
+    ):
+        """The result dict of `retrieve`, `related_paper` are the picked paper records
+        """
+        related_paper_id_list = retrieve_result["paper"]
+        result = {
+            "recall": recall,
+            "precision": precision,
+            "filtered_recall": 0,
+            "filtered_precision": 0,
+            "related_paper": related_paper,
+            "related_paper_id_list": related_paper_id_list,
+            "cocite_paper_id_list": retrieve_result["cocite_paper"],
+            "entities": retrieve_result["entities"],
+            "top_k_matrix": top_k_matrix if top_k_matrix is not None else {},
+            "gt_reference_num": (
+                len(target_paper_id_list) if target_paper_id_list is not None else 0
+            ),
+            "retrieve_paper_num": len(related_paper_id_list),
+            "label_num": label_num,
+        }
+        if "timings" in retrieve_result:
+            result["timings"] = retrieve_result["timings"]
+        return result
+
+    @abstractmethod
+    async def aretrieve_paper_of(self, bg, entities):
+        """`retrieve_paper` with the arguments of `retrieve` for an event loop, the database
+        reads are awaited on the AsyncPaperClient, should be implemented by the sub-class
+        Returns:
+            retrieve_result (dict): see `retrieve_paper`
+            embedding: the embedding of `bg`
+        """
+        pass
+
+    @staticmethod
+    async def await_stage(timings, stage, awaitable):
+        """Await `awaitable`, record its wall time in `timings[stage]`
+        """
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    @staticmethod
+    async def run_local(fn, *args):
+        """Run the cpu-bound `fn(*args)` (encoding, ANN search) on the loop's default
+        executor, not the retrieve executor: its stages must not wait behind us
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def aencode_query(self, bg):
+        return await self.run_local(self.encode_query, bg)
+
+    async def acosine_similarity_search(self, embedding, k=1, type_name="background_embedding"):
+        """`cosine_similarity_search`, the database fallback awaited on the AsyncPaperClient
+        """
+        index = self.vector_index.get(type_name) if self.vector_index is not None else None
+        if index is not None:
+            return await self.run_local(self.cosine_similarity_search, embedding, k, type_name)
+        result = await self.async_paper_client.cosine_similarity_search(
+            embedding, k, type_name=type_name
+        )
+        # backtrack: first is itself
+        return result[1:]
+
+    async def afind_related_entities(self, entities):
+        """`find_related_entities`, the database fallback awaited on the AsyncPaperClient
+        """
+        if self.entity_graph is not None or self.entity_index is not None:
+            return self.find_related_entities(entities)
+        return await self.async_paper_client.find_related_entities_of_entity_list(
+            entities, k=self.config.RETRIEVE.kg_cover_num
+        )
+
+    async def aget_entities_related_paper_num(self, entities):
+        """`get_entities_related_paper_num`, the database fallback awaited on the
+        AsyncPaperClient
+        """
+        if self.entity_index is not None:
+            return self.get_entities_related_paper_num(entities)
+        entity_paper_num = await self.async_paper_client.get_entities_related_paper_num(entities)
+        return {entity: entity_paper_num.get(entity, 0) for entity in entities}
+
+    async def afind_papers_by_entities(self, entities):
+        """`find_papers_by_entities`, the per-entity database lookups awaited concurrently
+        """
+        if self.entity_index is not None:
+            return self.find_papers_by_entities(entities)
+        paper_id_lists = await asyncio.gather(
+            *[self.async_paper_client.find_paper_by_entity(entity) for entity in entities]
+        )
+        paper_id_set = set()
+        for paper_id_list in paper_id_lists:
+            paper_id_set.update(paper_id_list)
+        return paper_id_set
+
+    async def afind_entities_by_paper_list(self, hash_ids):
+        if self.entity_index is not None:
+            return self.find_entities_by_paper_list(hash_ids)
+        return await self.async_paper_client.find_entities_by_paper_list(hash_ids)
+
+    async def aretrieve_entities_by_enties(
+        self, entities, related_entities=None, entity_paper_num=None
+    ):
+        """`retrieve_entities_by_enties`, the missing related entities and paper numbers
+        are awaited on the AsyncPaperClient first
+        """
+        related_entities = dict(related_entities or {})
+        missing = [entity for entity in entities if entity not in related_entities]
+        if missing:
+            related_entities.update(await self.afind_related_entities(missing))
+        expand_entities = set(entities)
+        for entity in entities:
+            expand_entities.update(related_entities.get(entity, []))
+        entity_paper_num = dict(entity_paper_num or {})
+        missing = [entity for entity in expand_entities if entity not in entity_paper_num]
+        if missing:
+            entity_paper_num.update(await self.aget_entities_related_paper_num(missing))
+        return self.retrieve_entities_by_enties(entities, related_entities, entity_paper_num)
+
+    async def acocite_ids(self, paper_ids, k=1):
+        """Co-cited papers of `paper_ids` if co-cite expansion is used, see
+        `CoCite.aget_cocite_ids_many`
+        """
+        if not self.use_cocite:
+            return set()
+        return set(
+            await self.cocite.aget_cocite_ids_many(paper_ids, self.async_paper_client, k=k)
+        )
+
+    async def aretrieve(self, bg, entities, need_evaluate=False, target_paper_id_list=[]):
+        """`retrieve` for an event loop. Encoding and ANN searches run on the loop's default
+        executor, all database reads (entity expansion, papers of entities, vector search
+        fallback, scores, clustering embeddings and paper records) are awaited on the
+        AsyncPaperClient
+        Returns:
+            result (dict): see `retrieve`
+        """
+        loop = asyncio.get_running_loop()
+        if need_evaluate:
+            # evaluation is offline only, keep it on the sync client
+            return await loop.run_in_executor(
+                None, self.retrieve, bg, entities, need_evaluate, target_paper_id_list
+            )
+        target_paper_id_list = self.check_target_paper_id_list(
+            need_evaluate, target_paper_id_list
+        )
+        retrieve_result, embedding = await self.aretrieve_paper_of(bg, entities)
+        score_all_dict = await self.acal_related_score(
+            embedding, retrieve_result["paper"], type_name=self.score_type_name
+        )
+        top_k = self.config.RETRIEVE.all_retrieve_paper_num
+        paper_embedding = None
+        if self.use_cluster_to_filter and len(score_all_dict) > top_k:
+            paper_embedding = await self.aget_weighted_paper_embedding(
+                list(score_all_dict.keys())
+            )
+        _, related_paper = self.pick_related_paper(
+            score_all_dict, False, target_paper_id_list, paper_embedding=paper_embedding
+        )
+        related_paper = await self.async_paper_client.update_papers_from_client(related_paper)
+        return self.assemble_retrieve_result(
+            retrieve_result, related_paper, target_paper_id_list
+        )
+
+    def retrieve_entities_by_enties(self, entities, related_entities=None, entity_paper_num=None):
         """The method do three things:
         1. Expand entities according to entities co-occurence
         2. Count the number of papers related to each expanded entity. Sort entities in terms of their occurence times in ascending order
         3. Initial new entities. Retrieve entities one by one until the number of related papers reach a threshold
         Args:
             entities: A List of entities, e.g., [str, str, ...]
+            related_entities (dict): pre-fetched `find_related_entities`, looked up if missing
+            entity_paper_num (dict): pre-fetched paper numbers (0 for entities without papers),
+                looked up if missing
         Returns:
             new_entities: A List of entities after expansion, e.g., [str, str, ...]
         """
         # TODO: KG
-        expand_entities = self.paper_client.find_related_entities_by_entity_list(
-            entities,
-            n=self.config.RETRIEVE.kg_jump_num,
-            k=self.config.RETRIEVE.kg_cover_num,
-            relation_name=self.config.RETRIEVE.relation_name,
-        )
-        expand_entities = list(set(entities + expand_entities))
-        entity_paper_num_dict = self.paper_client.get_entities_related_paper_num(
-            expand_entities
-        )
+        if related_entities is None:
+            related_entities = {}
+        missing = [entity for entity in entities if entity not in related_entities]
+        if missing:
+            related_entities = {**related_entities, **self.find_related_entities(missing)}
+        expand_entities = set()
+        for entity in entities:
+            expand_entities.update(related_entities.get(entity, []))
+        expand_entities = list(set(entities + list(expand_entities)))
+        if entity_paper_num is None:
+            entity_paper_num = {}
+        missing = [entity for entity in expand_entities if entity not in entity_paper_num]
+        if missing:
+            entity_paper_num = {**entity_paper_num, **self.get_entities_related_paper_num(missing)}
         new_entities = []
         entity_paper_num_dict = {
-            k: v for k, v in entity_paper_num_dict.items() if v != 0
+            k: entity_paper_num[k] for k in expand_entities if entity_paper_num[k] != 0
         }
         entity_paper_num_dict = dict(
             sorted(entity_paper_num_dict.items(), key=lambda item: item[1])
@@ -169,6 +590,98 @@ class Retriever(object):
                 new_entities.append(key)
         return new_entities
 
+    def load_entity_graph(self, index_dir):
+        """The entity graph of `RETRIEVE.relation_name` for multi-hop expansion: "related"
+        is the co-occurrence table of the entity index, "connect" the CONNECT edges built
+        by build-index. None if not available, then entities are expanded by one hop
+        """
+        relation_name = self.config.RETRIEVE.get("relation_name", "related")
+        if relation_name == "related":
+            if self.entity_index is None:
+                return None
+            return EntityGraph.from_cooccurrence(self.entity_index)
+        entity_graph_path = os.path.join(index_dir, "entity_graph")
+        if EntityGraph.exists(entity_graph_path):
+            return EntityGraph.load(entity_graph_path)
+        logger.warning(f"entity graph not found in {entity_graph_path}, use related entities")
+        return None
+
+    def find_related_entities(self, entities):
+        """Entities related to each of `entities`, within `RETRIEVE.kg_jump_num` hops of the
+        entity graph if loaded, otherwise co-occurring in more than `kg_cover_num` papers
+        Returns:
+            related_entities (dict of entity -> List of related entities)
+        """
+        if self.entity_graph is not None:
+            return {
+                entity: self.entity_graph.neighbours_of(
+                    entity,
+                    hops=self.config.RETRIEVE.get("kg_jump_num", 1),
+                    min_weight=self.config.RETRIEVE.kg_cover_num,
+                    max_per_hop=self.config.RETRIEVE.get("kg_hop_cap", 0),
+                )
+                for entity in entities
+            }
+        if self.entity_index is not None:
+            return {
+                entity: self.entity_index.related_entities_of(
+                    entity, k=self.config.RETRIEVE.kg_cover_num
+                )
+                for entity in entities
+            }
+        return self.paper_client.find_related_entities_of_entity_list(
+            entities, k=self.config.RETRIEVE.kg_cover_num
+        )
+
+    def get_entities_related_paper_num(self, entities):
+        """Number of papers related to each of `entities`, 0 for entities without papers
+        """
+        if self.entity_index is not None:
+            entity_paper_num = self.entity_index.get_entities_related_paper_num(entities)
+        else:
+            entity_paper_num = self.paper_client.get_entities_related_paper_num(entities)
+        return {entity: entity_paper_num.get(entity, 0) for entity in entities}
+
+    def find_papers_by_entities(self, entities):
+        """Union of the papers related to any of `entities`
+        Args:
+            entities: A List of entities
+        Returns:
+            paper_id_set (set of hash_ids)
+        """
+        return self.find_papers_by_entities_many([entities])[0]
+
+    def find_papers_by_entities_many(self, entities_list):
+        """`find_papers_by_entities` of many entity lists, the papers of an entity shared by
+        several lists are looked up once
+        Returns:
+            paper_id_sets (List of set of hash_ids)
+        """
+        if self.entity_index is not None:
+            return [
+                set(self.entity_index.find_papers_by_entities(entities))
+                for entities in entities_list
+            ]
+        entity_papers = {}
+        for entities in entities_list:
+            for entity in entities:
+                if entity not in entity_papers:
+                    entity_papers[entity] = self.paper_client.find_paper_by_entity(entity)
+        paper_id_sets = []
+        for entities in entities_list:
+            paper_id_set = set()
+            for entity in entities:
+                paper_id_set.update(entity_papers[entity])
+            paper_id_sets.append(paper_id_set)
+        return paper_id_sets
+
+    def find_entities_by_paper_list(self, hash_ids):
+        """All entities of a list of papers
+        """
+        if self.entity_index is not None:
+            return self.entity_index.find_entities_by_paper_list(hash_ids)
+        return self.paper_client.find_entities_by_paper_list(hash_ids)
+
     def update_related_paper(self, paper_id_list):
         """
         Args:
@@ -235,20 +748,14 @@ class Retriever(object):
                 paper_id2: score2,
                 ...
         """
-        score_1 = np.zeros((len(related_paper_id_list)))
-        # score_2 = np.zeros((len(related_paper_id_list)))
-        origin_vector = torch.tensor(embedding).to(self.device).unsqueeze(0)
-        context_embeddings = self.paper_client.get_papers_attribute(
-            related_paper_id_list, type_name
-        )
-        if len(context_embeddings) > 0:
-            context_embeddings = torch.tensor(context_embeddings).to(self.device)
-            score_1 = torch.nn.functional.cosine_similarity(
-                origin_vector, context_embeddings
+        score_1 = self.store_related_score(embedding, related_paper_id_list, type_name)
+        if score_1 is None:
+            context_embeddings = self.paper_client.get_papers_attribute(
+                related_paper_id_list, type_name
+            )
+            score_1 = self.context_related_score(
+                embedding, related_paper_id_list, context_embeddings
             )
-            score_1 = score_1.cpu().numpy()
-            if self.config.RETRIEVE.need_normalize:
-                score_1 = score_1 / np.max(score_1)
         score_all_dict = dict(zip(related_paper_id_list, score_1))
         # score_en_dict = dict(zip(related_paper_id_list, score_2))
         """
@@ -262,13 +769,151 @@ class Retriever(object):
         """
         return {}, {}, score_all_dict
 
-    def filter_related_paper(self, score_dict, top_k):
+    def store_related_score(self, embedding, related_paper_id_list, type_name):
+        """Scores of `cal_related_score` from the embedding store
+        Returns:
+            score_1 (np.ndarray): None if the store is disabled or misses any paper
+        """
+        store = self.embedding_store.get(type_name) if self.embedding_store is not None else None
+        if store is None or len(related_paper_id_list) == 0:
+            return None
+        # gather + matmul over the memory-mapped, pre-normalized matrix
+        scores, found = store.cosine_similarity(embedding, related_paper_id_list)
+        if not np.all(found):
+            logger.debug(
+                f"{int(np.sum(~found))} papers not in embedding store, read {type_name} from database"
+            )
+            return None
+        if self.config.RETRIEVE.need_normalize:
+            scores = scores / np.max(scores)
+        return scores
+
+    def context_related_score(self, embedding, related_paper_id_list, context_embeddings):
+        """Scores of `cal_related_score` from the embeddings read from the database
+        """
+        score_1 = np.zeros((len(related_paper_id_list)))
+        if len(context_embeddings) > 0:
+            origin_vector = torch.tensor(embedding).to(self.device).unsqueeze(0)
+            context_embeddings = torch.tensor(context_embeddings).to(self.device)
+            score_1 = torch.nn.functional.cosine_similarity(
+                origin_vector, context_embeddings
+            )
+            score_1 = score_1.cpu().numpy()
+            if self.config.RETRIEVE.need_normalize:
+                score_1 = score_1 / np.max(score_1)
+        return score_1
+
+    async def acal_related_score(
+        self, embedding, related_paper_id_list, type_name="background_embedding"
+    ):
+        """`cal_related_score` reading the missing embeddings through the AsyncPaperClient
+        Returns:
+            score_all_dict (dict of paper_id -> score)
+        """
+        score_1 = self.store_related_score(embedding, related_paper_id_list, type_name)
+        if score_1 is None:
+            context_embeddings = await self.async_paper_client.get_papers_attribute(
+                related_paper_id_list, type_name
+            )
+            score_1 = self.context_related_score(
+                embedding, related_paper_id_list, context_embeddings
+            )
+        return dict(zip(related_paper_id_list, score_1))
+
+    def cal_related_score_many(
+        self, embeddings, related_paper_id_lists, type_name="background_embedding"
+    ):
+        """Batched `cal_related_score`: the candidates of all backgrounds are gathered once
+        from the embedding store and scored against all backgrounds in one matrix multiply
+        Args:
+            embeddings (np.ndarray, [B, embedding dimension]): the input backgrounds' embeddings
+            related_paper_id_lists (List of paper id lists): candidates of each background
+        Returns:
+            score_all_dicts (List of dict): score_all_dict of each background
+        """
+        store = self.embedding_store.get(type_name) if self.embedding_store is not None else None
+        all_paper_ids = np.unique(
+            np.fromiter(
+                (paper_id for paper_id_list in related_paper_id_lists for paper_id in paper_id_list),
+                dtype=np.int64,
+            )
+        )
+        found = None
+        if store is not None and len(all_paper_ids) > 0:
+            vectors, found = store.get(all_paper_ids)
+        if found is None or not np.all(found):
+            return [
+                self.cal_related_score(embedding, related_paper_id_list, type_name=type_name)[2]
+                for embedding, related_paper_id_list in zip(embeddings, related_paper_id_lists)
+            ]
+        queries = normalize_rows(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        # [B, len(all_paper_ids)]
+        scores = queries @ vectors.T
+        score_all_dicts = []
+        for i, related_paper_id_list in enumerate(related_paper_id_lists):
+            columns = np.searchsorted(
+                all_paper_ids, np.asarray(related_paper_id_list, dtype=np.int64)
+            )
+            score_1 = scores[i, columns]
+            if self.config.RETRIEVE.need_normalize and len(score_1) > 0:
+                score_1 = score_1 / np.max(score_1)
+            score_all_dicts.append(dict(zip(related_paper_id_list, score_1)))
+        return score_all_dicts
+
+    def get_weighted_paper_embedding(self, paper_id_list):
+        """The final embedding of each paper, which is the weighted sum of background_embedding,
+        contribution_embedding, summary_embedding and abstract_embedding, the fields of
+        non-zero weight of all papers are fetched in one round trip
+        Args:
+            paper_id_list (List of int)
+        Returns:
+            paper_embedding (np.ndarray, [len(paper_id_list), embedding dimension])
+        """
+        embeddings = self.paper_client.get_papers_embeddings(
+            paper_id_list, self.weighted_embedding_fields()
+        )
+        return self.weight_paper_embedding(embeddings)
+
+    def paper_embedding_weights(self):
+        """Weight of each embedding field, fields of weight 0 are left out and never fetched
+        """
+        weights = {
+            "background": self.config.RETRIEVE.s_bg,
+            "contribution": self.config.RETRIEVE.s_contribution,
+            "summary": self.config.RETRIEVE.s_summary,
+            "abstract": self.config.RETRIEVE.s_abstract,
+        }
+        return {field: weight for field, weight in weights.items() if weight != 0}
+
+    def weighted_embedding_fields(self):
+        return [
+            f"{field}_embedding{self.embedding_postfix}"
+            for field in self.paper_embedding_weights().keys()
+        ]
+
+    def weight_paper_embedding(self, embeddings):
+        """Weighted sum over the fields of `get_papers_embeddings`, [N, F, D] -> [N, D]
+        """
+        weights = np.array(list(self.paper_embedding_weights().values()), dtype=np.float32)
+        return np.einsum("nfd,f->nd", embeddings, weights)
+
+    async def aget_weighted_paper_embedding(self, paper_id_list):
+        """`get_weighted_paper_embedding` through the AsyncPaperClient
+        """
+        embeddings = await self.async_paper_client.get_papers_embeddings(
+            paper_id_list, self.weighted_embedding_fields()
+        )
+        return self.weight_paper_embedding(embeddings)
+
+    def filter_related_paper(self, score_dict, top_k, paper_embedding=None):
         """Pick top_k papers from all retrieved papers in terms of score_dict. If clustering
         is not used, top_k papers with highest scores will be picked. If clustering is used,
         we will pick papers from each cluster in turn util top_k papers are chosen.
         Args:
             score_dict (dict): dict of (paper_id, similarity with user input background)
             top_k (int): pick top_k papers
+            paper_embedding: pre-fetched `get_weighted_paper_embedding` of all papers in
+                `score_dict`, read from the database if None
         Returns:
 
         """
@@ -287,42 +932,8 @@ class Retriever(object):
             # clustering filter, ensure that each category the highest score save first
             # background embedding
             paper_id_list = list(score_dict.keys())
-            paper_embedding_list = [
-                self.paper_client.get_paper_attribute(paper_id, f"background_embedding{self.embedding_postfix}")
-                for paper_id in paper_id_list
-            ]
-            paper_embedding = np.array(paper_embedding_list)
-            # contribution embedding
-            paper_embedding_list = [
-                self.paper_client.get_paper_attribute(
-                    paper_id, f"contribution_embedding{self.embedding_postfix}"
-                )
-                for paper_id in paper_id_list
-            ]
-            paper_contribution_embedding = np.array(paper_embedding_list)
-            # summary embedding
-            paper_embedding_list = [
-                self.paper_client.get_paper_attribute(paper_id, f"summary_embedding{self.embedding_postfix}")
-                for paper_id in paper_id_list
-            ]
-            paper_summary_embedding = np.array(paper_embedding_list)
-            # abstract embedding
-            paper_embedding_list = [
-                self.paper_client.get_paper_attribute(paper_id, f"abstract_embedding{self.embedding_postfix}")
-                for paper_id in paper_id_list
-            ]
-            paper_abstract_embedding = np.array(paper_embedding_list)
-
-            weight_background = self.config.RETRIEVE.s_bg
-            weight_contribution = self.config.RETRIEVE.s_contribution
-            weight_summary = self.config.RETRIEVE.s_summary
-            weight_abstract = self.config.RETRIEVE.s_abstract
-            paper_embedding = (
-                weight_background * paper_embedding
-                + weight_contribution * paper_contribution_embedding
-                + weight_summary * paper_summary_embedding
-                + weight_abstract * paper_abstract_embedding
-            )
+            if paper_embedding is None:
+                paper_embedding = self.get_weighted_paper_embedding(paper_id_list)
 
             ## similarity_matrix of all retrieved papers
             similarity_matrix = np.dot(paper_embedding, paper_embedding.T)
@@ -350,25 +961,49 @@ class Retriever(object):
         Returns:
             result (List of Papers): return related papers with the least embedding distance
         """
-        result = self.paper_client.cosine_similarity_search(
-            embedding, k, type_name=type_name
-        )
+        index = self.vector_index.get(type_name) if self.vector_index is not None else None
+        if index is not None:
+            result = index.search(
+                embedding, k,
+                nprobe=self.config.RETRIEVE.get("ann_nprobe", 16),
+                exact_threshold=self.config.RETRIEVE.get("ann_exact_threshold", 20000),
+            )
+        else:
+            # exact fallback: full scan in neo4j
+            result = self.paper_client.cosine_similarity_search(
+                embedding, k, type_name=type_name
+            )
         # backtrack: first is itself
         result = result[1:]
         return result
 
+    def cosine_similarity_search_many(
+        self, embeddings, k=1, type_name="background_embedding"
+    ):
+        """Batched `cosine_similarity_search`, one ANN search for all embeddings
+        Returns:
+            results (List of paper id lists)
+        """
+        index = self.vector_index.get(type_name) if self.vector_index is not None else None
+        if index is not None:
+            results = index.search_many(
+                embeddings, k,
+                nprobe=self.config.RETRIEVE.get("ann_nprobe", 16),
+                exact_threshold=self.config.RETRIEVE.get("ann_exact_threshold", 20000),
+            )
+        else:
+            results = [
+                self.paper_client.cosine_similarity_search(embedding, k, type_name=type_name)
+                for embedding in embeddings
+            ]
+        # backtrack: first is itself
+        return [result[1:] for result in results]
+
     def cluster_algorithm(self, paper_id_list, similarity_matrix):
         """
         """
         threshold = self.config.RETRIEVE.similarity_threshold
-        uf = UnionFind(len(paper_id_list))
-        # merge
-        for i in range(len(similarity_matrix)):
-            for j in range(i + 1, len(similarity_matrix)):
-                if similarity_matrix[i][j] >= threshold:
-                    if can_merge(uf, similarity_matrix, i, j, threshold):
-                        uf.union(i, j)
-        cluster_labels = [uf.find(i) for i in range(len(similarity_matrix))]
+        cluster_labels = threshold_cluster(similarity_matrix, threshold)
         return cluster_labels
 
     def eval_related_paper_in_all(self, score_all_dict, target_paper_id_list):
@@ -387,42 +1022,8 @@ class Retriever(object):
         all_paper_id_set = set(related_paper_id_list)
         all_paper_id_set.update(target_paper_id_list)
         all_paper_id_list = list(all_paper_id_set)
-        # get all target papers' background_embedding
-        paper_embedding_list = [
-            self.paper_client.get_paper_attribute(paper_id, f"background_embedding{self.embedding_postfix}")
-            for paper_id in target_paper_id_list
-        ]
-        paper_embedding = np.array(paper_embedding_list)
-        # get all target papers' contribution_embedding
-        paper_embedding_list = [
-            self.paper_client.get_paper_attribute(paper_id, f"contribution_embedding{self.embedding_postfix}")
-            for paper_id in target_paper_id_list
-        ]
-        paper_contribution_embedding = np.array(paper_embedding_list)
-        # get all target papers' summary_embedding
-        paper_embedding_list = [
-            self.paper_client.get_paper_attribute(paper_id, f"summary_embedding{self.embedding_postfix}")
-            for paper_id in target_paper_id_list
-        ]
-        # abstract embedding
-        paper_embedding_list = [
-            self.paper_client.get_paper_attribute(paper_id, f"abstract_embedding{self.embedding_postfix}")
-            for paper_id in target_paper_id_list
-        ]
-        paper_abstract_embedding = np.array(paper_embedding_list)
-
-        paper_summary_embedding = np.array(paper_embedding_list)
-        weight_background = self.config.RETRIEVE.s_bg
-        weight_contribution = self.config.RETRIEVE.s_contribution
-        weight_summary = self.config.RETRIEVE.s_summary
-        weight_abstract = self.config.RETRIEVE.s_abstract
         # 2D matrix of size [# of target papers, embedding dimension]
-        target_paper_embedding = (
-            weight_background * paper_embedding
-            + weight_contribution * paper_contribution_embedding
-            + weight_summary * paper_summary_embedding
-            + weight_abstract * paper_abstract_embedding
-        )
+        target_paper_embedding = self.get_weighted_paper_embedding(target_paper_id_list)
         similarity_threshold = self.config.RETRIEVE.similarity_threshold
         similarity_matrix = np.dot(target_paper_embedding, target_paper_embedding.T)
         # return each target_paper's cluster label
@@ -438,39 +1039,10 @@ class Retriever(object):
         
         ## calculate the similarity between each two papers
         all_labels = []
-        for paper_id in all_paper_id_list:
-            # for each paper, get its background_embedding
-            paper_bg_embedding = [
-                self.paper_client.get_paper_attribute(paper_id, f"background_embedding{self.embedding_postfix}")
-            ]
-            paper_bg_embedding = np.array(paper_bg_embedding)
-            # for each paper, get its contribution_embedding
-            paper_contribution_embedding = [
-                self.paper_client.get_paper_attribute(
-                    paper_id, f"contribution_embedding{self.embedding_postfix}"
-                )
-            ]
-            paper_contribution_embedding = np.array(paper_contribution_embedding)
-            # for each paper, get its summary_embedding
-            paper_summary_embedding = [
-                self.paper_client.get_paper_attribute(paper_id, f"summary_embedding{self.embedding_postfix}")
-            ]
-            paper_summary_embedding = np.array(paper_summary_embedding)
-            # for each paper, get its abstract_embedding
-            paper_abstract_embedding = [
-                self.paper_client.get_paper_attribute(paper_id, f"abstract_embedding{self.embedding_postfix}")
-            ]
-            paper_abstract_embedding = np.array(paper_abstract_embedding)
-            
-            paper_embedding = (
-                weight_background * paper_bg_embedding
-                + weight_contribution * paper_contribution_embedding
-                + weight_summary * paper_summary_embedding
-                + weight_abstract * paper_abstract_embedding
-            )
-
-            # vector of size embedding dimension
-            similarities = cosine_similarity(paper_embedding, target_paper_embedding)[0]
+        all_paper_embedding = self.get_weighted_paper_embedding(all_paper_id_list)
+        # matrix of size [# of all papers, # of target papers]
+        all_similarities = cosine_similarity(all_paper_embedding, target_paper_embedding)
+        for similarities in all_similarities:
             if np.any(similarities >= similarity_threshold):
                 all_labels.append(target_labels[np.argmax(similarities)])
             else:
@@ -634,6 +1206,10 @@ class SNRetriever(Retriever):
     def __init__(self, config):
         super().__init__(config)
 
+    @property
+    def score_type_name(self):
+        return f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
+
     def retrieve_paper(self, bg):
         """Retrieve papers P (a set) according to embeddings' similarity between the input 
         background and the backgrounds from the database. Optionally, you can also retrieve 
@@ -647,25 +1223,54 @@ class SNRetriever(Retriever):
                 "entities" (List): An empty list (TODO: remove),
                 "cocite_paper" (List of int): all papers cocited with embedding-retrieved papers
         """
-        entities = []
-        embedding = self.embedding_model.encode(bg, device=self.device)
+        embedding = self.encode_query(bg)
         sn_paper_id_list = self.cosine_similarity_search(
             embedding=embedding,
             k=self.config.RETRIEVE.sn_retrieve_paper_num,
             type_name=f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
         )
+        return self.collect_related_paper(embedding, sn_paper_id_list)
+
+    async def aretrieve_paper_of(self, bg, entities):
+        embedding = await self.aencode_query(bg)
+        sn_paper_id_list = await self.acosine_similarity_search(
+            embedding,
+            k=self.config.RETRIEVE.sn_retrieve_paper_num,
+            type_name=f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
+        )
+        cocite_id_set = await self.acocite_ids(
+            sn_paper_id_list, k=self.config.RETRIEVE.cocite_top_k
+        )
+        return self.collect_related_paper(embedding, sn_paper_id_list, cocite_id_set), embedding
+
+    def retrieve_paper_many(self, backgrounds, entities_list, embeddings):
+        sn_paper_id_lists = self.cosine_similarity_search_many(
+            embeddings,
+            k=self.config.RETRIEVE.sn_retrieve_paper_num,
+            type_name=f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
+        )
+        return [
+            self.collect_related_paper(embedding, sn_paper_id_list)
+            for embedding, sn_paper_id_list in zip(embeddings, sn_paper_id_lists)
+        ]
+
+    def collect_related_paper(self, embedding, sn_paper_id_list, cocite_id_set=None):
+        """Add the co-cited papers to the embedding-retrieved papers, see `retrieve_paper`
+        Args:
+            cocite_id_set (set): pre-fetched co-cited papers, looked up if None
+        """
+        entities = []
         related_paper = set()
         related_paper.update(sn_paper_id_list)
-        cocite_id_set = set()
-        if self.use_cocite:
-            for paper_id in related_paper:
+        if cocite_id_set is None:
+            cocite_id_set = set()
+            if self.use_cocite:
                 cocite_id_set.update(
-                    self.cocite.get_cocite_ids(
-                        paper_id, k=self.config.RETRIEVE.cocite_top_k
+                    self.cocite.get_cocite_ids_many(
+                        related_paper, k=self.config.RETRIEVE.cocite_top_k
                     )
                 )
-            related_paper = related_paper.union(cocite_id_set)
-        related_paper = list(related_paper)
+        related_paper = list(related_paper.union(cocite_id_set))
         logger.debug(f"paper num before filter: {len(related_paper)}")
         result = {
             f"background_embedding{self.embedding_postfix}": embedding,
@@ -694,53 +1299,18 @@ class SNRetriever(Retriever):
                 "retrieve_paper_num": len(related_paper_id_list),
                 "label_num": TODO,
         """
-        if need_evaluate:
-            if target_paper_id_list is None or len(target_paper_id_list) == 0:
-                logger.error(
-                    "If you need evaluate retriever, please input target paper is list..."
-                )
-            else:
-                target_paper_id_list = list(set(target_paper_id_list))
+        target_paper_id_list = self.check_target_paper_id_list(
+            need_evaluate, target_paper_id_list
+        )
         retrieve_result = self.retrieve_paper(bg)
-        related_paper_id_list = retrieve_result["paper"]
-        retrieve_paper_num = len(related_paper_id_list)
         # scores between the input background and all retrieved papers
         _, _, score_all_dict = self.cal_related_score(
-            retrieve_result[f"background_embedding{self.embedding_postfix}"], related_paper_id_list=related_paper_id_list,
-            type_name=f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
+            retrieve_result[f"background_embedding{self.embedding_postfix}"], related_paper_id_list=retrieve_result["paper"],
+            type_name=self.score_type_name
+        )
+        return self.build_retrieve_result(
+            retrieve_result, score_all_dict, need_evaluate, target_paper_id_list
         )
-        top_k_matrix = {}
-        recall = 0
-        precision = 0
-        filtered_recall = 0
-        label_num = 0
-        filtered_precision = 0
-        if need_evaluate:
-            top_k_matrix, label_num, recall, precision = self.eval_related_paper_in_all(
-                score_all_dict, target_paper_id_list
-            )
-            logger.debug("Top K matrix:{}".format(top_k_matrix))
-            logger.debug("before filter:")
-            logger.debug(f"Recall: {recall:.3f}")
-            logger.debug(f"Precision: {precision:.3f}")
-        ## For idea generation, only top 10 papers will be used, which has no relations with retriveal evaluation
-        related_paper = self.filter_related_paper(score_all_dict, top_k=self.config.RETRIEVE.all_retrieve_paper_num)
-        related_paper = self.update_related_paper(related_paper)
-        result = {
-            "recall": recall,
-            "precision": precision,
-            "filtered_recall": filtered_recall,
-            "filtered_precision": filtered_precision,
-            "related_paper": related_paper,
-            "related_paper_id_list": related_paper_id_list,
-            "cocite_paper_id_list": retrieve_result["cocite_paper"],
-            "entities": retrieve_result["entities"],
-            "top_k_matrix": top_k_matrix,
-            "gt_reference_num": len(target_paper_id_list),
-            "retrieve_paper_num": retrieve_paper_num,
-            "label_num": label_num,
-        }
-        return result
 
 
 @autoregister("KG")
@@ -748,20 +1318,51 @@ class KGRetriever(Retriever):
     def __init__(self, config):
         super().__init__(config)
 
+    @property
+    def score_type_name(self):
+        return f"background_embedding{self.embedding_postfix}"
+
     def retrieve_paper(self, entities):
         """Retrieve according to entities
         """
         new_entities = self.retrieve_entities_by_enties(entities)
         logger.debug("KG entities for retriever: {}".format(new_entities))
-        related_paper = set()
-        for entity in new_entities:
-            paper_id_set = set(self.paper_client.find_paper_by_entity(entity))
-            related_paper = related_paper.union(paper_id_set)
-        cocite_id_set = set()
-        if self.use_cocite:
-            for paper_id in related_paper:
-                cocite_id_set.update(self.cocite.get_cocite_ids(paper_id))
-            related_paper = related_paper.union(cocite_id_set)
+        return self.collect_related_paper(
+            entities, self.find_papers_by_entities(new_entities)
+        )
+
+    async def aretrieve_paper_of(self, bg, entities):
+        # the query is encoded while the entities are expanded
+        embedding, new_entities = await asyncio.gather(
+            self.aencode_query(bg), self.aretrieve_entities_by_enties(entities)
+        )
+        logger.debug("KG entities for retriever: {}".format(new_entities))
+        related_paper = await self.afind_papers_by_entities(new_entities)
+        cocite_id_set = await self.acocite_ids(related_paper)
+        return self.collect_related_paper(entities, related_paper, cocite_id_set), embedding
+
+    def retrieve_paper_many(self, backgrounds, entities_list, embeddings):
+        new_entities_list = []
+        for entities in entities_list:
+            new_entities = self.retrieve_entities_by_enties(entities)
+            logger.debug("KG entities for retriever: {}".format(new_entities))
+            new_entities_list.append(new_entities)
+        paper_id_sets = self.find_papers_by_entities_many(new_entities_list)
+        return [
+            self.collect_related_paper(entities, paper_id_set)
+            for entities, paper_id_set in zip(entities_list, paper_id_sets)
+        ]
+
+    def collect_related_paper(self, entities, related_paper, cocite_id_set=None):
+        """Add the co-cited papers to the entity-retrieved papers
+        Args:
+            cocite_id_set (set): pre-fetched co-cited papers, looked up if None
+        """
+        if cocite_id_set is None:
+            cocite_id_set = set()
+            if self.use_cocite:
+                cocite_id_set.update(self.cocite.get_cocite_ids_many(related_paper))
+        related_paper = related_paper.union(cocite_id_set)
         related_paper = list(related_paper)
         logger.debug(f"paper num before filter: {len(related_paper)}")
         result = {
@@ -778,53 +1379,18 @@ class KGRetriever(Retriever):
         Return:
             list(dict)
         """
-        if need_evaluate:
-            if target_paper_id_list is None or len(target_paper_id_list) == 0:
-                logger.error(
-                    "If you need evaluate retriever, please input target paper is list..."
-                )
-            else:
-                target_paper_id_list = list(set(target_paper_id_list))
-                logger.debug(f"target paper id list: {target_paper_id_list}")
+        target_paper_id_list = self.check_target_paper_id_list(
+            need_evaluate, target_paper_id_list
+        )
         retrieve_result = self.retrieve_paper(entities)
-        related_paper_id_list = retrieve_result["paper"]
-        retrieve_paper_num = len(related_paper_id_list)
-        embedding = self.embedding_model.encode(bg, device=self.device)
+        embedding = self.encode_query(bg)
         _, _, score_all_dict = self.cal_related_score(
-            embedding, related_paper_id_list=related_paper_id_list,
-            type_name=f"background_embedding{self.embedding_postfix}"
+            embedding, related_paper_id_list=retrieve_result["paper"],
+            type_name=self.score_type_name
+        )
+        return self.build_retrieve_result(
+            retrieve_result, score_all_dict, need_evaluate, target_paper_id_list
         )
-        top_k_matrix = {}
-        recall = 0
-        precision = 0
-        filtered_recall = 0
-        label_num = 0
-        filtered_precision = 0
-        if need_evaluate:
-            top_k_matrix, label_num, recall, precision = self.eval_related_paper_in_all(
-                score_all_dict, target_paper_id_list
-            )
-            logger.debug("Top P ACC:{}".format(top_k_matrix))
-            logger.debug("before filter:")
-            logger.debug(f"Recall: {recall:.3f}")
-            logger.debug(f"Precision: {precision:.3f}")
-        related_paper = self.filter_related_paper(score_all_dict, top_k=self.config.RETRIEVE.all_retrieve_paper_num)
-        related_paper = self.update_related_paper(related_paper)
-        result = {
-            "recall": recall,
-            "precision": precision,
-            "filtered_recall": filtered_recall,
-            "filtered_precision": filtered_precision,
-            "related_paper": related_paper,
-            "related_paper_id_list": related_paper_id_list,
-            "cocite_paper_id_list": retrieve_result["cocite_paper"],
-            "entities": retrieve_result["entities"],
-            "top_k_matrix": top_k_matrix,
-            "gt_reference_num": len(target_paper_id_list),
-            "retrieve_paper_num": retrieve_paper_num,
-            "label_num": label_num,
-        }
-        return result
 
 
 @autoregister("SNKG")
@@ -832,39 +1398,196 @@ class SNKGRetriever(Retriever):
     def __init__(self, config):
         super().__init__(config)
 
+    @property
+    def score_type_name(self):
+        return f"background_embedding{self.embedding_postfix}"
+
     def retrieve_paper(self, bg, entities):
-        sn_entities = []
-        ## 1. Retrieve papers according to the embeddings of input background
-        embedding = self.embedding_model.encode(bg, device=self.device)
+        """Retrieve papers according to the input background, the entities and citation
+        co-occurrence. Stages which do not depend on each other run concurrently: the input
+        entities are expanded while the vector search runs, and the papers of the expanded
+        entities are looked up in parallel
+        Returns:
+            result (dict): see `collect_related_paper`, plus
+                "timings" (dict): wall time of each stage in seconds
+        """
+        timings = {}
+        start = time.perf_counter()
+        ## 1. Retrieve papers according to the embeddings of input background, meanwhile
+        ## expand the input entities, which does not depend on the retrieved papers
+        sn_future = self.submit_stage(timings, "sn_search", self.sn_search, bg)
+        user_future = self.submit_stage(timings, "user_entities", self.prefetch_entities, entities)
+        embedding, sn_paper_id_list = self.wait_stage(sn_future, "sn_search")
+        related_entities, entity_paper_num = self.wait_stage(user_future, "user_entities")
+        ## 2. Retrieve papers according to entites
+        entities, new_entities = self.run_stage(
+            timings, "sn_entities", self.expand_entities,
+            entities, sn_paper_id_list, related_entities, entity_paper_num,
+        )
+        paper_id_set = self.run_stage(
+            timings, "entity_papers", self.find_papers_by_entities_concurrently, new_entities
+        )
+        ## 3. Add co-cited papers
+        result = self.run_stage(
+            timings, "cocite", self.collect_related_paper,
+            embedding, sn_paper_id_list, entities, paper_id_set,
+        )
+        timings["total"] = time.perf_counter() - start
+        logger.debug(f"SNKG retrieve stage timings: {timings}")
+        result["timings"] = timings
+        return result
+
+    async def aretrieve_paper_of(self, bg, entities):
+        """`retrieve_paper` for an event loop, the same stages with the database reads
+        awaited on the AsyncPaperClient
+        """
+        timings = {}
+        start = time.perf_counter()
+        (embedding, sn_paper_id_list), (related_entities, entity_paper_num) = await asyncio.gather(
+            self.await_stage(timings, "sn_search", self.asn_search(bg)),
+            self.await_stage(timings, "user_entities", self.aprefetch_entities(entities)),
+        )
+        entities, new_entities = await self.await_stage(
+            timings, "sn_entities",
+            self.aexpand_entities(entities, sn_paper_id_list, related_entities, entity_paper_num),
+        )
+        paper_id_set = await self.await_stage(
+            timings, "entity_papers", self.afind_papers_by_entities(new_entities)
+        )
+        cocite_id_set = await self.await_stage(
+            timings, "cocite", self.acocite_ids(set(sn_paper_id_list) | paper_id_set)
+        )
+        result = self.collect_related_paper(
+            embedding, sn_paper_id_list, entities, paper_id_set, cocite_id_set
+        )
+        timings["total"] = time.perf_counter() - start
+        logger.debug(f"SNKG async retrieve stage timings: {timings}")
+        result["timings"] = timings
+        return result, embedding
+
+    async def asn_search(self, bg):
+        embedding = await self.aencode_query(bg)
+        sn_paper_id_list = await self.acosine_similarity_search(
+            embedding, k=self.config.RETRIEVE.sn_num_for_entity,
+            type_name=f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
+        )
+        return embedding, sn_paper_id_list
+
+    async def aprefetch_entities(self, entities):
+        """`prefetch_entities` awaited on the AsyncPaperClient
+        """
+        related_entities = await self.afind_related_entities(entities)
+        names = set(entities)
+        for related in related_entities.values():
+            names.update(related)
+        return related_entities, await self.aget_entities_related_paper_num(list(names))
+
+    async def aexpand_entities(
+        self, entities, sn_paper_id_list, related_entities=None, entity_paper_num=None
+    ):
+        """`expand_entities` awaited on the AsyncPaperClient
+        """
+        sn_entities = await self.afind_entities_by_paper_list(sn_paper_id_list)
+        logger.debug("SN entities for retriever: {}".format(sn_entities))
+        entities = list(set(entities + sn_entities))
+        new_entities = await self.aretrieve_entities_by_enties(
+            entities, related_entities, entity_paper_num
+        )
+        logger.debug("SNKG entities for retriever: {}".format(new_entities))
+        return entities, new_entities
+
+    def sn_search(self, bg):
+        embedding = self.encode_query(bg)
         sn_paper_id_list = self.cosine_similarity_search(
             embedding, k=self.config.RETRIEVE.sn_num_for_entity,
             type_name=f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
         )
-        related_paper = set()
-        related_paper.update(sn_paper_id_list)
-        logger.debug(f"SN retrieve {len(related_paper)} papers")
+        return embedding, sn_paper_id_list
 
-        ## 2. Retrieve papers according to entites
+    def prefetch_entities(self, entities):
+        """Related entities of `entities` and the paper numbers of all of them, the part of
+        `retrieve_entities_by_enties` known before the vector search finishes
+        """
+        related_entities = self.find_related_entities(entities)
+        names = set(entities)
+        for related in related_entities.values():
+            names.update(related)
+        return related_entities, self.get_entities_related_paper_num(list(names))
+
+    def find_papers_by_entities_concurrently(self, entities):
+        """`find_papers_by_entities`, the per-entity database lookups are run on the executor
+        """
+        if self.entity_index is not None:
+            return self.find_papers_by_entities(entities)
+        futures = [
+            self.get_executor().submit(self.paper_client.find_paper_by_entity, entity)
+            for entity in entities
+        ]
+        paper_id_set = set()
+        for future in futures:
+            paper_id_set.update(self.wait_stage(future, "entity_papers"))
+        return paper_id_set
+
+    def retrieve_paper_many(self, backgrounds, entities_list, embeddings):
+        sn_paper_id_lists = self.cosine_similarity_search_many(
+            embeddings, k=self.config.RETRIEVE.sn_num_for_entity,
+            type_name=f"{self.config.RETRIEVE.SN_field_name}_embedding{self.embedding_postfix}"
+        )
+        expanded = [
+            self.expand_entities(entities, sn_paper_id_list)
+            for entities, sn_paper_id_list in zip(entities_list, sn_paper_id_lists)
+        ]
+        paper_id_sets = self.find_papers_by_entities_many(
+            [new_entities for _, new_entities in expanded]
+        )
+        return [
+            self.collect_related_paper(embedding, sn_paper_id_list, entities, paper_id_set)
+            for embedding, sn_paper_id_list, (entities, _), paper_id_set in zip(
+                embeddings, sn_paper_id_lists, expanded, paper_id_sets
+            )
+        ]
+
+    def expand_entities(
+        self, entities, sn_paper_id_list, related_entities=None, entity_paper_num=None
+    ):
+        """Add the entities of the embedding-retrieved papers, then expand them
+        Args:
+            related_entities, entity_paper_num: pre-fetched, see `prefetch_entities`
+        Returns:
+            entities: the input entities and the entities of `sn_paper_id_list`
+            new_entities: entities after expansion, used to retrieve papers
+        """
         # Fetch all entities from embedding-retrieved papers
-        sn_entities += self.paper_client.find_entities_by_paper_list(sn_paper_id_list)
+        sn_entities = self.find_entities_by_paper_list(sn_paper_id_list)
         logger.debug("SN entities for retriever: {}".format(sn_entities))
         entities = list(set(entities + sn_entities))
         # Expand entity list through synonyms
-        new_entities = self.retrieve_entities_by_enties(entities)
+        new_entities = self.retrieve_entities_by_enties(
+            entities, related_entities, entity_paper_num
+        )
         logger.debug("SNKG entities for retriever: {}".format(new_entities))
-        paper_id_set = set()
-        for entity in new_entities:
-            paper_id_set.update(self.paper_client.find_paper_by_entity(entity))
+        return entities, new_entities
+
+    def collect_related_paper(
+        self, embedding, sn_paper_id_list, entities, paper_id_set, cocite_id_set=None
+    ):
+        """Merge the embedding-retrieved and entity-retrieved papers, add the co-cited papers
+        Args:
+            cocite_id_set (set): pre-fetched co-cited papers, looked up if None
+        """
+        related_paper = set()
+        related_paper.update(sn_paper_id_list)
+        logger.debug(f"SN retrieve {len(related_paper)} papers")
         related_paper = related_paper.union(paper_id_set)
         logger.debug(f"Entity retrieve {len(paper_id_set)} papers")
         logger.debug(f"SN+entity retrieve {len(related_paper)} papers")
 
         ## 3. Retrieve papers according to citation co-occurrence
-        cocite_id_set = set()
-        if self.use_cocite:
-            for paper_id in related_paper:
-                cocite_id_set.update(self.cocite.get_cocite_ids(paper_id))
-            related_paper = related_paper.union(cocite_id_set)
+        if cocite_id_set is None:
+            cocite_id_set = set()
+            if self.use_cocite:
+                cocite_id_set.update(self.cocite.get_cocite_ids_many(related_paper))
+        related_paper = related_paper.union(cocite_id_set)
         logger.debug(f"Cocite retrieve {len(cocite_id_set)} papers")
         logger.debug(f"SN+entity+cocite retrieve {len(related_paper)} papers")
 
@@ -887,55 +1610,16 @@ class SNKGRetriever(Retriever):
         Return:
             list(dict)
         """
-        if need_evaluate:
-            if target_paper_id_list is None or len(target_paper_id_list) == 0:
-                logger.error(
-                    "If you need evaluate retriever, please input target paper is list..."
-                )
-            else:
-                target_paper_id_list = list(set(target_paper_id_list))
-                logger.debug(f"target paper id list: {target_paper_id_list}")
+        target_paper_id_list = self.check_target_paper_id_list(
+            need_evaluate, target_paper_id_list
+        )
         retrieve_result = self.retrieve_paper(bg, entities)
-        related_paper_id_list = retrieve_result["paper"]
-        retrieve_paper_num = len(related_paper_id_list)
         logger.info("=== Begin cal related paper score ===")
         _, _, score_all_dict = self.cal_related_score(
-            retrieve_result[f"background_embedding{self.embedding_postfix}"], related_paper_id_list=related_paper_id_list,
-            type_name=f"background_embedding{self.embedding_postfix}"
+            retrieve_result[f"background_embedding{self.embedding_postfix}"], related_paper_id_list=retrieve_result["paper"],
+            type_name=self.score_type_name
         )
         logger.info("=== End cal related paper score ===")
-        top_k_matrix = {}
-        recall = 0
-        precision = 0
-        filtered_recall = 0
-        filtered_precision = 0
-        label_num = 0
-        if need_evaluate:
-            top_k_matrix, label_num, recall, precision = self.eval_related_paper_in_all(
-                score_all_dict, target_paper_id_list
-            )
-            logger.debug("Top K matrix:{}".format(top_k_matrix))
-            logger.debug("before filter:")
-            logger.debug(f"Recall: {recall:.3f}")
-            logger.debug(f"Precision: {precision:.3f}")
-        logger.info("=== Begin filter related paper score ===")
-        related_paper = self.filter_related_paper(score_all_dict, self.config.RETRIEVE.all_retrieve_paper_num)
-        logger.info("=== End filter related paper score ===")
-        related_paper = self.update_related_paper(related_paper)
-        result = {
-            "recall": recall,
-            "precision": precision,
-            "filtered_recall": filtered_recall,
-            "filtered_precision": filtered_precision,
-            "related_paper": related_paper,
-            "cocite_paper_id_list": retrieve_result["cocite_paper"],
-            "related_paper_id_list": related_paper_id_list,
-            "entities": retrieve_result["entities"],
-            "top_k_matrix": top_k_matrix,
-            "gt_reference_num": (
-                len(target_paper_id_list) if target_paper_id_list is not None else 0
-            ),
-            "retrieve_paper_num": retrieve_paper_num,
-            "label_num": label_num,
-        }
-        return result
+        return self.build_retrieve_result(
+            retrieve_result, score_all_dict, need_evaluate, target_paper_id_list
+        )
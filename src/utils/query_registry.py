@@ -0,0 +1,221 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.query_registry
+
+File Name : query_registry.py
+
+Description : Named Cypher templates of PaperClient. Values are always passed as query
+    parameters, so a template renders to the same query string on every call and neo4j
+    reuses its cached plan. Property names, which Cypher cannot take as parameters in
+    MATCH patterns and SET clauses, are filled into `{placeholders}` only from a whitelist.
+    Renders are counted per template.
+
+Creation Date : 2026-10-16
+"""
+import threading
+from collections import Counter
+from .embedding_postfix import ALL_EMBEDDING_POSTFIXES
+
+
+PAPER_TEXT_PROPERTIES = [
+    "hash_id",
+    "venue_name",
+    "year",
+    "title",
+    "pdf_url",
+    "abstract",
+    "introduction",
+    "reference",
+    "summary",
+    "motivation",
+    "contribution",
+    "methodology",
+    "ground_truth",
+    "reference_filter",
+    "conclusions",
+    "background",
+    "entities",
+    "cite_id_list",
+    "all_cite_id_list",
+    "detail_method",
+]
+EMBEDDING_FIELDS = ["abstract", "background", "contribution", "summary", "motivation"]
+PAPER_EMBEDDING_PROPERTIES = ["embedding"] + [
+    f"{field}_embedding{postfix}"
+    for field in EMBEDDING_FIELDS
+    for postfix in ALL_EMBEDDING_POSTFIXES
+]
+PAPER_PROPERTIES = frozenset(PAPER_TEXT_PROPERTIES + PAPER_EMBEDDING_PROPERTIES)
+
+PAPER_QUERY_TEMPLATES = {
+    "paper_by_hash_id": """
+        MATCH (p:Paper {{hash_id: $hash_id}})
+        RETURN p
+        """,
+    "papers_record": """
+        UNWIND $papers AS paper
+        MATCH (p:Paper {{hash_id: paper.hash_id}})
+        RETURN p.hash_id AS hash_id, [field IN $fields | p[field]] AS values
+        """,
+    "papers_attribute": """
+        UNWIND $paper_ids AS paper_id
+        MATCH (p:Paper {{hash_id: paper_id}})
+        RETURN p.hash_id AS hash_id, p[$attribute_name] AS attributeValue
+        """,
+    "papers_embeddings": """
+        UNWIND $paper_ids AS paper_id
+        MATCH (p:Paper {{hash_id: paper_id}})
+        RETURN p.hash_id AS hash_id, [field IN $field_names | p[field]] AS embeddings
+        """,
+    "related_entities_of_entity_list": """
+        UNWIND $batch_entities AS entity_name
+        MATCH (e1:Entity {{name: entity_name}})-[:RELATED_TO]->(p:Paper)<-[:RELATED_TO]-(e2:Entity)
+        WHERE e1 <> e2
+        WITH e1, e2, COUNT(p) AS common_papers, entity_name
+        WHERE common_papers > $k
+        RETURN e2.name AS entities, entity_name AS source_entity, common_papers
+        """,
+    "entities_by_paper_list": """
+        UNWIND $hash_ids AS hash_id
+        MATCH (e:Entity)-[:RELATED_TO]->(p:Paper {{hash_id: hash_id}})
+        RETURN hash_id, e.name AS entity_name
+        """,
+    "papers_by_entity": """
+        MATCH (e1:Entity {{name: $entity_name}})-[:RELATED_TO]->(p:Paper)
+        RETURN p.hash_id AS hash_id
+        """,
+    "entities_related_paper_num": """
+        UNWIND $entity_names AS entity_name
+        MATCH (e:Entity {{name: entity_name}})-[:RELATED_TO]->(p:Paper)
+        WITH entity_name, COUNT(p) AS PaperCount
+        RETURN entity_name, PaperCount
+        """,
+    "papers_before_year": """
+        UNWIND $paper_id_list AS hash_id
+        MATCH (p:Paper {{hash_id: hash_id}})
+        WHERE p.year < $year
+        RETURN DISTINCT p.hash_id AS hash_id
+        """,
+    "paper_attribute": """
+        MATCH (p:Paper {{hash_id: $hash_id}})
+        RETURN p.`{attribute}` AS attributeValue
+        """,
+    "paper_by_attribute": """
+        MATCH (p:Paper {{`{attribute}`: $value}})
+        RETURN p
+        LIMIT 1
+        """,
+    "set_paper_field": """
+        MATCH (n:Paper {{hash_id: $hash_id}})
+        SET n.`{field}` = $content
+        RETURN n
+        """,
+    "paper_context": """
+        MATCH (p:Paper {{hash_id: $hash_id}})
+        WHERE p.`{field}` IS NOT NULL
+        RETURN p.`{field}` AS context, p.hash_id AS hash_id, p.title AS title
+        """,
+    "papers_contexts_after": """
+        MATCH (p:Paper)
+        WHERE p.hash_id > $last
+        WITH p, [i IN range(0, size($fields) - 1) |
+            CASE WHEN NOT $only_missing OR p[$embeddings[i]] IS NULL
+            THEN p[$fields[i]] END] AS contexts
+        WHERE any(context IN contexts WHERE context IS NOT NULL)
+        RETURN p.hash_id AS hash_id, p.title AS title, contexts
+        ORDER BY p.hash_id
+        LIMIT $batch_size
+        """,
+    "set_paper_embedding": """
+        MERGE (p:Paper {{hash_id: $hash_id}})
+        SET p.`{embedding}` = $embedding
+        """,
+    "set_papers_embedding": """
+        UNWIND $data AS row
+        MERGE (p:Paper {{hash_id: row.hash_id}})
+        SET p.`{embedding}` = row.embedding
+        """,
+    "set_papers_properties": """
+        UNWIND $rows AS row
+        MATCH (p:Paper {{hash_id: row.hash_id}})
+        SET p += row.props
+        """,
+    "vector_index_search": """
+        CALL db.index.vector.queryNodes($index_name, $k, $embedding)
+        YIELD node AS paper, score
+        WHERE score > 0
+        RETURN paper.hash_id AS hash_id, score
+        ORDER BY score DESC
+        """,
+    "cosine_similarity_scan": """
+        MATCH (paper:Paper)
+        WITH paper,
+            vector.similarity.cosine(paper.`{embedding}`, $embedding) AS score
+        WHERE score > 0
+        RETURN paper.hash_id AS hash_id, score
+        ORDER BY score DESC LIMIT $k
+        """,
+    "all_paper_embeddings": """
+        MATCH (p:Paper)
+        WHERE p.`{embedding}` IS NOT NULL
+        RETURN p.hash_id AS hash_id, p.`{embedding}` AS embedding
+        """,
+    "paper_embedding_count": """
+        MATCH (p:Paper)
+        WHERE p.`{embedding}` IS NOT NULL
+        RETURN count(p) AS papers
+        """,
+}
+
+
+class QueryRegistry:
+    """
+    templates (dict of name -> Cypher template): `{placeholder}`s are property names,
+        literal braces are doubled as in f-strings
+    allowed_properties (set of str): the only values a placeholder may take
+    """
+
+    def __init__(self, templates=PAPER_QUERY_TEMPLATES, allowed_properties=PAPER_PROPERTIES) -> None:
+        self.templates = dict(templates)
+        self.allowed_properties = allowed_properties
+        self.lock = threading.Lock()
+        self.rendered = {}
+        self.renders = Counter()
+
+    def register(self, name, template):
+        with self.lock:
+            self.templates[name] = template
+
+    def query(self, name, **properties):
+        """The query string of template `name` with its property placeholders filled in,
+        counted as one render of the template (a string rendered once and run in a loop
+        counts once)
+        Raises:
+            KeyError: unknown template
+            ValueError: a property name out of the whitelist
+        """
+        for placeholder, property_name in properties.items():
+            if property_name not in self.allowed_properties:
+                raise ValueError(
+                    f"property {property_name!r} ({placeholder}) is not allowed in query {name}"
+                )
+        key = (name, tuple(sorted(properties.items())))
+        with self.lock:
+            query = self.rendered.get(key, None)
+            if query is None:
+                query = self.templates[name].format(**properties)
+                self.rendered[key] = query
+            self.renders[name] += 1
+        return query
+
+    def stats(self):
+        """Template name -> number of renders and of distinct query strings (plans)
+        """
+        with self.lock:
+            variants = Counter(name for name, _ in self.rendered.keys())
+            return {
+                name: {"renders": self.renders[name], "variants": variants[name]}
+                for name in self.templates
+                if self.renders[name] > 0
+            }
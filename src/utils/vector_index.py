@@ -0,0 +1,255 @@
+r"""_summary_
+-*- coding: utf-8 -*-
+
+Module : utils.vector_index
+
+File Name : vector_index.py
+
+Description : In-process approximate nearest neighbour index (IVF) over the paper
+    embeddings stored in neo4j. One index is built per embedding property, e.g.
+    `background_embedding_jina_v3_text_matching`, persisted under `DEFAULT.index_dir`
+    and loaded by the retrievers at startup. An index records the number of papers with
+    its embedding when built; while the database holds a different number the retrievers
+    search neo4j instead, so papers embedded after the build are not missed.
+
+Creation Date : 2026-10-16
+"""
+import os
+import json
+import time
+import numpy as np
+from loguru import logger
+
+
+def normalize_rows(matrix):
+    """L2-normalize every row so that cosine similarity becomes a dot product
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IVFIndex:
+    """Inverted-file index: vectors are clustered by spherical k-means into `nlist`
+    lists, a query only scans the `nprobe` lists whose centroids are closest to it.
+    `nprobe >= nlist` (or a corpus smaller than `exact_threshold`) gives an exact search.
+    """
+
+    def __init__(self, centroids, offsets, ids, vectors, meta=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.meta = meta if meta is not None else {}
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=65536):
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start : start + chunk_size]
+            assign[start : start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+        return assign
+
+    @staticmethod
+    def _kmeans(vectors, nlist, n_iter=10, max_points_per_list=256, seed=0):
+        """Spherical k-means on a sample of the (normalized) vectors
+        """
+        rng = np.random.default_rng(seed)
+        n = len(vectors)
+        sample_num = min(n, nlist * max_points_per_list)
+        train = vectors[np.sort(rng.choice(n, sample_num, replace=False))]
+        centroids = train[rng.choice(sample_num, nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = IVFIndex._assign(train, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if np.any(empty):
+                # re-seed empty lists with random training points
+                sums[empty] = train[rng.choice(sample_num, int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    @classmethod
+    def build(cls, ids, vectors, nlist=0, n_iter=10, meta=None):
+        """Build an index from hash_ids and their embeddings
+        Args:
+            ids (array of int64): paper hash_ids
+            vectors (array of float32, [N, D]): the embeddings, normalized here
+            nlist (int): number of inverted lists, 0 means 4 * sqrt(N)
+        Returns:
+            IVFIndex
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize_rows(vectors)
+        if nlist <= 0:
+            nlist = int(4 * np.sqrt(len(ids)))
+        nlist = max(1, min(nlist, len(ids)))
+        centroids = cls._kmeans(vectors, nlist, n_iter=n_iter)
+        assign = cls._assign(vectors, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        meta = dict(meta or {})
+        meta.update({"num": int(len(ids)), "nlist": int(nlist), "dimension": int(vectors.shape[1])})
+        return cls(centroids, offsets, ids[order], vectors[order], meta)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "ids.npy"), self.ids)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf8") as f:
+            json.dump(self.meta, f, indent=4)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load an index saved by `save`, the vectors are memory-mapped by default
+        """
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf8") as f:
+            meta = json.load(f)
+        return cls(
+            np.load(os.path.join(path, "centroids.npy")),
+            np.load(os.path.join(path, "offsets.npy")),
+            np.load(os.path.join(path, "ids.npy")),
+            np.load(os.path.join(path, "vectors.npy"), mmap_mode=mmap_mode),
+            meta,
+        )
+
+    def search(self, embedding, k=1, nprobe=16, exact_threshold=20000):
+        """Retrieve top-k papers by cosine similarity (only scores > 0 are kept, in
+        descending order), the same contract as `PaperClient.cosine_similarity_search`
+        Args:
+            embedding: the query embedding, [D]
+            k: only return topk papers with highest similarities
+            nprobe: number of inverted lists to scan, the recall-vs-latency knob
+            exact_threshold: corpora smaller than this are always searched exactly
+        Returns:
+            related_paper (List of int): hash_id of retrieved papers
+        """
+        return self.search_many([embedding], k, nprobe, exact_threshold)[0]
+
+    def search_many(self, embeddings, k=1, nprobe=16, exact_threshold=20000):
+        """Batched version of `search`, one result list per query embedding
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        if len(self.ids) == 0:
+            return [[] for _ in queries]
+        if nprobe >= self.nlist or len(self.ids) <= exact_threshold:
+            scores = queries @ np.asarray(self.vectors).T
+            return [self._top_k(self.ids, score, k) for score in scores]
+        probe_lists = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        results = []
+        for query, lists in zip(queries, probe_lists):
+            rows = np.concatenate(
+                [np.arange(self.offsets[c], self.offsets[c + 1]) for c in lists]
+            )
+            score = np.asarray(self.vectors[rows]) @ query
+            results.append(self._top_k(self.ids[rows], score, k))
+        return results
+
+    @staticmethod
+    def _top_k(ids, score, k):
+        if len(score) > k:
+            top = np.argpartition(-score, k - 1)[:k]
+        else:
+            top = np.arange(len(score))
+        top = top[np.argsort(-score[top], kind="stable")]
+        top = top[score[top] > 0]
+        return [int(i) for i in ids[top]]
+
+
+class VectorIndexManager:
+    """Owns the on-disk IVF indexes of one `index_dir`, one sub-directory per
+    embedding property, and caches the loaded indexes
+    index_dir (str): `DEFAULT.index_dir`
+    get_watermark (callable): type_name -> watermark of the papers in the database, e.g.
+        `PaperClient.get_embedding_watermark`, None to use the indexes without checking
+    """
+
+    # a loaded index is compared with the database at most this often
+    WATERMARK_CHECK_SECONDS = 300
+
+    def __init__(self, index_dir, get_watermark=None):
+        self.index_dir = index_dir
+        self.get_watermark = get_watermark
+        self.indexes = {}
+        self.fresh = {}
+        self.checked_at = {}
+
+    def index_path(self, type_name):
+        return os.path.join(self.index_dir, "ann", type_name)
+
+    def exists(self, type_name):
+        return os.path.exists(os.path.join(self.index_path(type_name), "meta.json"))
+
+    def load(self, type_name):
+        if not self.exists(type_name):
+            return None
+        index = IVFIndex.load(self.index_path(type_name))
+        logger.info("load ann index {} ({} papers)".format(type_name, len(index)))
+        return index
+
+    def get(self, type_name):
+        """Return the loaded index of `type_name`, or None if it was never built or is stale
+        (its watermark differs from the database one, see `is_fresh`)
+        """
+        if type_name not in self.indexes:
+            self.indexes[type_name] = self.load(type_name)
+        if self.indexes[type_name] is None or self.get_watermark is None:
+            return self.indexes[type_name]
+        now = time.monotonic()
+        if now - self.checked_at.get(type_name, -np.inf) > self.WATERMARK_CHECK_SECONDS:
+            self.checked_at[type_name] = now
+            watermark = list(self.get_watermark(type_name))
+            if not self.is_fresh(type_name, watermark):
+                # a `build-index` run by another process may have refreshed the files
+                self.indexes[type_name] = self.load(type_name)
+            self.fresh[type_name] = self.is_fresh(type_name, watermark)
+            if not self.fresh[type_name]:
+                logger.warning(
+                    f"ann index {type_name} is stale (built for "
+                    f"{self.indexes[type_name].meta.get('watermark')} papers, database has "
+                    f"{watermark}), search the database until build-index is run"
+                )
+        return self.indexes[type_name] if self.fresh[type_name] else None
+
+    def is_fresh(self, type_name, watermark):
+        index = self.indexes.get(type_name)
+        return index is not None and index.meta.get("watermark") == watermark
+
+    def build(self, type_name, ids, vectors, nlist=0):
+        """Build and persist the index of `type_name` from hash_ids and their embeddings
+        (see `PaperClient.get_all_paper_embeddings`)
+        """
+        if len(ids) == 0:
+            logger.warning(f"no paper has {type_name}, skip building ann index")
+            return None
+        index = IVFIndex.build(
+            ids, vectors, nlist=nlist,
+            # the papers with the embedding, see `PaperClient.get_embedding_watermark`
+            meta={"type_name": type_name, "watermark": [int(len(ids))]},
+        )
+        index.save(self.index_path(type_name))
+        self.indexes[type_name] = index
+        self.fresh[type_name] = True
+        self.checked_at[type_name] = time.monotonic()
+        logger.info(
+            "build ann index {}: {} papers, {} lists".format(type_name, len(index), index.nlist)
+        )
+        return index